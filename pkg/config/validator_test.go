@@ -79,3 +79,22 @@ func TestValidatePythonVersionIsRequired(t *testing.T) {
 	require.Error(t, err)
 	require.Contains(t, err.Error(), "Additional property python_versions is not allowed")
 }
+
+func TestValidateConcurrency(t *testing.T) {
+	config := `build:
+  python_version: "3.8"
+predict: "predict.py:Predictor"
+concurrency: instance_per_thread`
+
+	err := Validate(config, "1.0")
+	require.NoError(t, err)
+
+	config = `build:
+  python_version: "3.8"
+predict: "predict.py:Predictor"
+concurrency: lots`
+
+	err = Validate(config, "1.0")
+	require.Error(t, err)
+	require.Contains(t, err.Error(), "concurrency")
+}
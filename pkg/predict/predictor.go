@@ -30,6 +30,13 @@ type Response struct {
 	Error  string       `json:"error"`
 }
 
+type HealthCheck struct {
+	Status string `json:"status"`
+	Setup  struct {
+		Logs []string `json:"logs"`
+	} `json:"setup"`
+}
+
 type ValidationErrorResponse struct {
 	Detail []struct {
 		Location []string `json:"loc"`
@@ -80,7 +87,7 @@ func (p *Predictor) Start(logsWriter io.Writer) error {
 }
 
 func (p *Predictor) waitForContainerReady() error {
-	url := fmt.Sprintf("http://localhost:%d/", p.port)
+	url := fmt.Sprintf("http://localhost:%d/health-check", p.port)
 
 	start := time.Now()
 	for {
@@ -103,6 +110,17 @@ func (p *Predictor) waitForContainerReady() error {
 		if err != nil {
 			continue
 		}
+		// the server answers while setup is running, so wait until it says
+		// it's ready
+		healthCheck := &HealthCheck{}
+		err = json.NewDecoder(resp.Body).Decode(healthCheck)
+		resp.Body.Close()
+		if err != nil {
+			continue
+		}
+		if healthCheck.Status == "setup_failed" {
+			return fmt.Errorf("Model setup failed:\n\n%s", strings.Join(healthCheck.Setup.Logs, "\n"))
+		}
 		if resp.StatusCode != http.StatusOK {
 			continue
 		}
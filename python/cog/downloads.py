@@ -0,0 +1,191 @@
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+import hashlib
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from typing_extensions import TypeGuard
+
+from .input_cache import get_input_cache
+
+CHUNK_SIZE = 64 * 1024
+
+# How many seconds each file can take to download, and all the files for a
+# prediction can take together
+DOWNLOAD_TIMEOUT_ENV = "COG_DOWNLOAD_TIMEOUT"
+DOWNLOAD_TOTAL_TIMEOUT_ENV = "COG_DOWNLOAD_TOTAL_TIMEOUT"
+DEFAULT_DOWNLOAD_TIMEOUT = 300.0
+DEFAULT_DOWNLOAD_TOTAL_TIMEOUT = 600.0
+
+# How many files are downloaded at once, across all predictions
+MAX_DOWNLOADS = 32
+
+# Shared by every download, so connections to the same host are reused
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_maxsize=MAX_DOWNLOADS))
+_session.mount("https://", HTTPAdapter(pool_maxsize=MAX_DOWNLOADS))
+_executor = ThreadPoolExecutor(
+    max_workers=MAX_DOWNLOADS, thread_name_prefix="cog-download"
+)
+
+
+class DownloadError(ValueError):
+    """
+    A file couldn't be downloaded. It's a ValueError so that pydantic reports
+    it as an error in the input that the file is for.
+    """
+
+
+def is_http_url(value: Any) -> "TypeGuard[str]":
+    return isinstance(value, str) and urlparse(value).scheme in ("http", "https")
+
+
+def download(url: str, suffix: str = "", deadline: Optional[float] = None) -> str:
+    """
+    Downloads a URL to a new temporary file whose name ends with `suffix`,
+    and returns its path, which the caller has to delete. If the input cache
+    is on, the file comes from there if it hasn't changed.
+
+    Raises DownloadError if it fails, or if it takes longer than
+    COG_DOWNLOAD_TIMEOUT seconds or goes past `deadline`, which is a
+    time.monotonic() time.
+    """
+    timeout_deadline = time.monotonic() + get_timeout(
+        DOWNLOAD_TIMEOUT_ENV, DEFAULT_DOWNLOAD_TIMEOUT
+    )
+    if deadline is None or timeout_deadline < deadline:
+        deadline = timeout_deadline
+    try:
+        return _download(url, suffix, deadline)
+    except requests.Timeout:
+        raise DownloadError(f"Timed out downloading {url}")
+    except requests.RequestException as e:
+        raise DownloadError(f"Failed to download {url}: {e}")
+
+
+def _download(url: str, suffix: str, deadline: float) -> str:
+    input_cache = get_input_cache()
+    entry = input_cache.read_entry(url) if input_cache is not None else None
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    with _get(url, headers, deadline) as resp:
+        if resp.status_code == 304 and entry is not None:
+            assert input_cache is not None
+            path = input_cache.copy(entry["digest"], suffix)
+            if path is not None:
+                return path
+        else:
+            resp.raise_for_status()
+            path, digest = _save(url, resp, suffix, deadline)
+            if input_cache is not None:
+                input_cache.add(
+                    path,
+                    digest,
+                    url,
+                    etag=resp.headers.get("ETag"),
+                    last_modified=resp.headers.get("Last-Modified"),
+                )
+            return path
+
+    # it was evicted from the cache while it was being revalidated
+    with _get(url, {}, deadline) as resp:
+        resp.raise_for_status()
+        path, digest = _save(url, resp, suffix, deadline)
+    return path
+
+
+def _get(url: str, headers: Dict[str, str], deadline: float) -> requests.Response:
+    # the timeout is for connecting and for each read, so _save() checks the
+    # deadline as well
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        raise requests.Timeout()
+    return _session.get(url, headers=headers, stream=True, timeout=timeout)
+
+
+def _save(
+    url: str, resp: requests.Response, suffix: str, deadline: float
+) -> Tuple[str, str]:
+    """
+    Writes the body of a response to a temporary file, and returns its path
+    and the SHA-256 of its contents.
+    """
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        try:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                if time.monotonic() > deadline:
+                    raise requests.Timeout()
+                digest.update(chunk)
+                f.write(chunk)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    return f.name, digest.hexdigest()
+
+
+class Download:
+    """
+    A file that's being downloaded in the background for a File or Path
+    input, which validates it once it's finished.
+    """
+
+    def __init__(self, url: str, suffix: str, deadline: float) -> None:
+        self.url = url
+        self.deadline = deadline
+        self.future: "Future[str]" = _executor.submit(download, url, suffix, deadline)
+
+    def result(self) -> str:
+        """
+        Waits for the file to download and returns its path, which the
+        caller has to delete. Raises DownloadError if it fails.
+        """
+        try:
+            return self.future.result(timeout=max(0, self.deadline - time.monotonic()))
+        except TimeoutError:
+            # it was waiting for a free thread, or it's stuck somewhere that
+            # doesn't check the deadline
+            self.cleanup()
+            raise DownloadError(f"Timed out downloading {self.url}")
+
+    def cleanup(self) -> None:
+        """
+        Stops the file being downloaded if it hasn't started yet, or deletes
+        it once it's been downloaded.
+        """
+        self.future.cancel()
+        self.future.add_done_callback(_delete_download)
+
+
+def _delete_download(future: "Future[str]") -> None:
+    if not future.cancelled() and future.exception() is None:
+        try:
+            os.unlink(future.result())
+        except FileNotFoundError:
+            # a File input has already deleted it
+            pass
+
+
+def download_deadline() -> float:
+    """
+    Returns the time.monotonic() time by which the files for a prediction
+    that starts downloading them now have to be downloaded.
+    """
+    return time.monotonic() + get_timeout(
+        DOWNLOAD_TOTAL_TIMEOUT_ENV, DEFAULT_DOWNLOAD_TOTAL_TIMEOUT
+    )
+
+
+def get_timeout(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
@@ -0,0 +1,217 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Configures the input cache in every process that validates inputs, like the
+# HTTP server, the Redis queue worker and the gRPC server
+CACHE_SIZE_ENV = "COG_INPUT_CACHE_SIZE"
+CACHE_DIR_ENV = "COG_INPUT_CACHE_DIR"
+
+# The ioctl that makes a copy-on-write clone of a file, on Linux filesystems
+# that support it, like Btrfs and XFS
+FICLONE = 0x40049409
+
+
+class InputCache:
+    """
+    A cache on disk of the files that inputs are downloaded from, so that a
+    file that's sent again and again by URL, like a reference image, is only
+    downloaded once. See cog.downloads.download().
+
+    It's keyed by URL, but files are stored by the SHA-256 of their contents,
+    so a file that's at several URLs is only stored once. Each time a URL is
+    used, the cached file is revalidated with the ETag or Last-Modified
+    header it was downloaded with, so a file that has changed is downloaded
+    again. Files that have neither header aren't cached.
+
+    Once the files take up more than `max_bytes`, the ones that were used
+    least recently are deleted. The cache is kept in `directory`, so
+    processes that share it share the files.
+
+    Files go in and out of the cache as copies, so a predictor that changes
+    an input file in place, even as root, can't change what's cached.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.files_dir = os.path.join(directory, "files")
+        self.urls_dir = os.path.join(directory, "urls")
+        os.makedirs(self.files_dir, exist_ok=True)
+        os.makedirs(self.urls_dir, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def add(
+        self,
+        path: str,
+        digest: str,
+        url: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """
+        Adds a file that was downloaded from `url`, whose contents have the
+        SHA-256 `digest`, to the cache, unless it can't be revalidated or
+        it's too big to fit.
+        """
+        if not etag and not last_modified:
+            return
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            return
+        cached_path = self.file_path(digest)
+        if not os.path.exists(cached_path):
+            # another process never uses one that's half written
+            temp_path = os.path.join(
+                self.files_dir,
+                f".{digest}.{os.getpid()}-{threading.get_ident()}.tmp",
+            )
+            copy_file(path, temp_path)
+            os.chmod(temp_path, 0o444)
+            os.replace(temp_path, cached_path)
+        self.write_entry(
+            url, {"digest": digest, "etag": etag, "last_modified": last_modified}
+        )
+        self.evict()
+
+    def copy(self, digest: str, suffix: str) -> Optional[str]:
+        """
+        Returns the path of a new temporary file that's a copy of a cached
+        file. Returns None if it isn't in the cache.
+        """
+        cached_path = self.file_path(digest)
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        try:
+            copy_file(cached_path, path)
+        except FileNotFoundError:
+            os.unlink(path)
+            return None
+        # so it's the last to be evicted
+        try:
+            os.utime(cached_path)
+        except OSError:
+            pass
+        return path
+
+    def evict(self) -> None:
+        """
+        Deletes the files that were used least recently until the rest fit
+        in `max_bytes`.
+        """
+        with self.lock:
+            files: List[Tuple[float, int, str]] = []
+            for entry in os.scandir(self.files_dir):
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.name))
+            total_bytes = sum(size for _, size, _ in files)
+            if total_bytes <= self.max_bytes:
+                return
+
+            evicted = set()
+            for _, size, digest in sorted(files):
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(self.file_path(digest))
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+                evicted.add(digest)
+
+            for entry in os.scandir(self.urls_dir):
+                url_entry = self.read_entry_file(entry.path)
+                if url_entry is not None and url_entry["digest"] in evicted:
+                    self.remove_entry_file(entry.path)
+
+    def read_entry(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns what's cached for a URL, or None if it isn't cached.
+        """
+        entry_path = self.entry_path(url)
+        entry = self.read_entry_file(entry_path)
+        if entry is None or entry.get("url") != url:
+            return None
+        if not os.path.exists(self.file_path(entry["digest"])):
+            self.remove_entry_file(entry_path)
+            return None
+        return entry
+
+    def write_entry(self, url: str, entry: Dict[str, Any]) -> None:
+        entry_path = self.entry_path(url)
+        # another process never reads one that's half written
+        temp_path = f"{entry_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(dict(entry, url=url), f)
+        os.replace(temp_path, entry_path)
+
+    def read_entry_file(self, path: str) -> Optional[Dict[str, Any]]:
+        if not path.endswith(".json"):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def remove_entry_file(self, path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def entry_path(self, url: str) -> str:
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.urls_dir, name + ".json")
+
+    def file_path(self, digest: str) -> str:
+        return os.path.join(self.files_dir, digest)
+
+
+def copy_file(src: str, dst: str) -> None:
+    """
+    Copies a file's contents to `dst`, which is created if it doesn't exist.
+    It's a copy-on-write clone if the filesystem can do that, which takes no
+    time or space however big the file is.
+    """
+    with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+        try:
+            fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+_input_cache: Optional[InputCache] = None
+_input_cache_lock = threading.Lock()
+
+
+def get_input_cache() -> Optional[InputCache]:
+    """
+    Returns the input cache, or None if it's turned off.
+
+    It's turned on by setting the COG_INPUT_CACHE_SIZE environment variable
+    to its size in megabytes. It's kept in COG_INPUT_CACHE_DIR, which
+    defaults to a directory in the temporary directory.
+    """
+    global _input_cache
+    size = os.environ.get(CACHE_SIZE_ENV)
+    if not size:
+        return None
+    with _input_cache_lock:
+        if _input_cache is None:
+            directory = os.environ.get(CACHE_DIR_ENV) or os.path.join(
+                tempfile.gettempdir(), "cog-input-cache"
+            )
+            _input_cache = InputCache(directory, int(size) * 1024 * 1024)
+        return _input_cache
@@ -1,5 +1,6 @@
 from enum import Enum
 import io
+import json
 from types import GeneratorType
 from typing import Any, Callable
 
@@ -14,6 +15,17 @@ try:
 except ImportError:
     has_numpy = False
 
+try:
+    import orjson  # type: ignore
+
+    has_orjson = True
+except ImportError:
+    has_orjson = False
+
+# Types that are already JSON-compatible, so encode_json() can return them
+# without checking them against everything else
+PRIMITIVE_TYPES = (str, int, float, bool, type(None))
+
 
 def make_encodeable(obj: Any) -> Any:
     """
@@ -57,3 +69,65 @@ def upload_files(obj: Any, upload_file: Callable[[io.IOBase], str]) -> Any:
     if isinstance(obj, io.IOBase):
         return upload_file(obj)
     return obj
+
+
+def encode_json(obj: Any, upload_file: Callable[[io.IOBase], str]) -> Any:
+    """
+    Returns a version of the object that can be serialised with dumps(). It does what make_encodeable() and then upload_files() do, in a single pass.
+
+    If orjson is installed, NumPy arrays are left as they are, because it serialises them much faster than it can serialise them as lists.
+    """
+    if type(obj) in PRIMITIVE_TYPES:
+        return obj
+    if isinstance(obj, BaseModel):
+        if obj.__custom_root_type__:
+            return encode_json(obj.__root__, upload_file)  # type: ignore
+        # like obj.dict(exclude_unset=True), without making a copy to encode
+        return {
+            name: encode_json(getattr(obj, name), upload_file)
+            for name in obj.__fields__
+            if name in obj.__fields_set__
+        }
+    if isinstance(obj, dict):
+        return {key: encode_json(value, upload_file) for key, value in obj.items()}
+    if isinstance(obj, (list, set, frozenset, GeneratorType, tuple)):
+        return [encode_json(value, upload_file) for value in obj]
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, Path):
+        with obj.open("rb") as f:
+            return upload_file(f)
+    if isinstance(obj, io.IOBase):
+        return upload_file(obj)
+    if has_numpy:
+        if isinstance(obj, np.integer):
+            return int(obj)
+        if isinstance(obj, np.floating):
+            return float(obj)
+        if isinstance(obj, np.ndarray):
+            if has_orjson and obj.dtype != object:
+                return obj
+            return encode_json(obj.tolist(), upload_file)
+    return obj
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serialises an object from encode_json() as JSON, with orjson if it's installed.
+    """
+    if has_orjson:
+        return orjson.dumps(
+            obj,
+            default=_encode_unsupported_array,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(
+        obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _encode_unsupported_array(obj: Any) -> Any:
+    # orjson only serialises contiguous arrays of some types itself
+    if has_numpy and isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -5,22 +5,28 @@ import importlib.util
 import inspect
 import os.path
 from pathlib import Path
-from pydantic import create_model, BaseModel, Field
+from pydantic import create_model, BaseModel, Field, ValidationError
 from pydantic.fields import FieldInfo
-from typing import Any, Callable, Dict, List, Type
+from pydantic.main import validate_model
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Type
 
 # Added in Python 3.8. Can be from typing if we drop support for <3.8.
 from typing_extensions import get_origin, get_args, Annotated
 import yaml
 
+from .downloads import Download, download_deadline, is_http_url
 from .errors import ConfigDoesNotExist, PredictorNotSet
-from .types import Input, Path as CogPath, File as CogFile
+from .types import Input, Path as CogPath, File as CogFile, get_filename
 
 
 ALLOWED_INPUT_TYPES = [str, int, float, bool, CogFile, CogPath]
 
 
 class BasePredictor(ABC):
+    # Set this to True if predict() always returns the same output for the
+    # same inputs, so Cog can cache outputs and reuse them for repeated inputs.
+    deterministic = False
+
     def setup(self) -> None:
         """
         An optional method to prepare the model so multiple predictions run efficiently.
@@ -46,6 +52,28 @@ def run_prediction(
     return result
 
 
+class Concurrency(str, enum.Enum):
+    """
+    How predictions can run at the same time, set with `concurrency` in
+    cog.yaml.
+    """
+
+    # predict() can be called from several threads at once on one instance
+    THREAD_SAFE = "thread_safe"
+    # each thread gets an instance of its own
+    INSTANCE_PER_THREAD = "instance_per_thread"
+    # each slot gets a subprocess with an instance of its own
+    PROCESS_PER_SLOT = "process_per_slot"
+
+
+def get_concurrency(config: Dict[str, Any]) -> Concurrency:
+    """
+    Returns the concurrency declared in a config. Predictors that don't
+    declare it are treated as thread safe, which is how they've always run.
+    """
+    return Concurrency(config.get("concurrency", Concurrency.THREAD_SAFE.value))
+
+
 # TODO: make config a TypedDict
 def load_config() -> Dict[str, Any]:
     """
@@ -93,17 +121,61 @@ class BaseInput(BaseModel):
         # But, after validation, we want to pass the actual value to predict(), not the enum object
         use_enum_values = True
 
+    # like BaseModel, so an input can be called `self`
+    def __init__(__pydantic_self__, **data: Any) -> None:
+        data, downloads = __pydantic_self__.start_downloads(data)
+        # validated the way BaseModel.__init__() does, so the inputs that
+        # were valid can be cleaned up if another one isn't
+        values, fields_set, error = validate_model(__pydantic_self__.__class__, data)
+        if error is not None:
+            # the files that other inputs downloaded or wrote aren't going to
+            # be used
+            for d in downloads:
+                d.cleanup()
+            delete_paths(values.values())
+            raise error
+        object.__setattr__(__pydantic_self__, "__dict__", values)
+        object.__setattr__(__pydantic_self__, "__fields_set__", fields_set)
+        __pydantic_self__._init_private_attributes()
+
+    @classmethod
+    def start_downloads(
+        cls, values: Dict[str, Any]
+    ) -> Tuple[Dict[str, Any], List[Download]]:
+        """
+        Starts downloading the files for all the File and Path inputs that are
+        URLs at once, because the fields are validated one at a time, and
+        each would otherwise be downloaded after the one before it.
+        """
+        deadline = download_deadline()
+        values = dict(values)
+        downloads = []
+        for field in cls.__fields__.values():
+            value = values.get(field.alias)
+            if (
+                inspect.isclass(field.type_)
+                and issubclass(field.type_, (CogFile, CogPath))
+                and is_http_url(value)
+            ):
+                values[field.alias] = Download(value, get_filename(value), deadline)
+                downloads.append(values[field.alias])
+        return values, downloads
+
     def cleanup(self) -> None:
         """
         Cleanup any temporary files created by the input.
         """
-        for _, value in self:
-            # Note this is pathlib.Path, which cog.Path is a subclass of. A pathlib.Path object shouldn't make its way here,
-            # but both have an unlink() method, so may as well be safe.
-            if isinstance(value, Path):
-                # This could be missing_ok=True when we drop support for Python 3.7
-                if value.exists():
-                    value.unlink()
+        delete_paths(value for _, value in self)
+
+
+def delete_paths(values: Iterable[Any]) -> None:
+    for value in values:
+        # Note this is pathlib.Path, which cog.Path is a subclass of. A pathlib.Path object shouldn't make its way here,
+        # but both have an unlink() method, so may as well be safe.
+        if isinstance(value, Path):
+            # This could be missing_ok=True when we drop support for Python 3.7
+            if value.exists():
+                value.unlink()
 
 
 def get_input_type(predictor: BasePredictor) -> Type[BaseInput]:
@@ -1,5 +1,5 @@
 import enum
-from typing import Optional, Type, Any
+from typing import List, Optional, Type, Any
 
 from pydantic import BaseModel, Field
 
@@ -22,3 +22,12 @@ def get_response_type(OutputType: Type[BaseModel]) -> Any:
             arbitrary_types_allowed = True
 
     return Response
+
+
+def get_batch_response_type(Response: Type[BaseModel]) -> Any:
+    class BatchResponse(BaseModel):
+        """The response body for a batch of predictions"""
+
+        predictions: List[Response] = Field(...)  # type: ignore
+
+    return BatchResponse
@@ -0,0 +1,102 @@
+import math
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .metrics import RollingWindow
+
+# How much each prediction moves the estimate of how long predictions take
+PREDICT_TIME_SMOOTHING = 0.2
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("Too many predictions waiting")
+        self.retry_after = retry_after
+
+
+class Admission:
+    """
+    Decides whether to accept predictions, so that when the server is
+    overloaded it turns them away straight away instead of letting them wait
+    until clients time out.
+
+    `slots` predictions run at once and at most `max_queue_depth` wait for a
+    slot. If `max_queue_depth` is None, any number can wait.
+    """
+
+    def __init__(self, slots: int, max_queue_depth: Optional[int] = None) -> None:
+        self.slots = slots
+        self.max_queue_depth = max_queue_depth
+        self.waiting = 0
+        self.running = 0
+        # exponentially weighted moving average of how long a prediction
+        # takes, once one has finished
+        self.predict_time: Optional[float] = None
+        self.queue_wait = RollingWindow()
+        self.rejected = RollingWindow()
+        self.lock = threading.Lock()
+
+    def admit(self) -> None:
+        """
+        Adds a prediction to the queue, or raises QueueFull if it's full.
+        """
+        with self.lock:
+            if (
+                self.max_queue_depth is not None
+                and self.running + self.waiting >= self.slots + self.max_queue_depth
+            ):
+                self.rejected.add(1)
+                raise QueueFull(self._retry_after())
+            self.waiting += 1
+
+    def cancel(self) -> None:
+        """
+        Removes a prediction from the queue without running it.
+        """
+        with self.lock:
+            self.waiting -= 1
+
+    def start(self, admitted_at: float) -> float:
+        """
+        Moves a prediction from the queue to a slot. Returns when it started.
+        """
+        started_at = time.time()
+        self.queue_wait.add(started_at - admitted_at, now=started_at)
+        with self.lock:
+            self.waiting -= 1
+            self.running += 1
+        return started_at
+
+    def finish(self, started_at: float) -> None:
+        predict_time = time.time() - started_at
+        with self.lock:
+            self.running -= 1
+            if self.predict_time is None:
+                self.predict_time = predict_time
+            else:
+                self.predict_time += PREDICT_TIME_SMOOTHING * (
+                    predict_time - self.predict_time
+                )
+
+    def _retry_after(self) -> int:
+        """
+        Estimates how many seconds it'll be until there's room in the queue.
+        """
+        predict_time = self.predict_time if self.predict_time is not None else 1.0
+        return max(1, math.ceil(predict_time * (self.waiting + 1) / self.slots))
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            waiting = self.waiting
+            running = self.running
+            predict_time = self.predict_time
+        return {
+            "queue_depth": waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "running": running,
+            "slots": self.slots,
+            "predict_time_seconds": predict_time,
+            "queue_wait_seconds": self.queue_wait.summary(),
+            "rejected_per_second": self.rejected.rate(),
+        }
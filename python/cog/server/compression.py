@@ -0,0 +1,210 @@
+import gzip
+from typing import Any, List, Optional, Tuple
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import zstandard  # type: ignore
+
+    has_zstd = True
+except ImportError:
+    has_zstd = False
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+# Smaller bodies aren't compressed, because it'd take longer than sending them
+# as they are
+MIN_COMPRESS_BYTES = 1024
+
+# Only these are compressed, because outputs sent as files, like images, are
+# usually compressed already
+COMPRESSIBLE_MEDIA_TYPES = [
+    "application/json",
+    "application/x-ndjson",
+    "text/",
+]
+
+
+def supported_encodings() -> List[str]:
+    """
+    The encodings that can be used, in order of preference.
+    """
+    if has_zstd:
+        return [ZSTD, GZIP]
+    return [GZIP]
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Picks the best encoding from an Accept-Encoding header (RFC 9110), or
+    returns None if the body should be sent as it is.
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    best: Tuple[float, Optional[str]] = (0.0, None)
+    for encoding in supported_encodings():
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best[0]:
+            best = (quality, encoding)
+    return best[1]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_body(
+    body: bytes, encoding: Optional[str], threshold: int = MIN_COMPRESS_BYTES
+) -> Tuple[bytes, Optional[str]]:
+    """
+    Compresses a body with `encoding` if it's at least `threshold` bytes.
+    Returns the body and the encoding it was compressed with, if it was.
+    """
+    if encoding is None or len(body) < threshold:
+        return body, None
+    return compress(body, encoding), encoding
+
+
+def check_encoding(encoding: str) -> None:
+    if encoding not in (GZIP, ZSTD):
+        raise ValueError(f"Unknown compression '{encoding}', use gzip or zstd")
+    if encoding == ZSTD and not has_zstd:
+        raise ValueError("zstd compression needs the zstandard package")
+
+
+class Compressor:
+    """
+    Compresses a body that's sent in chunks, flushing each chunk so it can be
+    decompressed as soon as it arrives.
+    """
+
+    def __init__(self, encoding: str) -> None:
+        self.compressobj: Any
+        if encoding == ZSTD:
+            self.compressobj = zstandard.ZstdCompressor().compressobj()
+            self.flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            # wbits=31 writes a gzip header and trailer
+            self.compressobj = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self.flush_mode = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        compressed = self.compressobj.compress(data)
+        if final:
+            return compressed + self.compressobj.flush()
+        return compressed + self.compressobj.flush(self.flush_mode)
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with gzip or zstd, if the client accepts it.
+
+    Like Starlette's GZipMiddleware, but it also supports zstd, leaves bodies
+    that probably don't compress alone, and flushes each chunk of a streamed
+    response so events aren't held back.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = MIN_COMPRESS_BYTES) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+            if encoding is not None:
+                responder = CompressionResponder(
+                    self.app, encoding, self.minimum_size
+                )
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int) -> None:
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Send = unattached_send
+        self.initial_message: Message = {}
+        self.started = False
+        self.compressor: Optional[Compressor] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # the headers can't be sent until we know whether the body will
+            # be compressed
+            self.initial_message = message
+            return
+        if message_type != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            if (
+                "content-encoding" in headers
+                or not is_compressible(headers.get("content-type"))
+                or (len(body) < self.minimum_size and not more_body)
+            ):
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+
+            self.compressor = Compressor(self.encoding)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            body = self.compressor.compress(body, final=not more_body)
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+            await self.send(self.initial_message)
+            await self.send(dict(message, body=body))
+            return
+
+        if self.compressor is not None:
+            body = self.compressor.compress(body, final=not more_body)
+            message = dict(message, body=body)
+        await self.send(message)
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    if content_type is None:
+        return False
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return any(
+        media_type == t or (t.endswith("/") and media_type.startswith(t))
+        for t in COMPRESSIBLE_MEDIA_TYPES
+    )
+
+
+async def unattached_send(message: Message) -> None:
+    raise RuntimeError("send awaitable not set")  # pragma: no cover
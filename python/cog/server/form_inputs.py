@@ -0,0 +1,155 @@
+import os
+import tempfile
+from typing import IO, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from multipart.multipart import MultipartParser, parse_options_header  # type: ignore
+from starlette.requests import Request as HTTPRequest
+from starlette.responses import Response
+from starlette.routing import request_response
+
+from ..types import Path
+
+FORM_DATA = "multipart/form-data"
+
+
+class FormDataError(Exception):
+    pass
+
+
+def is_form_data(content_type: Optional[str]) -> bool:
+    if content_type is None:
+        return False
+    media_type, _ = parse_options_header(content_type)
+    return media_type.decode("latin-1").lower() == FORM_DATA
+
+
+class FormReader:
+    """
+    Parses a multipart/form-data body (RFC 7578) as it's received.
+
+    Each file is written to a temporary file as it arrives, so it's never
+    held in memory. Other fields are read as strings.
+    """
+
+    def __init__(self) -> None:
+        self.fields: Dict[str, str] = {}
+        self.files: Dict[str, Path] = {}
+
+        self.headers: Dict[bytes, bytes] = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.name = ""
+        self.value = b""
+        self.file: Optional[IO[bytes]] = None
+
+    def parse(self, boundary: bytes) -> MultipartParser:
+        return MultipartParser(
+            boundary,
+            callbacks={
+                "on_part_begin": self.on_part_begin,
+                "on_header_field": self.on_header_field,
+                "on_header_value": self.on_header_value,
+                "on_header_end": self.on_header_end,
+                "on_headers_finished": self.on_headers_finished,
+                "on_part_data": self.on_part_data,
+                "on_part_end": self.on_part_end,
+            },
+        )
+
+    def on_part_begin(self) -> None:
+        self.headers = {}
+        self.value = b""
+        self.file = None
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        disposition, options = parse_options_header(
+            self.headers.get(b"content-disposition")
+        )
+        if disposition != b"form-data" or b"name" not in options:
+            raise FormDataError("Each part must have a form-data Content-Disposition")
+        self.name = options[b"name"].decode("utf-8")
+        if b"filename" in options:
+            # keep the name of the file, because predictors often look at its
+            # extension
+            filename = os.path.basename(options[b"filename"].decode("utf-8"))
+            self.file = tempfile.NamedTemporaryFile(suffix=filename, delete=False)
+            self.files[self.name] = Path(self.file.name)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.file is not None:
+            self.file.write(data[start:end])
+        else:
+            self.value += data[start:end]
+
+    def on_part_end(self) -> None:
+        if self.file is not None:
+            self.file.close()
+        else:
+            self.fields[self.name] = self.value.decode("utf-8")
+
+    def cleanup(self) -> None:
+        if self.file is not None:
+            self.file.close()
+        for path in self.files.values():
+            if path.exists():
+                path.unlink()
+
+
+async def read_form(request: HTTPRequest) -> Tuple[Dict[str, str], Dict[str, Path]]:
+    """
+    Reads a multipart/form-data request. Returns its fields, and its files as
+    paths to temporary files, which the caller has to delete.
+
+    Raises FormDataError if the body isn't valid.
+    """
+    _, options = parse_options_header(request.headers.get("content-type"))
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise FormDataError("The Content-Type has no boundary")
+
+    reader = FormReader()
+    try:
+        parser = reader.parse(boundary)
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except Exception as e:
+        reader.cleanup()
+        if isinstance(e, FormDataError):
+            raise
+        raise FormDataError(f"The form data isn't valid: {e}")
+    return reader.fields, reader.files
+
+
+def accept_form_data(
+    route: APIRoute,
+    handle_form: Callable[[HTTPRequest], Awaitable[Response]],
+    handle_json: Optional[Callable[[HTTPRequest], Awaitable[Response]]] = None,
+) -> None:
+    """
+    Makes a route pass multipart/form-data requests to `handle_form`, instead
+    of FastAPI reading the whole body into memory to validate it as JSON.
+    Other requests are passed to `handle_json`, or handled by FastAPI if it's
+    None.
+    """
+    if handle_json is None:
+        handle_json = route.get_route_handler()
+
+    async def handle(request: HTTPRequest) -> Response:
+        if is_form_data(request.headers.get("content-type")):
+            return await handle_form(request)
+        return await handle_json(request)
+
+    route.app = request_response(handle)
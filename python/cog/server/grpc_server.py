@@ -0,0 +1,442 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import queue
+import signal
+import tempfile
+import threading
+from types import FrameType
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import FastAPI, HTTPException
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory  # type: ignore
+import grpc  # type: ignore
+from pydantic import ValidationError
+
+from ..json import dumps, has_numpy
+from ..predictor import get_concurrency, load_config, load_predictor
+from ..types import Path
+from .http import create_app, describe_error
+from .listen import DEFAULT_HOST
+from .output_cleanup import OutputCleaner
+from .output_files import OCTET_STREAM, OutputFiles
+from .runner_pool import RunnerPool
+
+if has_numpy:
+    import numpy as np  # type: ignore
+
+logger = logging.getLogger("cog")
+
+DEFAULT_PORT = 50051
+SERVICE = "cog.Predictor"
+
+# Each call holds one of the server's threads while it waits for its
+# prediction, so when the queue isn't limited, this many can wait at once
+WAITING_THREADS = 100
+
+# How long predictions that are running get to finish when the server stops
+STOP_GRACE_SECONDS = 30
+
+# The messages are defined here rather than compiled by protoc, so they work
+# with whichever version of protobuf is installed. docs/grpc.md has the same
+# definitions as a .proto file, for clients.
+_FIELD = descriptor_pb2.FieldDescriptorProto
+_MESSAGES = {
+    "Blob": [
+        ("id", _FIELD.TYPE_STRING),
+        ("filename", _FIELD.TYPE_STRING),
+        ("content_type", _FIELD.TYPE_STRING),
+        ("data", _FIELD.TYPE_BYTES),
+        ("dtype", _FIELD.TYPE_STRING),
+        ("shape", _FIELD.TYPE_INT64, _FIELD.LABEL_REPEATED),
+    ],
+    "PredictRequest": [
+        ("id", _FIELD.TYPE_STRING),
+        ("input_json", _FIELD.TYPE_STRING),
+        ("files", "Blob", _FIELD.LABEL_REPEATED),
+    ],
+    "PredictResponse": [
+        ("id", _FIELD.TYPE_STRING),
+        ("status", _FIELD.TYPE_STRING),
+        ("output_json", _FIELD.TYPE_STRING),
+        ("error", _FIELD.TYPE_STRING),
+        ("blobs", "Blob", _FIELD.LABEL_REPEATED),
+    ],
+    "PredictEvent": [
+        ("id", _FIELD.TYPE_STRING),
+        ("event", _FIELD.TYPE_STRING),
+        ("data_json", _FIELD.TYPE_STRING),
+        ("blobs", "Blob", _FIELD.LABEL_REPEATED),
+    ],
+}
+
+
+def _make_message_classes() -> Dict[str, Any]:
+    file = descriptor_pb2.FileDescriptorProto(
+        name="cog/predictor.proto", package="cog", syntax="proto3"
+    )
+    for name, fields in _MESSAGES.items():
+        message = file.message_type.add(name=name)
+        for number, (field_name, field_type, *label) in enumerate(fields, 1):
+            field = message.field.add(
+                name=field_name,
+                number=number,
+                label=label[0] if label else _FIELD.LABEL_OPTIONAL,
+            )
+            if isinstance(field_type, str):
+                field.type = _FIELD.TYPE_MESSAGE
+                field.type_name = f".cog.{field_type}"
+            else:
+                field.type = field_type
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.AddSerializedFile(file.SerializeToString())
+    classes = {}
+    for name in _MESSAGES:
+        descriptor = pool.FindMessageTypeByName(f"cog.{name}")
+        if hasattr(message_factory, "GetMessageClass"):
+            classes[name] = message_factory.GetMessageClass(descriptor)
+        else:
+            # protobuf < 4
+            classes[name] = message_factory.MessageFactory(pool).GetPrototype(
+                descriptor
+            )
+    return classes
+
+
+_classes = _make_message_classes()
+Blob = _classes["Blob"]
+PredictRequest = _classes["PredictRequest"]
+PredictResponse = _classes["PredictResponse"]
+PredictEvent = _classes["PredictEvent"]
+
+
+class BlobEncoder:
+    """
+    Encodes a prediction's outputs as JSON, where each output file and NumPy
+    array is a `cid:` URL that references a blob that's sent with it, so
+    they don't have to be encoded as data URLs or lists of numbers.
+
+    Arrays can only be sent as blobs if orjson is installed, because
+    encode_json() converts them to lists otherwise.
+    """
+
+    def __init__(self, output_files: OutputFiles) -> None:
+        self.output_files = output_files
+        self.sent_files = 0
+        self.arrays = 0
+
+    def encode(self, output: Any) -> Tuple[str, List[Any]]:
+        """
+        Returns an encoded output as JSON, and the blobs for the arrays in it
+        and for the files that have been output since the last call.
+        """
+        blobs: List[Any] = []
+        output = self.extract_arrays(output, blobs)
+        for f in self.output_files.files[self.sent_files :]:
+            with open(f.path, "rb") as fh:
+                data = fh.read()
+            blobs.append(
+                Blob(
+                    id=quote(f.name),
+                    filename=f.name,
+                    content_type=f.content_type,
+                    data=data,
+                )
+            )
+        self.sent_files = len(self.output_files.files)
+        return dumps(output).decode("utf-8"), blobs
+
+    def extract_arrays(self, obj: Any, blobs: List[Any]) -> Any:
+        if isinstance(obj, dict):
+            return {
+                key: self.extract_arrays(value, blobs) for key, value in obj.items()
+            }
+        if isinstance(obj, list):
+            return [self.extract_arrays(value, blobs) for value in obj]
+        if has_numpy and isinstance(obj, np.ndarray):
+            blob_id = f"array-{self.arrays}"
+            self.arrays += 1
+            blobs.append(
+                Blob(
+                    id=blob_id,
+                    content_type=OCTET_STREAM,
+                    data=np.ascontiguousarray(obj).tobytes(),
+                    dtype=obj.dtype.str,
+                    shape=obj.shape,
+                )
+            )
+            return "cid:" + blob_id
+        return obj
+
+
+class PredictorServicer:
+    """
+    Runs predictions for gRPC calls with the prediction machinery of a Cog
+    HTTP app, so they're validated, queued and run exactly like HTTP
+    requests, and share the same queue.
+    """
+
+    def __init__(self, app: FastAPI) -> None:
+        self.app = app
+
+    def handler(self) -> Any:
+        return grpc.method_handlers_generic_handler(
+            SERVICE,
+            {
+                "Predict": grpc.unary_unary_rpc_method_handler(
+                    self.predict,
+                    request_deserializer=PredictRequest.FromString,
+                    response_serializer=PredictResponse.SerializeToString,
+                ),
+                "PredictStream": grpc.unary_stream_rpc_method_handler(
+                    self.predict_stream,
+                    request_deserializer=PredictRequest.FromString,
+                    response_serializer=PredictEvent.SerializeToString,
+                ),
+            },
+        )
+
+    def predict(self, message: Any, context: Any) -> Any:
+        """
+        Runs a prediction and responds with its output.
+        """
+        request = self.make_request(message, context)
+        output_files = OutputFiles(self.app.state.output_cleaner)
+        cancelled = threading.Event()
+        # called when the call ends, including when the client cancels it
+        context.add_callback(cancelled.set)
+        future = self.start(
+            context, request, upload=output_files.add, cancelled=cancelled
+        )
+        try:
+            try:
+                encoded_response = future.result()
+            except Exception as e:
+                abort(context, e)
+
+            response = PredictResponse(
+                id=message.id,
+                status=encoded_response["status"],
+                error=encoded_response.get("error") or "",
+            )
+            if "output" in encoded_response:
+                output_json, blobs = BlobEncoder(output_files).encode(
+                    encoded_response["output"]
+                )
+                response.output_json = output_json
+                response.blobs.extend(blobs)
+            return response
+        finally:
+            output_files.cleanup()
+
+    def predict_stream(self, message: Any, context: Any) -> Iterator[Any]:
+        """
+        Runs a prediction and streams an event for each output as soon as
+        it's produced, and each line it logs if it's running in a subprocess,
+        followed by a `done` event.
+        """
+        request = self.make_request(message, context)
+        output_files = OutputFiles(self.app.state.output_cleaner)
+        encoder = BlobEncoder(output_files)
+        cancelled = threading.Event()
+        context.add_callback(cancelled.set)
+        events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        future = self.start(
+            context,
+            request,
+            send_event=lambda event, data: events.put((event, data)),
+            upload=output_files.add,
+            cancelled=cancelled,
+        )
+        try:
+            while True:
+                event, data = events.get()
+                blobs: List[Any] = []
+                if event == "output":
+                    data_json, blobs = encoder.encode(data)
+                else:
+                    data_json = dumps(data).decode("utf-8")
+                yield PredictEvent(
+                    id=message.id, event=event, data_json=data_json, blobs=blobs
+                )
+                if event == "done":
+                    break
+        finally:
+            cancelled.set()
+            # once the prediction has stopped writing them
+            future.add_done_callback(lambda _: output_files.cleanup())
+
+    def make_request(self, message: Any, context: Any) -> Any:
+        try:
+            inputs = json.loads(message.input_json or "{}")
+        except ValueError as e:
+            context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT, f"input_json isn't valid JSON: {e}"
+            )
+        if not isinstance(inputs, dict):
+            context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT, "input_json must be a JSON object"
+            )
+
+        files: Dict[str, Path] = {}
+        for blob in message.files:
+            # keep the name of the file, because predictors often look at its
+            # extension
+            with tempfile.NamedTemporaryFile(
+                suffix=os.path.basename(blob.filename), delete=False
+            ) as f:
+                f.write(blob.data)
+            files[blob.id] = Path(f.name)
+
+        try:
+            return self.app.state.make_request(inputs, files, id=message.id or None)
+        except ValidationError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    def start(self, context: Any, request: Any, **kwargs: Any) -> Any:
+        try:
+            return self.app.state.start_prediction(request, **kwargs)
+        except HTTPException as e:
+            if request.input is not None:
+                request.input.cleanup()
+            abort(context, e)
+
+
+def abort(context: Any, e: Exception) -> None:
+    """
+    Ends a call with the gRPC status that matches an error.
+    """
+    code = grpc.StatusCode.INTERNAL
+    if isinstance(e, HTTPException) and e.status_code == 503:
+        # the queue is full, or setup failed
+        code = grpc.StatusCode.UNAVAILABLE
+    context.abort(code, describe_error(e))
+
+
+def make_server(
+    app: FastAPI,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    max_workers: int = WAITING_THREADS,
+) -> Tuple[Any, int]:
+    """
+    Makes a gRPC server that runs predictions with `app`, and returns it with
+    the port it's bound to, which is a free one if `port` is 0.
+    """
+    server = grpc.server(
+        ThreadPoolExecutor(max_workers=max_workers),
+        # files can be any size, like they can over HTTP
+        options=[
+            ("grpc.max_receive_message_length", -1),
+            ("grpc.max_send_message_length", -1),
+        ],
+    )
+    server.add_generic_rpc_handlers((PredictorServicer(app).handler(),))
+    address = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+    bound_port = server.add_insecure_port(address)
+    return server, bound_port
+
+
+def serve_grpc(
+    app: FastAPI,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    max_workers: int = WAITING_THREADS,
+) -> None:
+    """
+    Serves predictions with `app` over gRPC until SIGINT or SIGTERM.
+    Predictions wait for setup, which runs in the background.
+    """
+    server, bound_port = make_server(app, host, port, max_workers)
+    app.state.start_setup()
+    server.start()
+    logger.info(f"Listening for gRPC on {host}:{bound_port}")
+
+    def stop(signum: int, frame: Optional[FrameType]) -> None:
+        server.stop(STOP_GRACE_SECONDS)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    server.wait_for_termination()
+    app.state.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cog gRPC server")
+    parser.add_argument(
+        "--host",
+        dest="host",
+        default=DEFAULT_HOST,
+        help="Address to listen on.",
+    )
+    parser.add_argument(
+        "--port",
+        dest="port",
+        type=int,
+        default=DEFAULT_PORT,
+        help="Port to listen on.",
+    )
+    parser.add_argument(
+        "--threads",
+        dest="threads",
+        type=int,
+        default=None,
+        help="Number of predictions to run at once. Defaults to number of CPUs, or 1 if using a GPU.",
+    )
+    parser.add_argument(
+        "--runner",
+        dest="runner",
+        action="store_true",
+        help="Run predictions in subprocesses, one for each thread, so they can time out, stream logs and crash without taking the server down.",
+    )
+    parser.add_argument(
+        "--predict-timeout",
+        dest="predict_timeout",
+        type=int,
+        default=None,
+        help="Fail predictions that take longer than this many seconds. Implies --runner.",
+    )
+    parser.add_argument(
+        "--max-queue-depth",
+        dest="max_queue_depth",
+        type=int,
+        default=None,
+        help="Fail predictions with UNAVAILABLE when this many are already waiting to run.",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get("COG_LOG_LEVEL", "info").upper())
+
+    config = load_config()
+
+    threads = args.threads
+    if threads is None:
+        if config.get("build", {}).get("gpu", False):
+            threads = 1
+        else:
+            threads = os.cpu_count()
+
+    predictor = load_predictor(config)
+    app = create_app(
+        predictor,
+        threads=threads,
+        runner_pool=(
+            RunnerPool(size=threads, predict_timeout=args.predict_timeout)
+            if args.runner or args.predict_timeout is not None
+            else None
+        ),
+        max_queue_depth=args.max_queue_depth,
+        concurrency=get_concurrency(config),
+        output_cleaner=OutputCleaner(),
+    )
+    # enough for every prediction that can wait in the queue, and one more,
+    # so the one after that is turned away instead of waiting for a thread
+    max_workers = threads + (
+        args.max_queue_depth + 1
+        if args.max_queue_depth is not None
+        else WAITING_THREADS
+    )
+    serve_grpc(app, host=args.host, port=args.port, max_workers=max_workers)
@@ -0,0 +1,144 @@
+from collections import deque
+import contextlib
+import enum
+import io
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Callable, Deque, Dict, Optional
+
+# setup that logs a lot, like download progress, only keeps its last lines
+MAX_SETUP_LOG_LINES = 1000
+
+
+class Health(str, enum.Enum):
+    STARTING = "starting"
+    READY = "ready"
+    SETUP_FAILED = "setup_failed"
+
+
+class SetupFailed(Exception):
+    pass
+
+
+class Setup:
+    """
+    Runs the predictor's setup in the background, so the server can answer
+    health checks while it runs, and keeps track of how it went.
+    """
+
+    def __init__(self) -> None:
+        self.health = Health.STARTING
+        self.started_at: Optional[float] = None
+        self.completed_at: Optional[float] = None
+        self.logs: Deque[str] = deque(maxlen=MAX_SETUP_LOG_LINES)
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self, setup: Callable[[], None]) -> None:
+        self.started_at = time.time()
+        thread = threading.Thread(target=self.run, args=(setup,), daemon=True)
+        thread.start()
+
+    def run(self, setup: Callable[[], None]) -> None:
+        """
+        Runs setup in this thread, and blocks until it has finished.
+        """
+        if self.started_at is None:
+            self.started_at = time.time()
+        health = Health.READY
+        try:
+            with capture_output(self.append_log):
+                setup()
+        except Exception:
+            for line in traceback.format_exc().splitlines():
+                self.append_log(line)
+            health = Health.SETUP_FAILED
+        with self.lock:
+            self.health = health
+            self.completed_at = time.time()
+        self.done.set()
+
+    def append_log(self, line: str) -> None:
+        with self.lock:
+            self.logs.append(line)
+
+    def wait(self) -> None:
+        """
+        Blocks until setup has finished. Raises SetupFailed if it failed.
+        """
+        self.done.wait()
+        if self.health == Health.SETUP_FAILED:
+            raise SetupFailed("Setup failed")
+
+    def state(self) -> Dict[str, Any]:
+        with self.lock:
+            duration = None
+            if self.started_at is not None:
+                duration = (self.completed_at or time.time()) - self.started_at
+            return {
+                "status": self.health.value,
+                "setup": {
+                    "duration_seconds": duration,
+                    "logs": list(self.logs),
+                },
+            }
+
+
+class LineTee(io.TextIOBase):
+    """
+    Passes writes through to a stream, and each complete line written by the
+    thread with the ident `thread` to `on_line`, until it's closed.
+    """
+
+    def __init__(
+        self, stream: Any, on_line: Callable[[str], None], thread: int
+    ) -> None:
+        self.stream = stream
+        self.on_line = on_line
+        self.thread = thread
+        self.capturing = True
+        self.buffer = ""
+
+    def write(self, s: str) -> int:
+        self.stream.write(s)
+        if not self.capturing or threading.get_ident() != self.thread:
+            return len(s)
+        self.buffer += s
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            self.on_line(line)
+        return len(s)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def close_buffer(self) -> None:
+        # it can still be written to by whatever kept a reference to it
+        self.capturing = False
+        if self.buffer:
+            self.on_line(self.buffer)
+            self.buffer = ""
+
+
+@contextlib.contextmanager
+def capture_output(on_line: Callable[[str], None]) -> Any:
+    """
+    Passes each line that this thread writes to sys.stdout and sys.stderr to
+    `on_line`, as well as writing it out. sys.stdout and sys.stderr are
+    replaced for the whole process, so output from other threads, like the
+    server's, is written out without being captured.
+
+    Only output written from Python is captured, not output from
+    subprocesses, native code or threads that this one starts.
+    """
+    thread = threading.get_ident()
+    stdout = LineTee(sys.stdout, on_line, thread)
+    stderr = LineTee(sys.stderr, on_line, thread)
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            yield
+    finally:
+        stdout.close_buffer()
+        stderr.close_buffer()
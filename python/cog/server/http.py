@@ -1,45 +1,214 @@
 from anyio import CapacityLimiter
 from anyio.lowlevel import RunVar
 import argparse
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextlib
+import datetime
+import inspect
+import io
+import json
 import logging
 import os
+import queue
+import threading
+import time
 import types
-from typing import Any, Optional
-
-from fastapi import Body, FastAPI, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, ValidationError
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+)
+import uuid
 
-# https://github.com/encode/uvicorn/issues/998
-import uvicorn  # type: ignore
+from fastapi import (
+    Body,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, Field, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import MissingError
+import redis
+import requests
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request as HTTPRequest
+from starlette.responses import Response as HTTPResponse
+from starlette.routing import request_response
 
 
 from ..files import upload_file
-from ..json import make_encodeable, upload_files
+from ..json import dumps, encode_json
+from ..types import File, Path
 from ..predictor import (
     BasePredictor,
+    Concurrency,
+    get_concurrency,
     get_input_type,
     get_output_type,
     load_config,
     load_predictor,
 )
-from ..response import Status, get_response_type
+from ..response import Status, get_batch_response_type, get_response_type
+from .admission import Admission, QueueFull
+from .compression import CompressionMiddleware
+from .health import Health, Setup, SetupFailed
+from .form_inputs import FormDataError, accept_form_data, read_form
+from .metrics import Counter, Histogram, format_prometheus
+from .output_cleanup import DiskQuotaExceeded, OutputCleaner, find_output_files
+from .output_files import MULTIPART_MIXED, OCTET_STREAM, OutputFiles, multipart_body
+from .prediction_store import PredictionStore
+from .listen import DEFAULT_HOST, DEFAULT_PORT, serve
+from .prefork import serve_prefork
+from .result_cache import ResultCache, make_result_cache
+from .runner_pool import PredictionCancelled, PredictionError, RunnerPool
+from .single_flight import SingleFlight
 
 logger = logging.getLogger("cog")
 
 
-def create_app(predictor: BasePredictor, threads: int = 1) -> FastAPI:
+class FastJSONResponse(JSONResponse):
+    """
+    A JSON response serialised with cog.json.dumps(), which is faster than
+    json.dumps() and can serialise NumPy arrays without converting them.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+EVENT_STREAM = "text/event-stream"
+NDJSON = "application/x-ndjson"
+
+# What nginx logs for a request that the client closed before it was
+# answered. Nothing receives it, but it shows up in the access log.
+CLIENT_CLOSED_REQUEST = 499
+
+# Webhooks are sent by a few threads of their own, so a slow webhook doesn't
+# hold up a slot that a prediction could run in
+WEBHOOK_THREADS = 4
+WEBHOOK_TIMEOUT_SECONDS = 10
+
+
+def create_app(
+    predictor: BasePredictor,
+    threads: int = 1,
+    result_cache: Optional[ResultCache] = None,
+    prediction_store_size: int = 1000,
+    runner_pool: Optional[RunnerPool] = None,
+    max_queue_depth: Optional[int] = None,
+    concurrency: Concurrency = Concurrency.THREAD_SAFE,
+    output_cleaner: Optional[OutputCleaner] = None,
+) -> FastAPI:
+    """
+    If `runner_pool` is set, predictions run in its subprocesses instead of
+    calling `predictor` directly, which is then only used for its types.
+
+    At most `threads` predictions run at once. If `max_queue_depth` is set,
+    predictions that arrive when that many are already waiting are turned
+    away with a 503.
+
+    `concurrency` decides what runs those predictions: `predictor` itself in
+    every thread, an instance of the predictor's class for each thread, or a
+    subprocess for each thread.
+
+    Output files in the temporary directory are deleted by `output_cleaner`
+    once they've been uploaded or sent.
+    """
+    if concurrency == Concurrency.PROCESS_PER_SLOT and runner_pool is None:
+        runner_pool = RunnerPool(size=threads)
+
+    if output_cleaner is None:
+        output_cleaner = OutputCleaner()
+    if result_cache is None:
+        # only does anything if the predictor is deterministic
+        result_cache = make_result_cache(predictor)
+    single_flight = SingleFlight() if predictor.deterministic else None
+    is_generator = inspect.isgeneratorfunction(predictor.predict)
+    returns_file = inspect.signature(predictor.predict).return_annotation in (
+        File,
+        Path,
+    )
+
+    if concurrency == Concurrency.INSTANCE_PER_THREAD and runner_pool is None:
+        instances = [predictor] + [type(predictor)() for _ in range(threads - 1)]
+    else:
+        instances = [predictor] * threads
+    # A prediction takes a predictor from here while it runs. Every
+    # prediction also runs in the executor, so that's the queue for all of
+    # them, whether they're synchronous, asynchronous or streamed, but this
+    # also limits how many run at once if they're run some other way.
+    idle_predictors: "queue.Queue[BasePredictor]" = queue.Queue()
+    for instance in instances:
+        idle_predictors.put(instance)
+
+    executor = ThreadPoolExecutor(max_workers=threads)
+    webhook_executor = ThreadPoolExecutor(
+        max_workers=WEBHOOK_THREADS, thread_name_prefix="cog-webhook"
+    )
+    admission = Admission(slots=threads, max_queue_depth=max_queue_depth)
+    prediction_store = PredictionStore(max_size=prediction_store_size)
+    setup = Setup()
+    predictions_total = Counter(label="status")
+    prediction_duration = Histogram()
+    stage_duration = Histogram(label="stage")
+
     app = FastAPI(
         title="Cog",  # TODO: mention model name?
         # version=None # TODO
     )
+    # large outputs, like embeddings, are compressed if the client accepts it
+    app.add_middleware(CompressionMiddleware)
 
     @app.on_event("startup")
     def startup() -> None:
         # https://github.com/tiangolo/fastapi/issues/4221
         RunVar("_default_thread_limiter").set(CapacityLimiter(threads))  # type: ignore
 
-        predictor.setup()
+        # in the background, so health checks can be answered while it runs,
+        # unless it was run before the server started
+        if setup.started_at is None:
+            setup.start(setup_predictors)
+
+    def setup_predictors() -> None:
+        if runner_pool is not None:
+            runner_pool.setup()
+        else:
+            # each instance once, even if it's shared between threads
+            for instance in {id(i): i for i in instances}.values():
+                instance.setup()
+
+    # lets serve_prefork() run setup before it forks the workers
+    app.state.run_setup = lambda: setup.run(setup_predictors)
+    app.state.runner_pool = runner_pool
+    # set by serve_prefork(). Each worker has its own asynchronous predictions
+    # and metrics, so they can't be served by more than one.
+    app.state.workers = 1
+
+    @app.on_event("shutdown")
+    def shutdown() -> None:
+        if runner_pool is not None:
+            runner_pool.close()
+        output_cleaner.close()
 
     @app.get("/")
     def root() -> Any:
@@ -54,34 +223,942 @@ def create_app(predictor: BasePredictor, threads: int = 1) -> FastAPI:
     class Request(BaseModel):
         """The request body for a prediction"""
 
+        id: Optional[str] = None
         input: Optional[InputType] = None  # type: ignore
         output_file_prefix: Optional[str] = None
+        webhook: Optional[str] = None
 
     # response_model is purely for generating schema.
     # We generate Response again in the request so we can set file output paths correctly, etc.
     OutputType = get_output_type(predictor)
     Response = get_response_type(OutputType)
 
+    class BatchRequest(BaseModel):
+        """The request body for a batch of predictions"""
+
+        inputs: List[InputType] = Field(...)  # type: ignore
+        output_file_prefix: Optional[str] = None
+
+    class UnvalidatedBatchRequest(BaseModel):
+        inputs: List[Dict[str, Any]]
+        output_file_prefix: Optional[str] = None
+
+    BatchResponse = get_batch_response_type(Response)
+
     @app.post(
         "/predictions",
-        response_model=get_response_type(OutputType),
+        response_model=Response,
         response_model_exclude_unset=True,
     )
 
     # The signature of this function is used by FastAPI to generate the schema.
     # The function body is not used to generate the schema.
-    def predict(request: Request = Body(default=None)) -> Any:
+    async def predict(
+        http_request: HTTPRequest,
+        request: Request = Body(default=None),
+        prefer: Optional[str] = Header(None),
+        accept: Optional[str] = Header(None),
+        # dependencies are solved before the body is validated, so this is
+        # before inputs are validated and downloaded
+        received_at: float = Depends(current_time),
+    ) -> Any:
         """
         Run a single prediction on the model
         """
+        stage_duration.observe(time.time() - received_at, "input")
+        if prefers_async(prefer):
+            return start_async_prediction(request)
+
+        media_type = accepted_media_type(
+            accept, [EVENT_STREAM, NDJSON, MULTIPART_MIXED, OCTET_STREAM]
+        )
+        if media_type in (EVENT_STREAM, NDJSON):
+            return start_streaming_prediction(request, media_type)  # type: ignore
+        if media_type in (MULTIPART_MIXED, OCTET_STREAM):
+            return await respond_with_files(
+                http_request, request, media_type  # type: ignore
+            )
+
+        cancelled = threading.Event()
+        admitted_at = admit()
+        encoded_response = await wait_for_prediction(
+            http_request,
+            submit_prediction(
+                admitted_at, handle_request, request, cancelled=cancelled
+            ),
+            cancelled,
+        )
+        if encoded_response is None:
+            return HTTPResponse(status_code=CLIENT_CLOSED_REQUEST)
+        status_code = 500 if encoded_response["status"] == Status.FAILED.value else 200
+        with time_stage("serialisation"):
+            return FastJSONResponse(content=encoded_response, status_code=status_code)
+
+    async def predict_form(http_request: HTTPRequest) -> Any:
+        """
+        Runs a prediction whose inputs are the fields of a multipart/form-data
+        request, with the files that are uploaded bound to File and Path
+        inputs, so they don't have to be encoded as data URLs.
+        """
+        received_at = time.time()
         try:
-            if request is not None and request.input is not None:
-                output = predictor.predict(**request.input.dict())
+            fields, files = await read_form(http_request)
+        except FormDataError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        try:
+            # in a thread, because inputs that are URLs are downloaded
+            request = await run_in_threadpool(make_request, fields, files)
+        except ValidationError as e:
+            raise RequestValidationError(e.raw_errors)
+        return await predict(
+            http_request,
+            request,
+            prefer=http_request.headers.get("prefer"),
+            accept=http_request.headers.get("accept"),
+            received_at=received_at,
+        )
+
+    async def predict_json(http_request: HTTPRequest) -> Any:
+        """
+        Runs a prediction whose request is JSON. It's validated in a thread,
+        rather than by FastAPI, because inputs that are URLs are downloaded
+        while they're validated, and that would block the event loop.
+        """
+        received_at = time.time()
+        body = await read_json(http_request)
+        request = None
+        if body is not None:
+            try:
+                request = await run_in_threadpool(Request.parse_obj, body)
+            except ValidationError as e:
+                raise RequestValidationError([ErrorWrapper(e, ("body",))])
+        return await predict(
+            http_request,
+            request,  # type: ignore
+            prefer=http_request.headers.get("prefer"),
+            accept=http_request.headers.get("accept"),
+            received_at=received_at,
+        )
+
+    def make_request(
+        inputs: Dict[str, Any], files: Dict[str, Path], **fields: Any
+    ) -> Request:
+        """
+        Makes a request for `inputs`, with `files`, which are temporary files,
+        bound to the File and Path inputs they're named after. The files are
+        deleted once the prediction has finished with them.
+
+        Raises ValidationError if the request isn't valid.
+        """
+        inputs = dict(inputs)
+        for name, path in files.items():
+            field = InputType.__fields__.get(name)
+            if field is None:
+                path.unlink()
+            elif inspect.isclass(field.type_) and issubclass(field.type_, File):
+                # the open file keeps its contents after it's deleted
+                inputs[name] = open(path, "rb")
+                path.unlink()
             else:
-                output = predictor.predict()
+                # deleted by the input's cleanup() after the prediction
+                inputs[name] = path
+
+        try:
+            return Request(input=inputs, **fields)
+        except ValidationError:
+            for path in files.values():
+                if path.exists():
+                    path.unlink()
+            raise
+
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.path == "/predictions":
+            accept_form_data(route, predict_form, predict_json)
+
+    @app.post(
+        "/predictions/batch",
+        response_model=BatchResponse,
+        response_model_exclude_unset=True,
+    )
+    # Requests are handled by predict_batch_json(), which validates each
+    # input on its own. This signature is used to generate the schema.
+    async def predict_batch(
+        http_request: HTTPRequest,
+        batch: BatchRequest = Body(...),
+        accept: Optional[str] = Header(None),
+        received_at: float = Depends(current_time),
+    ) -> Any:
+        """
+        Run a prediction for each of a batch of inputs
+        """
+        item_requests = [
+            Request(input=inputs, output_file_prefix=batch.output_file_prefix)
+            for inputs in batch.inputs
+        ]
+        return await run_batch(http_request, item_requests, accept, received_at)
+
+    async def predict_batch_json(http_request: HTTPRequest) -> Any:
+        received_at = time.time()
+        body = await read_json(http_request)
+        # in a thread, because inputs that are URLs are downloaded
+        item_requests = await run_in_threadpool(make_batch_requests, body)
+        return await run_batch(
+            http_request,
+            item_requests,
+            http_request.headers.get("accept"),
+            received_at,
+        )
+
+    def make_batch_requests(body: Any) -> List[Request]:
+        """
+        Makes a request for each of the inputs in a batch. The files for all
+        of them are downloaded at once, rather than one input after another.
+        If one of them isn't valid, all the files are deleted, because the
+        batch isn't going to be run.
+
+        Raises RequestValidationError if an input isn't valid.
+        """
+        if body is None:
+            raise RequestValidationError([ErrorWrapper(MissingError(), ("body",))])
+        try:
+            batch = UnvalidatedBatchRequest.parse_obj(body)
+        except ValidationError as e:
+            raise RequestValidationError([ErrorWrapper(e, ("body",))])
+
+        started = [InputType.start_downloads(inputs) for inputs in batch.inputs]
+        input_objs = []
+        for i, (inputs, _) in enumerate(started):
+            try:
+                input_objs.append(InputType(**inputs))
+            except ValidationError as e:
+                for input_obj in input_objs:
+                    input_obj.cleanup()
+                for _, downloads in started[i:]:
+                    for d in downloads:
+                        d.cleanup()
+                raise RequestValidationError([ErrorWrapper(e, ("body", "inputs", i))])
+        return [
+            Request(input=input_obj, output_file_prefix=batch.output_file_prefix)
+            for input_obj in input_objs
+        ]
+
+    async def run_batch(
+        http_request: HTTPRequest,
+        item_requests: List[Request],
+        accept: Optional[str],
+        received_at: float,
+    ) -> Any:
+        stage_duration.observe(time.time() - received_at, "input")
+        cancelled = threading.Event()
+        admitted_at = admit(len(item_requests))
+        # they run in any free slots, in the order they're in the batch
+        futures = [
+            submit_prediction(
+                admitted_at, handle_batch_item, request, cancelled=cancelled
+            )
+            for request in item_requests
+        ]
+
+        media_type = accepted_media_type(accept, [EVENT_STREAM, NDJSON])
+        if media_type is not None:
+            return stream_batch(futures, media_type, cancelled)
+
+        predictions = await wait_for_prediction(
+            http_request,
+            asyncio.gather(*(asyncio.wrap_future(future) for future in futures)),
+            cancelled,
+        )
+        if predictions is None:
+            return HTTPResponse(status_code=CLIENT_CLOSED_REQUEST)
+        with time_stage("serialisation"):
+            return FastJSONResponse(content={"predictions": predictions})
+
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.path == "/predictions/batch":
+            route.app = request_response(predict_batch_json)
+
+    def stream_batch(
+        futures: "List[Future[Dict[str, Any]]]",
+        media_type: str,
+        cancelled: threading.Event,
+    ) -> StreamingResponse:
+        """
+        Streams a `prediction` event with the response for each prediction in
+        a batch as soon as it finishes, with its `index` in the batch,
+        followed by a `done` event.
+
+        If the client disconnects, the predictions that haven't finished are
+        cancelled.
+        """
+
+        async def wait(index: int, future: "Future[Dict[str, Any]]") -> Any:
+            prediction: Dict[str, Any] = await asyncio.wrap_future(future)
+            return {"index": index, **prediction}
+
+        async def stream() -> AsyncIterator[str]:
+            waiting = [wait(i, future) for i, future in enumerate(futures)]
+            try:
+                for finished in asyncio.as_completed(waiting):
+                    prediction = await finished
+                    with time_stage("serialisation"):
+                        chunk = format_event("prediction", prediction, media_type)
+                    yield chunk
+            finally:
+                # the stream is closed early if the client disconnects
+                cancelled.set()
+            yield format_event("done", {}, media_type)
+
+        return StreamingResponse(stream(), media_type=media_type)
+
+    def handle_batch_item(
+        request: Request, cancelled: threading.Event
+    ) -> Dict[str, Any]:
+        # a prediction that fails doesn't fail the rest of the batch
+        try:
+            return handle_request(request, cancelled=cancelled)
+        except Exception as e:
+            return {"status": Status.FAILED.value, "error": describe_error(e)}
+
+    @app.get("/predictions/{prediction_id}")
+    async def get_prediction(prediction_id: str) -> Any:
+        """
+        Get the state of a prediction that was started asynchronously
+        """
+        prediction = prediction_store.get(prediction_id)
+        if prediction is None:
+            raise HTTPException(status_code=404, detail="Prediction not found")
+        return FastJSONResponse(content=prediction)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics() -> Any:
+        if app.state.workers > 1:
+            # the counters would jump between the workers' own
+            raise HTTPException(
+                status_code=404,
+                detail="Metrics aren't available with more than one worker",
+            )
+        setup_state = setup.state()
+        return PlainTextResponse(
+            format_prometheus(
+                {
+                    **admission.metrics(),
+                    "predictions_total": predictions_total,
+                    "prediction_duration_seconds": prediction_duration,
+                    "stage_duration_seconds": stage_duration,
+                    "ready": int(setup_state["status"] == Health.READY.value),
+                    "setup_duration_seconds": setup_state["setup"]["duration_seconds"],
+                    "output_files_bytes": output_cleaner.usage(),
+                }
+            ),
+            media_type="text/plain; version=0.0.4",
+        )
+
+    @app.get("/health-check", include_in_schema=False)
+    async def health_check() -> Any:
+        """
+        Check whether the model has finished setup and can run predictions
+        """
+        state = setup.state()
+        status_code = 200 if state["status"] == Health.READY.value else 503
+        return JSONResponse(content=state, status_code=status_code)
+
+    @app.websocket("/predictions/ws")
+    async def predict_websocket(websocket: WebSocket) -> None:
+        """
+        Runs predictions for the messages a client sends over a WebSocket,
+        and streams their events back, so one connection can be used for any
+        number of predictions, including several at once.
+        """
+        await websocket.accept()
+        loop = asyncio.get_event_loop()
+        outgoing: asyncio.Queue = asyncio.Queue()
+        # the cancellation events of the predictions that are running
+        running: Dict[str, threading.Event] = {}
+
+        def send(message: Dict[str, Any]) -> None:
+            loop.call_soon_threadsafe(outgoing.put_nowait, message)
+
+        async def send_messages() -> None:
+            while True:
+                message = await outgoing.get()
+                with time_stage("serialisation"):
+                    text = dumps(message).decode("utf-8")
+                await websocket.send_text(text)
+                if message.get("event") == "done":
+                    running.pop(message["id"], None)
+
+        sender = asyncio.ensure_future(send_messages())
+        starting: Set[asyncio.Future] = set()
+        try:
+            while True:
+                starting = {task for task in starting if not task.done()}
+                received = await websocket.receive()
+                if received["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(received.get("code", 1000))
+                text = received.get("text")
+                if text is None:
+                    # a binary frame
+                    send({"event": "error", "data": "Messages must be text"})
+                    continue
+                try:
+                    message = json.loads(text)
+                    if not isinstance(message, dict):
+                        raise ValueError
+                except ValueError:
+                    send({"event": "error", "data": "Messages must be JSON objects"})
+                    continue
+
+                prediction_id = message.get("id") or uuid.uuid4().hex
+                if message.get("type", "predict") == "cancel":
+                    if prediction_id in running:
+                        running[prediction_id].set()
+                elif prediction_id in running:
+                    send(
+                        {
+                            "id": prediction_id,
+                            "event": "error",
+                            "data": "Prediction already exists",
+                        }
+                    )
+                else:
+                    cancelled = threading.Event()
+                    running[prediction_id] = cancelled
+                    # its inputs are validated while the connection keeps
+                    # receiving messages
+                    starting.add(
+                        asyncio.ensure_future(
+                            start_websocket_prediction(
+                                prediction_id, message, cancelled, send
+                            )
+                        )
+                    )
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sender.cancel()
+            # nobody's left to read the outputs
+            for cancelled in running.values():
+                cancelled.set()
+
+    async def start_websocket_prediction(
+        prediction_id: str,
+        message: Dict[str, Any],
+        cancelled: threading.Event,
+        send: Callable[[Dict[str, Any]], None],
+    ) -> None:
+        def send_event(event: str, data: Any) -> None:
+            send({"id": prediction_id, "event": event, "data": data})
+
+        try:
+            with time_stage("input"):
+                # in a thread, because inputs that are URLs are downloaded
+                request = await run_in_threadpool(
+                    Request,
+                    id=prediction_id,
+                    input=message.get("input"),
+                    output_file_prefix=message.get("output_file_prefix"),
+                )
+            admitted_at = admit()
+        except ValidationError as e:
+            send_event("done", {"status": Status.FAILED.value, "error": str(e)})
+            return
+        except HTTPException as e:
+            send_event("done", {"status": Status.FAILED.value, "error": e.detail})
+            return
+
+        submit_prediction(
+            admitted_at, stream_prediction, request, send_event, cancelled
+        )
+
+    def admit(count: int = 1) -> float:
+        """
+        Adds `count` predictions to the queue and returns when they were
+        added, or responds with a 503 if there isn't room for all of them.
+        """
+        for admitted in range(count):
+            try:
+                admission.admit()
+            except QueueFull as e:
+                for _ in range(admitted):
+                    admission.cancel()
+                predictions_total.inc("rejected", count)
+                raise HTTPException(
+                    status_code=503,
+                    detail=str(e),
+                    headers={"Retry-After": str(e.retry_after)},
+                )
+        return time.time()
+
+    def start_prediction(
+        request: Optional[Request],
+        send_event: Optional[Callable[[str, Any], None]] = None,
+        upload: Optional[Callable[[io.IOBase], str]] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> "Future[Any]":
+        """
+        Runs a prediction for a request from a frontend other than HTTP, like
+        the gRPC server, and returns a future for its response. If
+        `send_event` is set, it's streamed like stream_prediction() does
+        instead, and the future's result is None.
+
+        Raises HTTPException if there isn't room for it in the queue.
+        """
+        admitted_at = admit()
+        if send_event is not None:
+            return submit_prediction(
+                admitted_at,
+                stream_prediction,
+                request,
+                send_event,
+                cancelled or threading.Event(),
+                upload=upload,
+            )
+        return submit_prediction(
+            admitted_at, handle_request, request, upload=upload, cancelled=cancelled
+        )
+
+    # lets other frontends run predictions the same way HTTP requests do
+    app.state.make_request = make_request
+    app.state.start_prediction = start_prediction
+    app.state.start_setup = lambda: setup.start(setup_predictors)
+    app.state.shutdown = shutdown
+    app.state.output_cleaner = output_cleaner
+
+    def submit_prediction(
+        admitted_at: float, fn: Callable[..., Any], *args: Any, **kwargs: Any
+    ) -> "Future[Any]":
+        """
+        Runs a prediction that has been admitted in the executor.
+        """
+
+        def run() -> Any:
+            started_at = admission.start(admitted_at)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                admission.finish(started_at)
+                prediction_duration.observe(time.time() - admitted_at)
+
+        try:
+            return executor.submit(run)
+        except Exception:
+            admission.cancel()
+            raise
+
+    def start_async_prediction(request: Optional[Request]) -> FastJSONResponse:
+        if app.state.workers > 1:
+            # fetching it would be answered by any of the workers
+            raise HTTPException(
+                status_code=400,
+                detail="Asynchronous predictions can't be used with more than one worker",
+            )
+        prediction_id = uuid.uuid4().hex
+        webhook = None
+        if request is not None:
+            prediction_id = request.id or prediction_id
+            webhook = request.webhook
+
+        if prediction_id in prediction_store:
+            raise HTTPException(status_code=409, detail="Prediction already exists")
+        admitted_at = admit()
+        if not prediction_store.create(prediction_id):
+            admission.cancel()
+            raise HTTPException(
+                status_code=503, detail="Too many predictions in progress"
+            )
+
+        future = submit_prediction(
+            admitted_at, run_async_prediction, prediction_id, request
+        )
+        if webhook is not None:
+            # once the prediction has finished and freed its slot
+            future.add_done_callback(
+                lambda _: webhook_executor.submit(send_webhook, prediction_id, webhook)
+            )
+
+        return FastJSONResponse(
+            status_code=202,
+            content=prediction_store.get(prediction_id),
+            headers={
+                "Location": f"/predictions/{prediction_id}",
+                "Preference-Applied": "respond-async",
+            },
+        )
+
+    async def respond_with_files(
+        http_request: HTTPRequest, request: Optional[Request], media_type: str
+    ) -> Any:
+        """
+        Runs a prediction and responds with its output files as binary, read
+        from disk as they're sent.
+
+        With `application/octet-stream`, the body is the output file. With
+        `multipart/mixed`, the first part is the response as JSON, where each
+        output file is a `cid:` URL that references a later part.
+        """
+        if media_type == OCTET_STREAM and not returns_file:
+            raise HTTPException(
+                status_code=406,
+                detail="The output isn't a single file, so it can't be sent as application/octet-stream",
+            )
+
+        output_files = OutputFiles(output_cleaner)
+        cancelled = threading.Event()
+        admitted_at = admit()
+        future = submit_prediction(
+            admitted_at,
+            handle_request,
+            request,
+            upload=output_files.add,
+            cancelled=cancelled,
+        )
+        try:
+            encoded_response = await wait_for_prediction(
+                http_request, future, cancelled
+            )
+        except BaseException:
+            output_files.cleanup()
+            raise
+
+        if encoded_response is None:
+            # once the prediction has stopped writing them
+            future.add_done_callback(lambda _: output_files.cleanup())
+            return HTTPResponse(status_code=CLIENT_CLOSED_REQUEST)
+        if encoded_response["status"] == Status.FAILED.value:
+            output_files.cleanup()
+            with time_stage("serialisation"):
+                return FastJSONResponse(content=encoded_response, status_code=500)
+
+        cleanup = BackgroundTask(output_files.cleanup)
+        if media_type == OCTET_STREAM:
+            output_file = output_files.files[0]
+            return FileResponse(
+                output_file.path,
+                media_type=output_file.content_type,
+                filename=output_file.name,
+                background=cleanup,
+            )
+
+        boundary = uuid.uuid4().hex
+        return StreamingResponse(
+            multipart_body(encoded_response, output_files, boundary),
+            media_type=f"{MULTIPART_MIXED}; boundary={boundary}",
+            background=cleanup,
+        )
+
+    def start_streaming_prediction(
+        request: Optional[Request], media_type: str
+    ) -> StreamingResponse:
+        """
+        Runs a prediction in the background and streams each output, and each
+        line it logs if it's running in a subprocess, as an event as soon as
+        it's produced, followed by a `done` event.
+
+        If the client disconnects, the prediction is cancelled.
+        """
+        cancelled = threading.Event()
+        admitted_at = admit()
+        loop = asyncio.get_event_loop()
+        events: asyncio.Queue = asyncio.Queue()
+
+        def send_event(event: str, data: Any) -> None:
+            # nothing reads them once the client has gone
+            if not cancelled.is_set():
+                loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+        submit_prediction(
+            admitted_at, stream_prediction, request, send_event, cancelled
+        )
+
+        async def stream() -> AsyncIterator[str]:
+            try:
+                while True:
+                    event, data = await events.get()
+                    with time_stage("serialisation"):
+                        chunk = format_event(event, data, media_type)
+                    yield chunk
+                    if event == "done":
+                        break
+            finally:
+                # the stream is closed early if the client disconnects
+                cancelled.set()
+
+        return StreamingResponse(stream(), media_type=media_type)
+
+    def stream_prediction(
+        request: Optional[Request],
+        send_event: Callable[[str, Any], None],
+        cancelled: threading.Event,
+        upload: Optional[Callable[[io.IOBase], str]] = None,
+    ) -> None:
+        """
+        Runs a prediction and passes each event to `send_event`, followed by
+        a `done` event with its status, and its error if it failed.
+        """
+        try:
+            encoded_response = handle_request(
+                request, on_event=send_event, upload=upload, cancelled=cancelled
+            )
+            done = {"status": encoded_response["status"]}
+            if "error" in encoded_response:
+                done["error"] = encoded_response["error"]
+        except Exception as e:
+            done = {"status": Status.FAILED.value, "error": describe_error(e)}
+        send_event("done", done)
+
+    def run_async_prediction(prediction_id: str, request: Optional[Request]) -> None:
+        timestamps = {"started_at": datetime.datetime.now().isoformat()}
+        prediction_store.update(
+            prediction_id, **{"x-experimental-timestamps": timestamps}
+        )
+        try:
+            encoded_response = handle_request(request)
+            prediction_store.update(prediction_id, **encoded_response)
+        except Exception as e:
+            prediction_store.update(
+                prediction_id, status=Status.FAILED.value, error=describe_error(e)
+            )
+        timestamps = dict(timestamps, completed_at=datetime.datetime.now().isoformat())
+        prediction_store.update(
+            prediction_id, **{"x-experimental-timestamps": timestamps}
+        )
+
+    def send_webhook(prediction_id: str, webhook: str) -> None:
+        try:
+            resp = requests.post(
+                webhook,
+                data=dumps(prediction_store.get(prediction_id)),
+                headers={"Content-Type": "application/json"},
+                timeout=WEBHOOK_TIMEOUT_SECONDS,
+            )
+            resp.raise_for_status()
+        except Exception:
+            logger.exception("Failed to send webhook for prediction %s", prediction_id)
+
+    def handle_request(
+        request: Optional[Request],
+        on_event: Optional[Callable[[str, Any], None]] = None,
+        upload: Optional[Callable[[io.IOBase], str]] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> Dict[str, Any]:
+        """
+        Runs a prediction for a request, and returns the response as something
+        that can be encoded as JSON.
+
+        See respond() for what the arguments do. This counts how the
+        prediction went, whichever way it was run.
+        """
+        status = Status.FAILED.value
+        try:
+            encoded_response = respond(request, on_event, upload, cancelled)
+            status = encoded_response["status"]
+            return encoded_response
+        finally:
+            if cancelled is not None and cancelled.is_set():
+                status = "cancelled"
+            predictions_total.inc(status)
+
+    def respond(
+        request: Optional[Request],
+        on_event: Optional[Callable[[str, Any], None]] = None,
+        upload: Optional[Callable[[io.IOBase], str]] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> Dict[str, Any]:
+        """
+        Runs a prediction for a request, and returns the response as something
+        that can be encoded as JSON, from the cache if it can.
+
+        If `on_event` is set, it's called with an `output` event for each
+        encoded output of a generator predictor as soon as it's produced, or
+        for the whole output of any other predictor. If the prediction runs
+        in a subprocess, it's also called with a `log` event for each line the
+        predictor logs.
+
+        Output files are passed to `upload` if it's set, instead of being
+        uploaded to the request's `output_file_prefix` or encoded as data
+        URLs.
+
+        If `cancelled` is set, the prediction stops as soon as it can and
+        fails. A prediction that identical requests are sharing isn't
+        stopped, because they're still waiting for it.
+        """
+        output_file_prefix = None
+        if request:
+            output_file_prefix = request.output_file_prefix
+
+        inputs: Dict[str, Any] = {}
+        try:
+            if request is not None and request.input is not None:
+                inputs = request.input.dict()
+
+            if upload is not None:
+                # the outputs reference files that only this request has, so
+                # they can't be cached or shared
+                return run_prediction(
+                    inputs,
+                    output_file_prefix,
+                    on_event=on_event,
+                    upload=upload,
+                    cancelled=cancelled,
+                )
+
+            prediction_key = None
+            if result_cache is not None:
+                # output files are uploaded to output_file_prefix, so outputs
+                # can only be reused for requests with the same prefix
+                prediction_key = result_cache.key(inputs, output_file_prefix)
+
+            if prediction_key is None:
+                return run_prediction(
+                    inputs, output_file_prefix, on_event=on_event, cancelled=cancelled
+                )
+
+            hit, cached_output = result_cache.get(prediction_key)  # type: ignore
+            if hit:
+                if on_event is not None:
+                    for output in cached_output if is_generator else [cached_output]:
+                        on_event("output", output)
+                return {
+                    "status": Status.SUCCEEDED.value,
+                    "output": cached_output,
+                }
+            if single_flight is not None:
+                # share the output with identical requests that arrive while
+                # this one is running, including each event as it happens
+                return single_flight.do_streaming(
+                    prediction_key,
+                    lambda publish: run_prediction(
+                        inputs,
+                        output_file_prefix,
+                        prediction_key,
+                        on_event=lambda event, data: publish((event, data)),
+                    ),
+                    on_item=(
+                        (lambda item: on_event(*item))  # type: ignore
+                        if on_event is not None
+                        else None
+                    ),
+                )
+            return run_prediction(
+                inputs,
+                output_file_prefix,
+                prediction_key,
+                on_event=on_event,
+                cancelled=cancelled,
+            )
+        finally:
+            if request is not None and request.input is not None:
+                request.input.cleanup()
+
+    @contextlib.contextmanager
+    def time_stage(stage: str) -> Iterator[None]:
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            stage_duration.observe(time.time() - started_at, stage)
+
+    @contextlib.contextmanager
+    def take_predictor() -> Iterator[BasePredictor]:
+        # predictions that arrive while setup is running wait for it
+        try:
+            setup.wait()
+        except SetupFailed as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        instance = idle_predictors.get()
+        try:
+            yield instance
+        finally:
+            idle_predictors.put(instance)
+
+    def run_prediction(
+        inputs: Dict[str, Any],
+        output_file_prefix: Optional[str],
+        prediction_key: Optional[str] = None,
+        on_event: Optional[Callable[[str, Any], None]] = None,
+        upload: Optional[Callable[[io.IOBase], str]] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> Dict[str, Any]:
+        def check_cancelled() -> None:
+            if cancelled is not None and cancelled.is_set():
+                raise PredictionCancelled("Prediction was cancelled")
+
+        # output files from before this are left alone
+        prediction_started_at = time.time()
 
-            response = Response(status=Status.SUCCEEDED, output=output)
+        def encode_response(response: Any) -> Dict[str, Any]:
+            # the files are counted towards the disk quota until they've been
+            # uploaded, or until `upload` has sent them
+            output_paths = find_output_files(
+                response.output, since=prediction_started_at
+            )
+            output_cleaner.hold(output_paths)
+            try:
+                encoded_response = encode_json(
+                    response,
+                    upload_file=upload
+                    or (lambda fh: upload_file(fh, output_file_prefix)),
+                )
+            except BaseException:
+                output_cleaner.release(output_paths)
+                raise
+            if upload is None:
+                output_cleaner.release(output_paths)
+            return encoded_response
 
+        try:
+            with take_predictor() as instance:
+                # it might have been cancelled while it was waiting to run
+                check_cancelled()
+                with time_stage("predict"):
+                    if runner_pool is not None:
+                        output = runner_pool.predict(
+                            inputs,
+                            on_log=(
+                                (lambda line: on_event("log", line))  # type: ignore
+                                if on_event is not None
+                                else None
+                            ),
+                            cancelled=cancelled,
+                        )
+                    else:
+                        # this can't be stopped until it returns, but a
+                        # generator is stopped at the next thing it yields
+                        output = instance.predict(**inputs)
+                if isinstance(output, types.GeneratorType):
+                    # Each output is validated and encoded as it's yielded, so
+                    # it can be sent before the generator finishes. The time
+                    # spent waiting for the generator counts as predicting.
+                    encoded_outputs: List[Any] = []
+                    predict_time = output_time = 0.0
+                    try:
+                        started_at = time.time()
+                        for item in output:
+                            predict_time += time.time() - started_at
+                            started_at = time.time()
+                            item_response = Response(
+                                status=Status.SUCCEEDED, output=[item]
+                            )
+                            encoded_output = encode_response(item_response)["output"][0]
+                            encoded_outputs.append(encoded_output)
+                            output_time += time.time() - started_at
+                            if on_event is not None:
+                                on_event("output", encoded_output)
+                            check_cancelled()
+                            started_at = time.time()
+                        predict_time += time.time() - started_at
+                    finally:
+                        # stops the prediction if we've given up on it early
+                        output.close()
+                    stage_duration.observe(predict_time, "predict")
+                    stage_duration.observe(output_time, "output")
+                    encoded_response = {
+                        "status": Status.SUCCEEDED.value,
+                        "output": encoded_outputs,
+                    }
+                else:
+                    response = Response(status=Status.SUCCEEDED, output=output)
         except ValidationError as e:
             logger.error(
                 f"""The return value of predict() was not valid:
@@ -95,26 +1172,155 @@ Check that your predict function is in this form, where `output_type` is the sam
 """
             )
             raise HTTPException(status_code=500)
-        finally:
-            if request is not None and request.input is not None:
-                request.input.cleanup()
+        except (PredictionError, DiskQuotaExceeded) as e:
+            return {"status": Status.FAILED.value, "error": str(e)}
 
-        output_file_prefix = None
-        if request:
-            output_file_prefix = request.output_file_prefix
+        if not isinstance(output, types.GeneratorType):
+            with time_stage("output"):
+                try:
+                    encoded_response = encode_response(response)
+                except DiskQuotaExceeded as e:
+                    return {"status": Status.FAILED.value, "error": str(e)}
+            if on_event is not None:
+                on_event("output", encoded_response["output"])
+        if prediction_key is not None:
+            result_cache.set(prediction_key, encoded_response["output"])  # type: ignore
+        return encoded_response
 
-        encoded_response = make_encodeable(response)
-        encoded_response = upload_files(
-            encoded_response, upload_file=lambda fh: upload_file(fh, output_file_prefix)
+    return app
+
+
+def current_time() -> float:
+    # FastAPI can't depend on time.time() directly, because it's a builtin
+    # without a signature
+    return time.time()
+
+
+async def read_json(http_request: HTTPRequest) -> Any:
+    """
+    Reads a JSON request body the way FastAPI does, for routes that validate
+    it themselves. An empty body is None.
+    """
+    body = await http_request.body()
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError as e:
+        raise RequestValidationError([ErrorWrapper(e, ("body", e.pos))], body=e.doc)
+
+
+async def wait_for_prediction(
+    http_request: HTTPRequest, prediction: Any, cancelled: threading.Event
+) -> Any:
+    """
+    Waits for a prediction (a concurrent or asyncio future, or a coroutine)
+    and returns its result, unless the client disconnects first. Then, it
+    sets `cancelled` and returns None without waiting for it to stop.
+    """
+    prediction = asyncio.ensure_future(
+        asyncio.wrap_future(prediction)
+        if isinstance(prediction, Future)
+        else prediction
+    )
+    disconnected = asyncio.ensure_future(wait_for_disconnect(http_request))
+    try:
+        await asyncio.wait(
+            [prediction, disconnected], return_when=asyncio.FIRST_COMPLETED
         )
-        # TODO: clean up output files
-        return JSONResponse(content=encoded_response)
+    finally:
+        disconnected.cancel()
+    if prediction.done():
+        return prediction.result()
 
-    return app
+    logger.info("Client disconnected, cancelling prediction")
+    cancelled.set()
+    # nothing's waiting for it any more, so it mustn't log that its exception
+    # wasn't retrieved
+    prediction.add_done_callback(lambda f: f.cancelled() or f.exception())
+    return None
+
+
+async def wait_for_disconnect(http_request: HTTPRequest) -> None:
+    # the body has been read already, so the next message is the disconnect
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def describe_error(e: Exception) -> str:
+    """
+    Returns the error message to report for a prediction that failed.
+    """
+    if isinstance(e, HTTPException):
+        return str(e.detail)
+    logger.exception("Prediction failed")
+    return str(e)
+
+
+def accepted_media_type(
+    accept: Optional[str], media_types: Sequence[str]
+) -> Optional[str]:
+    """
+    Returns the first media type in an Accept header that's one of
+    `media_types`, or None if there isn't one.
+    """
+    if accept is None:
+        return None
+    for media_range in accept.split(","):
+        media_type = media_range.split(";", 1)[0].strip().lower()
+        if media_type in media_types:
+            return media_type
+    return None
+
+
+def format_event(event: str, data: Any, media_type: str) -> str:
+    if media_type == EVENT_STREAM:
+        return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+    return dumps({"event": event, "data": data}).decode("utf-8") + "\n"
+
+
+def prefers_async(prefer: Optional[str]) -> bool:
+    """
+    Returns True if a Prefer header (RFC 7240) includes respond-async.
+    """
+    if prefer is None:
+        return False
+    for preference in prefer.split(","):
+        name = preference.split(";", 1)[0].split("=", 1)[0]
+        if name.strip().lower() == "respond-async":
+            return True
+    return False
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Cog HTTP server")
+    parser.add_argument(
+        "--host",
+        dest="host",
+        default=DEFAULT_HOST,
+        help="Address to listen on.",
+    )
+    parser.add_argument(
+        "--port",
+        dest="port",
+        type=int,
+        default=DEFAULT_PORT,
+        help="Port to listen on.",
+    )
+    parser.add_argument(
+        "--unix-socket",
+        dest="unix_socket",
+        default=None,
+        help="Also listen on a Unix domain socket at this path, for clients on the same machine.",
+    )
+    parser.add_argument(
+        "--no-tcp",
+        dest="tcp",
+        action="store_false",
+        help="Only listen on --unix-socket, not on --host and --port.",
+    )
     parser.add_argument(
         "--threads",
         dest="threads",
@@ -122,9 +1328,82 @@ if __name__ == "__main__":
         default=None,
         help="Number of worker processes. Defaults to number of CPUs, or 1 if using a GPU.",
     )
+    parser.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        type=int,
+        default=128,
+        help="Number of outputs to cache, if the predictor is deterministic.",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        dest="cache_ttl",
+        type=float,
+        default=60 * 60,
+        help="Number of seconds to cache outputs for.",
+    )
+    parser.add_argument(
+        "--cache-redis-url",
+        dest="cache_redis_url",
+        default=None,
+        help="Also cache outputs in Redis at this URL, to share them between replicas.",
+    )
+    parser.add_argument(
+        "--prediction-store-size",
+        dest="prediction_store_size",
+        type=int,
+        default=1000,
+        help="Number of asynchronous predictions to keep the state of.",
+    )
+    parser.add_argument(
+        "--runner",
+        dest="runner",
+        action="store_true",
+        help="Run predictions in subprocesses, one for each thread, so they can time out, stream logs and crash without taking the server down.",
+    )
+    parser.add_argument(
+        "--predict-timeout",
+        dest="predict_timeout",
+        type=int,
+        default=None,
+        help="Fail predictions that take longer than this many seconds. Implies --runner.",
+    )
+    parser.add_argument(
+        "--max-queue-depth",
+        dest="max_queue_depth",
+        type=int,
+        default=None,
+        help="Respond with 503 to predictions that arrive when this many are already waiting to run.",
+    )
+    parser.add_argument(
+        "--output-disk-quota",
+        dest="output_disk_quota",
+        type=int,
+        default=None,
+        help="Fail predictions whose output files would take the disk space used by output files that haven't been deleted yet over this many megabytes.",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=1,
+        help="Run setup once, then fork this many processes to serve predictions, sharing the model's memory. Only for models that run on the CPU. Asynchronous predictions and /metrics aren't available with more than one.",
+    )
     args = parser.parse_args()
+    if not args.tcp and args.unix_socket is None:
+        parser.error("--no-tcp needs --unix-socket")
 
     config = load_config()
+    concurrency = get_concurrency(config)
+    if args.workers > 1 and (
+        args.runner
+        or args.predict_timeout is not None
+        or concurrency == Concurrency.PROCESS_PER_SLOT
+    ):
+        # the runners' subprocesses already run predictions in parallel
+        parser.error(
+            "--workers can't be used with --runner, --predict-timeout or concurrency: process_per_slot"
+        )
 
     threads = args.threads
     if threads is None:
@@ -134,16 +1413,46 @@ if __name__ == "__main__":
             threads = os.cpu_count()
 
     predictor = load_predictor(config)
-    app = create_app(predictor, threads=threads)
-    uvicorn.run(
-        app,
-        host="0.0.0.0",
-        port=5000,
-        # log level is configurable so we can make it quiet or verbose for `cog predict`
-        # cog predict --debug       # -> debug
-        # cog predict               # -> warning
-        # docker run <image-name>   # -> info (default)
-        log_level=os.environ.get("COG_LOG_LEVEL", "info"),
-        # This is the default, but to be explicit: only run a single worker
-        workers=1,
+    result_cache = make_result_cache(
+        predictor,
+        max_size=args.cache_size,
+        ttl=args.cache_ttl,
+        redis_client=(
+            redis.Redis.from_url(args.cache_redis_url) if args.cache_redis_url else None
+        ),
+    )
+    app = create_app(
+        predictor,
+        threads=threads,
+        result_cache=result_cache,
+        prediction_store_size=args.prediction_store_size,
+        runner_pool=(
+            RunnerPool(size=threads, predict_timeout=args.predict_timeout)
+            if args.runner or args.predict_timeout is not None
+            else None
+        ),
+        max_queue_depth=args.max_queue_depth,
+        concurrency=concurrency,
+        output_cleaner=OutputCleaner(
+            max_bytes=(
+                args.output_disk_quota * 1024 * 1024
+                if args.output_disk_quota is not None
+                else None
+            )
+        ),
     )
+    # log level is configurable so we can make it quiet or verbose for `cog predict`
+    # cog predict --debug       # -> debug
+    # cog predict               # -> warning
+    # docker run <image-name>   # -> info (default)
+    log_level = os.environ.get("COG_LOG_LEVEL", "info")
+    listen_options = {
+        "host": args.host,
+        "port": args.port if args.tcp else None,
+        "unix_socket": args.unix_socket,
+        "log_level": log_level,
+    }
+    if args.workers > 1:
+        serve_prefork(app, workers=args.workers, **listen_options)
+    else:
+        serve(app, **listen_options)
@@ -0,0 +1,88 @@
+import logging
+import os
+import signal
+import socket
+import stat
+import sys
+from typing import Any, List, Optional
+
+from fastapi import FastAPI
+import uvicorn  # type: ignore
+
+logger = logging.getLogger("cog")
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 5000
+
+
+def bind_sockets(
+    host: str = DEFAULT_HOST,
+    port: Optional[int] = DEFAULT_PORT,
+    unix_socket: Optional[str] = None,
+) -> List[socket.socket]:
+    """
+    Binds a TCP socket to `host` and `port`, unless `port` is None, and a
+    Unix domain socket to the path `unix_socket`, if it's set.
+
+    Clients on the same machine, like a sidecar, can connect to the Unix
+    domain socket, which skips the TCP stack.
+    """
+    sockets = []
+    if port is not None:
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sockets.append(sock)
+        logger.info(f"Listening on {host}:{port}")
+
+    if unix_socket is not None:
+        # left behind by a server that didn't exit cleanly
+        if os.path.exists(unix_socket) and stat.S_ISSOCK(os.stat(unix_socket).st_mode):
+            os.unlink(unix_socket)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(unix_socket)
+        # so clients running as other users can connect, like uvicorn does
+        os.chmod(unix_socket, 0o666)
+        sockets.append(sock)
+        logger.info(f"Listening on {unix_socket}")
+
+    if not sockets:
+        raise ValueError("There's nothing to listen on")
+    for sock in sockets:
+        sock.listen(2048)
+        sock.set_inheritable(True)
+    return sockets
+
+
+def close_sockets(sockets: List[socket.socket], unix_socket: Optional[str]) -> None:
+    """
+    Closes sockets from bind_sockets(), and removes the Unix domain socket.
+    """
+    for sock in sockets:
+        sock.close()
+    if unix_socket is not None and os.path.exists(unix_socket):
+        os.unlink(unix_socket)
+
+
+def serve(
+    app: FastAPI,
+    host: str = DEFAULT_HOST,
+    port: Optional[int] = DEFAULT_PORT,
+    unix_socket: Optional[str] = None,
+    **uvicorn_options: Any,
+) -> None:
+    """
+    Serves `app` in this process, on a TCP socket, a Unix domain socket, or
+    both. See bind_sockets().
+    """
+    sockets = bind_sockets(host, port, unix_socket)
+    # Newer versions of uvicorn raise the signal that stopped them again once
+    # they've shut down, which would otherwise kill the process before it
+    # removes the Unix domain socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        config = uvicorn.Config(app, **uvicorn_options)
+        uvicorn.Server(config).run(sockets=sockets)
+    finally:
+        close_sockets(sockets, unix_socket)
@@ -0,0 +1,306 @@
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import math
+from socketserver import ThreadingMixIn
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+
+class RollingWindow:
+    """
+    Keeps the samples recorded in the last `window` seconds, so we can report
+    rolling percentiles and rates instead of raw samples.
+    """
+
+    def __init__(self, window: float = 60.0) -> None:
+        self.window = window
+        self.samples: Deque[Tuple[float, float]] = deque()
+        self.lock = threading.Lock()
+
+    def add(self, value: float, now: Optional[float] = None) -> None:
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self.samples.append((now, value))
+            self._expire(now)
+
+    def values(self, now: Optional[float] = None) -> List[float]:
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self._expire(now)
+            return [value for _, value in self.samples]
+
+    def rate(self, now: Optional[float] = None) -> float:
+        """
+        The number of samples per second over the window.
+        """
+        return len(self.values(now)) / self.window
+
+    def summary(self, now: Optional[float] = None) -> Dict[str, Optional[float]]:
+        values = sorted(self.values(now))
+        return {
+            "count": len(values),
+            "sum": sum(values),
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+        }
+
+    def _expire(self, now: float) -> None:
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+
+class BusyTracker:
+    """
+    Tracks how much of the last `window` seconds was spent doing work.
+    """
+
+    def __init__(self, window: float = 60.0) -> None:
+        self.window = window
+        self.intervals: Deque[Tuple[float, float]] = deque()
+        self.busy_since: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def start(self, now: Optional[float] = None) -> None:
+        with self.lock:
+            self.busy_since = time.time() if now is None else now
+
+    def stop(self, now: Optional[float] = None) -> None:
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if self.busy_since is not None:
+                self.intervals.append((self.busy_since, now))
+                self.busy_since = None
+            while self.intervals and self.intervals[0][1] < now - self.window:
+                self.intervals.popleft()
+
+    def ratio(self, now: Optional[float] = None) -> float:
+        if now is None:
+            now = time.time()
+        window_start = now - self.window
+        with self.lock:
+            intervals = list(self.intervals)
+            if self.busy_since is not None:
+                intervals.append((self.busy_since, now))
+        busy = sum(max(0.0, end - max(start, window_start)) for start, end in intervals)
+        return min(1.0, busy / self.window)
+
+    def completed(self, now: Optional[float] = None) -> int:
+        """
+        The number of intervals that finished in the window.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return sum(1 for _, end in self.intervals if end >= now - self.window)
+
+
+# Prometheus's default buckets, with more for predictions that take minutes
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+
+class Counter:
+    """
+    A Prometheus counter, with a value for each value of an optional label.
+    """
+
+    def __init__(self, label: Optional[str] = None) -> None:
+        self.label = label
+        self.values: Dict[Optional[str], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_value: Optional[str] = None, amount: float = 1.0) -> None:
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0.0) + amount
+
+    def format(self, name: str, labels: Optional[Dict[str, str]] = None) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        lines = [f"# TYPE {name} counter"]
+        for label_value, value in values.items():
+            lines.append(
+                f"{name}{_format_labels(_with_label(labels, self.label, label_value))} {_format_value(value)}"
+            )
+        return lines
+
+
+class Histogram:
+    """
+    A Prometheus histogram, with a set of buckets for each value of an
+    optional label.
+    """
+
+    def __init__(
+        self, label: Optional[str] = None, buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        self.label = label
+        self.buckets = buckets
+        # label value -> (count in each bucket, sum, count)
+        self.values: Dict[Optional[str], Tuple[List[int], float, int]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, label_value: Optional[str] = None) -> None:
+        with self.lock:
+            bucket_counts, total, count = self.values.get(
+                label_value, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+                    break
+            self.values[label_value] = (bucket_counts, total + value, count + 1)
+
+    def format(self, name: str, labels: Optional[Dict[str, str]] = None) -> List[str]:
+        with self.lock:
+            values = {k: (list(b), t, c) for k, (b, t, c) in self.values.items()}
+        lines = [f"# TYPE {name} histogram"]
+        for label_value, (bucket_counts, total, count) in values.items():
+            series_labels = _with_label(labels, self.label, label_value)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = dict(series_labels, le=_format_value(bound))
+                lines.append(
+                    f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                )
+            lines.append(
+                f"{name}_bucket{_format_labels(dict(series_labels, le='+Inf'))} {count}"
+            )
+            lines.append(
+                f"{name}_sum{_format_labels(series_labels)} {_format_value(total)}"
+            )
+            lines.append(f"{name}_count{_format_labels(series_labels)} {count}")
+        return lines
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """
+    Nearest-rank percentile of an already sorted list, or None if it's empty.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def format_prometheus(
+    metrics: Dict[str, Any],
+    prefix: str = "cog_",
+    labels: Optional[Dict[str, str]] = None,
+) -> str:
+    """
+    Formats metrics in the Prometheus text exposition format.
+
+    Numbers become gauges. Dicts produced by `RollingWindow.summary()` become
+    summaries, with a `quantile` label for each percentile. Counters and
+    histograms are formatted as themselves.
+    """
+    lines = []
+    for name, value in metrics.items():
+        if value is None:
+            continue
+        name = prefix + name
+        if isinstance(value, (Counter, Histogram)):
+            lines.extend(value.format(name, labels))
+        elif isinstance(value, dict):
+            lines.append(f"# TYPE {name} summary")
+            for key, quantile_value in value.items():
+                if key in ("count", "sum"):
+                    lines.append(
+                        f"{name}_{key}{_format_labels(labels)} {_format_value(quantile_value)}"
+                    )
+                else:
+                    quantile_labels = dict(labels or {})
+                    quantile_labels["quantile"] = str(float(key.lstrip("p")) / 100)
+                    lines.append(
+                        f"{name}{_format_labels(quantile_labels)} {_format_value(quantile_value)}"
+                    )
+        else:
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def _with_label(
+    labels: Optional[Dict[str, str]], name: Optional[str], value: Optional[str]
+) -> Dict[str, str]:
+    labels = dict(labels or {})
+    if name is not None and value is not None:
+        labels[name] = value
+    return labels
+
+
+def _format_value(value: Any) -> str:
+    # Prometheus understands NaN as "no data"
+    if value is None:
+        return "NaN"
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+# http.server.ThreadingHTTPServer was only added in Python 3.7
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(
+    port: int, get_metrics: Callable[[], str], host: str = "0.0.0.0"
+) -> ThreadingHTTPServer:
+    """
+    Serves the output of `get_metrics` at `/metrics` from a background thread.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = get_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            # scrapes are too frequent to be worth logging
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,208 @@
+import io
+import logging
+import os
+import pathlib
+import queue
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger("cog")
+
+# File times come from a coarser clock than time.time(), so a file that's
+# written just after a prediction starts can look like it's slightly older
+MTIME_SLACK_SECONDS = 0.1
+
+
+class DiskQuotaExceeded(Exception):
+    pass
+
+
+def find_output_files(obj: Any, since: Optional[float] = None) -> List[str]:
+    """
+    Returns the paths of the files in the temporary directory that an output
+    references, as Path outputs or as file objects. If `since` is set, only
+    the ones that were created or modified since then are returned.
+
+    Files anywhere else might be part of the model, so they're left alone,
+    and so are files from before the prediction started, like ones that
+    setup() created and returns from every prediction.
+    """
+    paths: List[str] = []
+    _find_output_files(obj, paths, since)
+    return paths
+
+
+def _find_output_files(obj: Any, paths: List[str], since: Optional[float]) -> None:
+    if isinstance(obj, BaseModel):
+        for _, value in obj:
+            _find_output_files(value, paths, since)
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            _find_output_files(value, paths, since)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for value in obj:
+            _find_output_files(value, paths, since)
+    else:
+        path = None
+        if isinstance(obj, pathlib.Path):
+            path = str(obj)
+        elif isinstance(obj, io.IOBase):
+            name = getattr(obj, "name", None)
+            if isinstance(name, str):
+                path = name
+        if path is not None and is_temporary(path, since) and path not in paths:
+            paths.append(path)
+
+
+def is_temporary(path: str, since: Optional[float] = None) -> bool:
+    """
+    Returns True if a path is a file in the temporary directory, which was
+    created or modified since the time `since`, if it's set.
+    """
+    temp_dir = os.path.realpath(tempfile.gettempdir())
+    real_path = os.path.realpath(path)
+    if (
+        os.path.commonpath([real_path, temp_dir]) != temp_dir
+        or real_path == temp_dir
+        or not os.path.isfile(real_path)
+    ):
+        return False
+    if since is None:
+        return True
+    try:
+        return os.path.getmtime(real_path) >= since - MTIME_SLACK_SECONDS
+    except OSError:
+        return False
+
+
+class OutputCleaner:
+    """
+    Deletes the files that predictions output once they've been uploaded or
+    sent, in a background thread so it's off the request path.
+
+    If `max_bytes` is set, it's a quota on how much disk the output files
+    that haven't been deleted yet can use, so that lots of big outputs, or
+    slow clients downloading them, can't fill the disk. A prediction whose
+    outputs would take it over the quota fails instead.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None) -> None:
+        self.max_bytes = max_bytes
+        # predictors sometimes write every output to the same path, so a
+        # file isn't deleted until every prediction that output it is done
+        # with it
+        self.holders: Dict[str, int] = {}
+        self.sizes: Dict[str, int] = {}
+        self.held_bytes = 0
+        self.lock = threading.Lock()
+        self.deletions: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+
+    def hold(self, paths: List[str]) -> None:
+        """
+        Counts files towards the quota until they're released.
+
+        Raises DiskQuotaExceeded if they'd take it over the quota, and
+        deletes them.
+        """
+        sizes = {}
+        for path in paths:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except OSError:
+                pass
+
+        with self.lock:
+            new_bytes = sum(
+                size for path, size in sizes.items() if path not in self.holders
+            )
+            over_quota = (
+                self.max_bytes is not None
+                and self.held_bytes + new_bytes > self.max_bytes
+            )
+            if not over_quota:
+                for path, size in sizes.items():
+                    if path not in self.holders:
+                        self.holders[path] = 0
+                        self.sizes[path] = size
+                    self.holders[path] += 1
+                self.held_bytes += new_bytes
+            held_bytes = self.held_bytes
+
+        if over_quota:
+            assert self.max_bytes is not None
+            for path in sizes:
+                self.deletions.put(path)
+            self.start()
+            raise DiskQuotaExceeded(
+                f"The output files take up {new_bytes} bytes, but only "
+                f"{max(0, self.max_bytes - held_bytes)} bytes of the output "
+                "disk quota are free"
+            )
+
+    def release(self, paths: List[str]) -> None:
+        """
+        Deletes files in the background, once every prediction that holds
+        them has released them. Files that aren't held are deleted straight
+        away.
+        """
+        with self.lock:
+            for path in paths:
+                if path in self.holders:
+                    self.holders[path] -= 1
+                    if self.holders[path] > 0:
+                        continue
+                self.deletions.put(path)
+        self.start()
+
+    def usage(self) -> int:
+        """
+        Returns how many bytes the files that are held take up.
+        """
+        with self.lock:
+            return self.held_bytes
+
+    def start(self) -> None:
+        # when it's needed, rather than when it's created, so it isn't
+        # started before serve_prefork() forks the workers
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            path = self.deletions.get()
+            if path is None:
+                return
+            self.delete(path)
+
+    def delete(self, path: str) -> None:
+        with self.lock:
+            if self.holders.get(path, 0) > 0:
+                # another prediction has output it since it was released
+                return
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logger.exception("Failed to delete output file %s", path)
+            if path in self.holders:
+                del self.holders[path]
+                self.held_bytes -= self.sizes.pop(path)
+
+    def close(self) -> None:
+        """
+        Deletes the files that are waiting to be deleted, and stops the
+        background thread.
+        """
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            self.deletions.put(None)
+            thread.join()
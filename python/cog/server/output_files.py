@@ -0,0 +1,113 @@
+import io
+import mimetypes
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List
+from urllib.parse import quote
+
+from ..json import dumps
+from .output_cleanup import OutputCleaner, is_temporary
+
+MULTIPART_MIXED = "multipart/mixed"
+OCTET_STREAM = "application/octet-stream"
+
+CHUNK_SIZE = 64 * 1024
+
+
+class OutputFile:
+    def __init__(self, name: str, path: str, temporary: bool) -> None:
+        self.name = name
+        self.path = path
+        self.temporary = temporary
+        self.content_type = mimetypes.guess_type(name)[0] or OCTET_STREAM
+
+
+class OutputFiles:
+    """
+    Collects the files a prediction outputs, so they can be sent as binary
+    parts of the response instead of being encoded as data URLs.
+
+    Files that are already on disk are sent from where they are. Other files
+    are copied to temporary files, so they aren't held in memory. Once
+    they've been sent, the files in the temporary directory that were
+    written after this was created, which is before the prediction starts,
+    are deleted by `cleaner`.
+    """
+
+    def __init__(self, cleaner: OutputCleaner) -> None:
+        self.cleaner = cleaner
+        self.files: List[OutputFile] = []
+        self.created_at = time.time()
+
+    def add(self, fh: io.IOBase) -> str:
+        """
+        Adds a file, and returns a `cid:` URL (RFC 2392) that references the
+        part of the response it's sent in.
+        """
+        path = getattr(fh, "name", None)
+        name = os.path.basename(path) if isinstance(path, str) else "output"
+        name = self.unique_name(name or "output")
+
+        if isinstance(path, str) and os.path.isfile(path):
+            self.files.append(
+                OutputFile(
+                    name, path, temporary=is_temporary(path, since=self.created_at)
+                )
+            )
+        else:
+            self.files.append(OutputFile(name, copy_to_temp_file(fh), temporary=True))
+        return "cid:" + quote(name)
+
+    def unique_name(self, name: str) -> str:
+        names = {f.name for f in self.files}
+        stem, ext = os.path.splitext(name)
+        i = 1
+        while name in names:
+            name = f"{stem}-{i}{ext}"
+            i += 1
+        return name
+
+    def cleanup(self) -> None:
+        self.cleaner.release([f.path for f in self.files if f.temporary])
+
+
+def copy_to_temp_file(fh: io.IOBase) -> str:
+    fh.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False) as temp:
+        while True:
+            chunk = fh.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            # the file handle might be strings, not bytes
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            temp.write(chunk)
+    return temp.name
+
+
+def multipart_body(
+    response: Dict[str, Any], output_files: OutputFiles, boundary: str
+) -> Iterator[bytes]:
+    """
+    Generates a multipart/mixed body (RFC 2046) with the response as JSON in
+    the first part, followed by a part for each output file, read from disk
+    as it's sent.
+    """
+    yield f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode("utf-8")
+    yield dumps(response) + b"\r\n"
+
+    for f in output_files.files:
+        yield (
+            f"--{boundary}\r\n"
+            f"Content-Type: {f.content_type}\r\n"
+            f"Content-ID: <{quote(f.name)}>\r\n"
+            f'Content-Disposition: attachment; filename="{quote(f.name)}"\r\n'
+            "\r\n"
+        ).encode("utf-8")
+        with open(f.path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+                yield chunk
+        yield b"\r\n"
+
+    yield f"--{boundary}--\r\n".encode("utf-8")
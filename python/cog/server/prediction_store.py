@@ -0,0 +1,61 @@
+from collections import OrderedDict
+import threading
+from typing import Any, Dict, Optional
+
+from ..response import Status
+
+
+class PredictionStore:
+    """
+    Keeps the state of asynchronous predictions in memory.
+
+    It holds at most `max_size` predictions. When it's full, adding a
+    prediction evicts the oldest one that has finished. If they're all still
+    running, the new prediction is refused.
+    """
+
+    def __init__(self, max_size: int = 1000) -> None:
+        self.max_size = max_size
+        self.predictions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, prediction_id: str) -> bool:
+        with self.lock:
+            return prediction_id in self.predictions
+
+    def create(self, prediction_id: str) -> bool:
+        """
+        Adds a prediction with the status `processing`. Returns False if the
+        store is full of predictions that are still running.
+        """
+        with self.lock:
+            if len(self.predictions) >= self.max_size and not self._evict():
+                return False
+            self.predictions[prediction_id] = {
+                "id": prediction_id,
+                "status": Status.PROCESSING.value,
+                "output": None,
+            }
+            return True
+
+    def update(self, prediction_id: str, **fields: Any) -> None:
+        with self.lock:
+            prediction = self.predictions.get(prediction_id)
+            if prediction is not None:
+                prediction.update(fields)
+
+    def get(self, prediction_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            prediction = self.predictions.get(prediction_id)
+            if prediction is None:
+                return None
+            # fields are replaced rather than mutated, so a shallow copy is
+            # enough to keep it consistent
+            return dict(prediction)
+
+    def _evict(self) -> bool:
+        for prediction_id, prediction in self.predictions.items():
+            if prediction["status"] != Status.PROCESSING.value:
+                del self.predictions[prediction_id]
+                return True
+        return False
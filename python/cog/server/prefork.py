@@ -0,0 +1,105 @@
+import gc
+import logging
+import os
+import signal
+import time
+from types import FrameType
+from typing import Any, Optional, Set
+
+from fastapi import FastAPI
+import uvicorn  # type: ignore
+
+from .listen import DEFAULT_HOST, DEFAULT_PORT, bind_sockets, close_sockets
+
+logger = logging.getLogger("cog")
+
+# A worker that keeps crashing straight away isn't restarted in a tight loop
+RESTART_DELAY_SECONDS = 1
+
+
+def serve_prefork(
+    app: FastAPI,
+    workers: int,
+    host: str = DEFAULT_HOST,
+    port: Optional[int] = DEFAULT_PORT,
+    unix_socket: Optional[str] = None,
+    **uvicorn_options: Any,
+) -> None:
+    """
+    Runs setup once in this process, then forks `workers` processes that each
+    serve `app` on the same sockets. See bind_sockets() for what they are.
+
+    The workers share the memory that setup allocated, like model weights,
+    copy-on-write, so it isn't duplicated unless a worker writes to it. This
+    is for models that run on the CPU: CUDA can't be used from a process
+    that's forked after it's been initialised.
+
+    Workers that exit are restarted. SIGINT and SIGTERM are passed on to the
+    workers, and this returns once they've all exited.
+
+    Each worker has its own state, so an app from create_app() refuses
+    asynchronous predictions, which could be fetched from any worker, and
+    doesn't serve /metrics.
+
+    Raises ValueError if `app` runs predictions in a RunnerPool, because its
+    subprocesses can only be used by the process that started them.
+    """
+    if getattr(app.state, "runner_pool", None) is not None:
+        raise ValueError("serve_prefork() can't be used with a RunnerPool")
+    app.state.workers = workers
+    app.state.run_setup()
+
+    sockets = bind_sockets(host, port, unix_socket)
+
+    # Moves everything that's been allocated so far out of the garbage
+    # collector's reach, so collections in the workers don't write to the
+    # pages it's on and copy them
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+
+    config = uvicorn.Config(app, **uvicorn_options)
+    children: Set[int] = set()
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            # the parent's handlers are replaced by uvicorn's
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                uvicorn.Server(config).run(sockets=sockets)
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum: int, frame: Optional[FrameType]) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        spawn()
+    logger.info(f"Started {workers} workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logger.warning(
+                f"Worker {pid} exited with status {status}, starting a new one"
+            )
+            time.sleep(RESTART_DELAY_SECONDS)
+            if not stopping:
+                spawn()
+    close_sockets(sockets, unix_socket)
@@ -6,6 +6,7 @@ from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional, Tuple
 import signal
 import sys
+import threading
 import traceback
 import time
 import types
@@ -15,10 +16,21 @@ from pydantic import ValidationError
 import redis
 import requests
 
-from ..predictor import BasePredictor, get_input_type, load_predictor, load_config
-from ..json import upload_files
+from ..predictor import (
+    BaseInput,
+    BasePredictor,
+    get_input_type,
+    load_predictor,
+    load_config,
+)
+from ..json import dumps, encode_json
 from ..response import Status
+from .compression import MIN_COMPRESS_BYTES, check_encoding, compress_body
+from .metrics import BusyTracker, RollingWindow, format_prometheus, start_metrics_server
+from .output_cleanup import OutputCleaner, find_output_files
+from .result_cache import make_result_cache
 from .runner import PredictionRunner
+from .single_flight import RedisSingleFlight
 
 from opentelemetry import trace
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter  # type: ignore
@@ -28,11 +40,21 @@ from opentelemetry.trace import Status as TraceStatus, StatusCode
 from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
 
 
+class PredictorCrashed(Exception):
+    """
+    The predictor subprocess died while it was running a prediction.
+    """
+
+
 class RedisQueueWorker:
     SETUP_TIME_QUEUE_SUFFIX = "-setup-time"
     RUN_TIME_QUEUE_SUFFIX = "-run-time"
+    DEAD_LETTER_QUEUE_SUFFIX = "-dead-letter"
+    METRICS_KEY_SUFFIX = "-metrics"
     STAGE_SETUP = "setup"
     STAGE_RUN = "run"
+    # How many seconds apart a coalesced prediction checks for new waiters
+    WAITERS_CHECK_INTERVAL = 1.0
 
     def __init__(
         self,
@@ -46,6 +68,14 @@ class RedisQueueWorker:
         log_queue: Optional[str] = None,
         predict_timeout: Optional[int] = None,
         redis_db: int = 0,
+        max_delivery_attempts: Optional[int] = 3,
+        dead_letter_queue: Optional[str] = None,
+        metrics_interval: float = 10,
+        metrics_port: Optional[int] = None,
+        cache_size: int = 128,
+        cache_ttl: float = 60 * 60,
+        response_compression: Optional[str] = None,
+        compression_threshold: int = MIN_COMPRESS_BYTES,
     ):
         self.runner = PredictionRunner(predict_timeout=predict_timeout)
         self.redis_host = redis_host
@@ -63,6 +93,19 @@ class RedisQueueWorker:
         else:
             # retry after 10 minutes by default
             self.autoclaim_messages_after = 10 * 60
+        # Messages that keep getting autoclaimed are most likely crashing the
+        # worker, so after this many deliveries they get moved to the dead
+        # letter queue instead of being retried again
+        self.max_delivery_attempts = max_delivery_attempts
+        if dead_letter_queue is None:
+            dead_letter_queue = input_queue + self.DEAD_LETTER_QUEUE_SUFFIX
+        self.dead_letter_queue = dead_letter_queue
+        # Responses at least `compression_threshold` bytes long are
+        # compressed with this, if it's set
+        if response_compression is not None:
+            check_encoding(response_compression)
+        self.response_compression = response_compression
+        self.compression_threshold = compression_threshold
 
         # Set up types
         self.InputType = get_input_type(predictor)
@@ -70,12 +113,45 @@ class RedisQueueWorker:
         self.redis = redis.Redis(
             host=self.redis_host, port=self.redis_port, db=self.redis_db
         )
+        # If the predictor is deterministic, cache outputs locally and in
+        # Redis so they can be shared between workers
+        self.result_cache = make_result_cache(
+            predictor,
+            version=model_id,
+            max_size=cache_size,
+            ttl=cache_ttl,
+            redis_client=self.redis,
+        )
+        # Identical deterministic predictions that arrive while one is running
+        # are attached to it instead of being run again. The lease outlasts
+        # the time before a message is autoclaimed, so if the worker running
+        # it dies, the retry takes the lease over.
+        if getattr(predictor, "deterministic", False):
+            self.single_flight: Optional[RedisSingleFlight] = RedisSingleFlight(
+                self.redis, lease_seconds=self.autoclaim_messages_after * 2
+            )
+        else:
+            self.single_flight = None
+        # output files are deleted once they've been uploaded
+        self.output_cleaner = OutputCleaner()
         self.should_exit = False
         self.setup_time_queue = input_queue + self.SETUP_TIME_QUEUE_SUFFIX
         self.predict_time_queue = input_queue + self.RUN_TIME_QUEUE_SUFFIX
         self.stats_queue_length = 100
         self.tracer = trace.get_tracer("cog")
 
+        # Rolling metrics, published to a Redis key every `metrics_interval`
+        # seconds so they can be used for autoscaling
+        self.metrics_key = f"{input_queue}{self.METRICS_KEY_SUFFIX}:{consumer_id}"
+        self.metrics_interval = metrics_interval
+        self.metrics_port = metrics_port
+        self.metrics: Dict[str, Any] = {}
+        self.setup_time: Optional[float] = None
+        self.time_in_queue_window = RollingWindow()
+        self.run_time_window = RollingWindow()
+        self.expired_window = RollingWindow()
+        self.busy = BusyTracker()
+
         sys.stderr.write(
             f"Connected to Redis: {self.redis_host}:{self.redis_port} (db {self.redis_db})\n"
         )
@@ -101,7 +177,21 @@ class RedisQueueWorker:
         if raw_messages and raw_messages[0] is not None and len(raw_messages[0]) == 2:
             key, raw_message = raw_messages[0]
             assert raw_message[0] == b"value"
-            return key.decode(), raw_message[1].decode()
+            message_id, message_json = key.decode(), raw_message[1].decode()
+
+            delivery_count = self.get_delivery_count(message_id)
+            if (
+                self.max_delivery_attempts is not None
+                and delivery_count > self.max_delivery_attempts
+            ):
+                self.dead_letter(
+                    message_id,
+                    message_json,
+                    f"Prediction did not complete after {delivery_count - 1} attempts. The input may be crashing the model.",
+                )
+                return None, None
+
+            return message_id, message_json
 
         # if no old messages exist, get message from main queue
         raw_messages = self.redis.xreadgroup(
@@ -118,6 +208,63 @@ class RedisQueueWorker:
         key, raw_message = raw_messages[0][1][0]
         return key.decode(), raw_message[b"value"].decode()
 
+    def get_delivery_count(self, message_id: str) -> int:
+        """
+        Returns how many times a pending message has been delivered to a
+        consumer, using the delivery counter Redis keeps for each message.
+        """
+        pending = self.redis.xpending_range(
+            self.input_queue,
+            self.input_queue,
+            min=message_id,
+            max=message_id,
+            count=1,
+        )
+        if not pending:
+            return 0
+        return pending[0]["times_delivered"]
+
+    def dead_letter(self, message_id: str, message_json: str, reason: str) -> None:
+        """
+        Moves a message to the dead letter queue along with the reason it
+        failed, and sends a failed response to the client, and to the clients
+        of any identical messages that were waiting for it.
+        """
+        sys.stderr.write(
+            f"Moving message {message_id} to {self.dead_letter_queue}: {reason}\n"
+        )
+        self.redis.xadd(
+            self.dead_letter_queue,
+            fields={
+                "value": message_json,
+                "message_id": message_id,
+                "consumer_id": self.consumer_id,
+                "reason": reason,
+            },
+        )
+
+        response: Dict[str, Any] = {
+            "status": Status.FAILED,
+            "output": None,
+            "logs": [],
+            "error": reason,
+        }
+        try:
+            send_response = self.response_sender(json.loads(message_json))
+            send_response(response)
+        except Exception:
+            tb = traceback.format_exc()
+            sys.stderr.write(f"Failed to send response for dead letter: {tb}\n")
+
+        if self.single_flight is not None:
+            # otherwise they'd wait for it until the lease expired, and then
+            # get nothing
+            for waiter in self.single_flight.release_message(message_id):
+                self.send_to_waiter(waiter, response)
+
+        self.redis.xack(self.input_queue, self.input_queue, message_id)
+        self.redis.xdel(self.input_queue, message_id)
+
     def start(self) -> None:
         with self.tracer.start_as_current_span(name="redis_queue.setup") as span:
             signal.signal(signal.SIGTERM, self.signal_exit)
@@ -127,6 +274,7 @@ class RedisQueueWorker:
             self.runner.setup()
 
             setup_time = time.time() - start_time
+            self.setup_time = setup_time
             self.redis.xadd(
                 self.setup_time_queue,
                 fields={"duration": setup_time},
@@ -134,15 +282,18 @@ class RedisQueueWorker:
             )
             sys.stderr.write(f"Setup time: {setup_time:.2f}\n")
 
+        self.start_metrics()
+
         sys.stderr.write(f"Waiting for message on {self.input_queue}\n")
         while not self.should_exit:
             try:
                 message_id, message_json = self.receive_message()
-                if message_json is None:
+                if message_id is None or message_json is None:
                     # tight loop in order to respect self.should_exit
                     continue
 
-                time_in_queue = calculate_time_in_queue(message_id)  # type: ignore
+                time_in_queue = calculate_time_in_queue(message_id)
+                self.time_in_queue_window.add(time_in_queue)
                 message = json.loads(message_json)
 
                 # Check whether the incoming message includes details of an
@@ -162,12 +313,7 @@ class RedisQueueWorker:
                     context=context,
                     attributes={"time_in_queue": time_in_queue},
                 ) as span:
-                    webhook = message.get("webhook")
-                    if webhook is not None:
-                        send_response = self.webhook_caller(webhook)
-                    else:
-                        redis_key = message["response_queue"]
-                        send_response = self.redis_setter(redis_key)
+                    send_response = self.response_sender(message)
 
                     sys.stderr.write(
                         f"Received message {message_id} on {self.input_queue}\n"
@@ -178,23 +324,64 @@ class RedisQueueWorker:
                         "output": None,
                         "logs": [],
                     }
+
+                    # Don't spend any time downloading inputs or running the
+                    # model if nobody is waiting for the result any more
+                    try:
+                        expired = message_expired(message, time_in_queue)
+                    except ValueError as e:
+                        sys.stderr.write(f"Message {message_id} is invalid: {e}\n")
+                        response["status"] = Status.FAILED
+                        response["error"] = str(e)
+                        send_response(response)
+                        self.redis.xack(self.input_queue, self.input_queue, message_id)
+                        self.redis.xdel(self.input_queue, message_id)
+                        continue
+                    if expired:
+                        sys.stderr.write(
+                            f"Message {message_id} expired after {time_in_queue:.2f}s in queue\n"
+                        )
+                        span.set_attribute("expired", True)
+                        self.expired_window.add(time_in_queue)
+                        response["status"] = Status.FAILED
+                        response["error"] = "Prediction expired before it started"
+                        send_response(response)
+                        self.redis.xack(self.input_queue, self.input_queue, message_id)
+                        self.redis.xdel(self.input_queue, message_id)
+                        continue
+
                     cleanup_functions: List[Callable] = []
+                    self.busy.start()
                     try:
                         start_time = time.time()
                         self.handle_message(
-                            send_response, response, message, cleanup_functions
+                            send_response,
+                            response,
+                            message_id,
+                            message,
+                            cleanup_functions,
                         )
                         self.redis.xack(self.input_queue, self.input_queue, message_id)
                         self.redis.xdel(
                             self.input_queue, message_id
                         )  # xdel to be able to get stream size
                         run_time = time.time() - start_time
+                        self.run_time_window.add(run_time)
                         self.redis.xadd(
                             self.predict_time_queue,
                             fields={"duration": run_time},
                             maxlen=self.stats_queue_length,
                         )
                         sys.stderr.write(f"Run time for {message_id}: {run_time:.2f}\n")
+                    except PredictorCrashed as e:
+                        # The message isn't acked, so it's retried once it's
+                        # been pending for long enough, and dead-lettered if
+                        # it keeps crashing the predictor
+                        sys.stderr.write(
+                            f"Predictor crashed running {message_id}, leaving it to be retried: {e}\n"
+                        )
+                        span.record_exception(e)
+                        self.restart_runner()
                     except Exception as e:
                         response["status"] = Status.FAILED
                         response["error"] = str(e)
@@ -205,6 +392,7 @@ class RedisQueueWorker:
                         self.redis.xack(self.input_queue, self.input_queue, message_id)
                         self.redis.xdel(self.input_queue, message_id)
                     finally:
+                        self.busy.stop()
                         for cleanup_function in cleanup_functions:
                             try:
                                 cleanup_function()
@@ -216,11 +404,95 @@ class RedisQueueWorker:
 
         sys.stderr.write("Closing runner, bye bye!\n")
         self.runner.close()
+        self.output_cleaner.close()
+
+    def restart_runner(self) -> None:
+        """
+        Replaces a runner whose subprocess has died. If the new one can't be
+        set up, the worker exits, and the messages it left pending are
+        retried by other workers.
+        """
+        try:
+            self.runner = PredictionRunner(predict_timeout=self.predict_timeout)
+            self.runner.setup()
+        except Exception:
+            tb = traceback.format_exc()
+            sys.stderr.write(f"Failed to restart predictor, exiting: {tb}\n")
+            self.should_exit = True
+
+    def start_metrics(self) -> None:
+        """
+        Starts publishing metrics in a background thread, and serving them in
+        the Prometheus format if `metrics_port` is set.
+        """
+
+        def publish_loop() -> None:
+            while not self.should_exit:
+                try:
+                    self.publish_metrics()
+                except Exception:
+                    tb = traceback.format_exc()
+                    sys.stderr.write(f"Failed to publish metrics: {tb}\n")
+                time.sleep(self.metrics_interval)
+
+        threading.Thread(target=publish_loop, daemon=True).start()
+
+        if self.metrics_port is not None:
+            start_metrics_server(
+                self.metrics_port,
+                lambda: format_prometheus(
+                    self.metrics,
+                    prefix="cog_queue_",
+                    labels={"queue": self.input_queue, "consumer": self.consumer_id},
+                ),
+            )
+            sys.stderr.write(f"Serving metrics on port {self.metrics_port}\n")
+
+    def collect_metrics(self) -> Dict[str, Any]:
+        queue_length = self.redis.xlen(self.input_queue)
+
+        pending = 0
+        lag = None
+        for group in self.redis.xinfo_groups(self.input_queue):
+            name = group["name"]
+            if isinstance(name, bytes):
+                name = name.decode()
+            if name == self.input_queue:
+                pending = group["pending"]
+                # lag was added to XINFO GROUPS in Redis 7
+                lag = group.get("lag")
+        if lag is None:
+            # processed messages are deleted, so anything that isn't pending
+            # hasn't been delivered yet
+            lag = queue_length - pending
+
+        return {
+            "queue_length": queue_length,
+            "pending": pending,
+            "lag": lag,
+            "setup_time_seconds": self.setup_time,
+            "time_in_queue_seconds": self.time_in_queue_window.summary(),
+            "run_time_seconds": self.run_time_window.summary(),
+            "throughput_per_second": self.busy.completed() / self.busy.window,
+            "expired_per_second": self.expired_window.rate(),
+            "busy_ratio": self.busy.ratio(),
+            "timestamp": time.time(),
+        }
+
+    def publish_metrics(self) -> None:
+        self.metrics = self.collect_metrics()
+        self.redis.set(
+            self.metrics_key,
+            json.dumps(self.metrics),
+            # let the metrics of dead workers expire
+            ex=max(1, int(self.metrics_interval * 3)),
+        )
 
     def handle_message(
         self,
         send_response: Callable,
         response: Dict[str, Any],
+        message_id: str,
         message: Dict[str, Any],
         cleanup_functions: List[Callable],
     ) -> None:
@@ -240,6 +512,87 @@ class RedisQueueWorker:
 
         cleanup_functions.append(input_obj.cleanup)
 
+        prediction_key = None
+        if self.result_cache is not None:
+            prediction_key = self.result_cache.key(input_obj.dict())
+            if prediction_key is not None:
+                hit, output = self.result_cache.get(prediction_key)
+                if hit:
+                    span.add_event("used cached output")
+                    now = datetime.datetime.now().isoformat()
+                    response["status"] = Status.SUCCEEDED
+                    response["output"] = output
+                    response["x-experimental-timestamps"] = {
+                        "started_at": now,
+                        "completed_at": now,
+                    }
+                    send_response(response)
+                    return
+
+        if self.single_flight is None or prediction_key is None:
+            self.run_prediction(send_response, response, input_obj, prediction_key)
+            return
+
+        # if this message is being retried, it takes over its own lease
+        while not self.single_flight.acquire(prediction_key, message_id):
+            if self.single_flight.attach(prediction_key, response_destination(message)):
+                # the worker running it will send responses for this message
+                span.add_event("attached to in-flight prediction")
+                sys.stderr.write("Attached to identical in-flight prediction\n")
+                return
+            # the other prediction finished in the meantime, so try again
+
+        # Waiters only ever get added to the end of the list, so this fetches
+        # the new ones every so often instead of the whole list every time a
+        # response is sent. Waiters that attach in between get the next one.
+        waiters: List[Dict[str, Any]] = []
+        waiters_checked_at: Optional[float] = None
+
+        def send_response_to_all(response: Dict[str, Any]) -> None:
+            nonlocal waiters_checked_at
+            send_response(response)
+            now = time.monotonic()
+            if (
+                waiters_checked_at is None
+                or now - waiters_checked_at >= self.WAITERS_CHECK_INTERVAL
+            ):
+                waiters.extend(
+                    self.single_flight.waiters(prediction_key, start=len(waiters))  # type: ignore
+                )
+                waiters_checked_at = now
+            for waiter in waiters:
+                self.send_to_waiter(waiter, response)
+
+        try:
+            self.run_prediction(
+                send_response_to_all, response, input_obj, prediction_key
+            )
+        except PredictorCrashed:
+            # the retry takes over the lease and the waiters
+            raise
+        except Exception as e:
+            # start() sends the error to this message's client
+            failed_response = dict(response, status=Status.FAILED, error=str(e))
+            for waiter in self.single_flight.release(prediction_key, message_id):
+                self.send_to_waiter(waiter, failed_response)
+            raise
+        else:
+            # waiters that attached after the final response was sent
+            all_waiters = self.single_flight.release(prediction_key, message_id)
+            for waiter in all_waiters[len(waiters) :]:
+                self.send_to_waiter(waiter, response)
+
+    def run_prediction(
+        self,
+        send_response: Callable,
+        response: Dict[str, Any],
+        input_obj: BaseInput,
+        prediction_key: Optional[str],
+    ) -> None:
+        span = trace.get_current_span()
+
+        # output files from before this are left alone
+        started_at = time.time()
         self.runner.run(**input_obj.dict())
 
         response["x-experimental-timestamps"] = {
@@ -258,6 +611,7 @@ class RedisQueueWorker:
                 send_response(response)
 
         if self.runner.error() is not None:
+            self.raise_if_crashed()
             response["status"] = Status.FAILED
             response["error"] = str(self.runner.error())  # type: ignore
             response["x-experimental-timestamps"][
@@ -276,9 +630,10 @@ class RedisQueueWorker:
             while self.runner.is_processing():
                 # TODO: restructure this to avoid the tight CPU-eating loop
                 if self.runner.has_output_waiting() or self.runner.has_logs_waiting():
-                    # Object has already passed through `make_encodeable()` in the Runner, so all we need to do here is upload the files
+                    # Object has already passed through `make_encodeable()` in the Runner, so all encode_json() has left to do is upload the files
                     new_output = [
-                        self.upload_files(o) for o in self.runner.read_output()
+                        self.upload_files(o, started_at)
+                        for o in self.runner.read_output()
                     ]
                     new_logs = self.runner.read_logs()
 
@@ -296,6 +651,7 @@ class RedisQueueWorker:
                     send_response(response)
 
             if self.runner.error() is not None:
+                self.raise_if_crashed()
                 response["status"] = Status.FAILED
                 response["error"] = str(self.runner.error())  # type: ignore
                 response["x-experimental-timestamps"][
@@ -312,9 +668,13 @@ class RedisQueueWorker:
             response["x-experimental-timestamps"][
                 "completed_at"
             ] = datetime.datetime.now().isoformat()
-            output.extend(self.upload_files(o) for o in self.runner.read_output())
+            output.extend(
+                self.upload_files(o, started_at) for o in self.runner.read_output()
+            )
             logs.extend(self.runner.read_logs())
             send_response(response)
+            if prediction_key is not None:
+                self.result_cache.set(prediction_key, output)  # type: ignore
 
         else:
             # just send logs until output ends
@@ -324,6 +684,7 @@ class RedisQueueWorker:
                     send_response(response)
 
             if self.runner.error() is not None:
+                self.raise_if_crashed()
                 response["status"] = Status.FAILED
                 response["error"] = str(self.runner.error())  # type: ignore
                 response["x-experimental-timestamps"][
@@ -341,34 +702,85 @@ class RedisQueueWorker:
             response["x-experimental-timestamps"][
                 "completed_at"
             ] = datetime.datetime.now().isoformat()
-            response["output"] = self.upload_files(output[0])
+            response["output"] = self.upload_files(output[0], started_at)
             logs.extend(self.runner.read_logs())
             send_response(response)
+            if prediction_key is not None:
+                self.result_cache.set(prediction_key, response["output"])  # type: ignore
+
+    def raise_if_crashed(self) -> None:
+        """
+        Raises PredictorCrashed if the prediction failed because the
+        predictor subprocess died, rather than because predict() raised.
+        """
+        if not self.runner.is_alive():
+            raise PredictorCrashed(str(self.runner.error()))
 
     def download(self, url: str) -> bytes:
         resp = requests.get(url)
         resp.raise_for_status()
         return resp.content
 
+    def response_sender(self, message: Dict[str, Any]) -> Callable:
+        webhook = message.get("webhook")
+        if webhook is not None:
+            return self.webhook_caller(webhook)
+        return self.redis_setter(message["response_queue"])
+
+    def send_to_waiter(self, waiter: Dict[str, Any], response: Dict[str, Any]) -> None:
+        try:
+            self.response_sender(waiter)(response)
+        except Exception:
+            tb = traceback.format_exc()
+            sys.stderr.write(f"Failed to send response to waiter: {tb}\n")
+
     def webhook_caller(self, webhook: str) -> Callable:
         def caller(response: Any) -> None:
-            requests.post(webhook, json=response)
+            body, encoding = self.encode_response(response)
+            headers = {"Content-Type": "application/json"}
+            if encoding is not None:
+                headers["Content-Encoding"] = encoding
+            requests.post(webhook, data=body, headers=headers)
 
         return caller
 
     def redis_setter(self, redis_key: str) -> Callable:
         def setter(response: Any) -> None:
-            self.redis.set(redis_key, json.dumps(response))
+            # if it's compressed, the magic number at the start says how
+            self.redis.set(redis_key, self.encode_response(response)[0])
 
         return setter
 
-    def upload_files(self, obj: Any) -> Any:
+    def encode_response(self, response: Any) -> Tuple[bytes, Optional[str]]:
+        """
+        Serialises a response as JSON, compressed if it's big enough and
+        response compression is on. Returns the body and the encoding it was
+        compressed with, if it was.
+        """
+        return compress_body(
+            dumps(response), self.response_compression, self.compression_threshold
+        )
+
+    def upload_files(self, obj: Any, since: float) -> Any:
         def upload_file(fh: io.IOBase) -> str:
             resp = requests.put(self.upload_url, files={"file": fh})
             resp.raise_for_status()
             return resp.json()["url"]
 
-        return upload_files(obj, upload_file)
+        output_paths = find_output_files(obj, since)
+        try:
+            return encode_json(obj, upload_file)
+        finally:
+            self.output_cleaner.release(output_paths)
+
+
+def response_destination(message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the fields of a message that say where to send responses.
+    """
+    return {
+        key: message[key] for key in ("webhook", "response_queue") if key in message
+    }
 
 
 def calculate_time_in_queue(message_id: str) -> float:
@@ -381,6 +793,39 @@ def calculate_time_in_queue(message_id: str) -> float:
     return now - queue_time
 
 
+def message_expired(
+    message: Dict[str, Any], time_in_queue: float, now: Optional[float] = None
+) -> bool:
+    """
+    Returns True if the message's `deadline` (a Unix timestamp) has passed, or
+    it has spent longer than its `max_queue_time` (in seconds) in the queue.
+
+    Raises ValueError if either of them isn't a number.
+    """
+    if now is None:
+        now = time.time()
+
+    deadline = _parse_seconds(message, "deadline")
+    if deadline is not None and now > deadline:
+        return True
+
+    max_queue_time = _parse_seconds(message, "max_queue_time")
+    if max_queue_time is not None and time_in_queue > max_queue_time:
+        return True
+
+    return False
+
+
+def _parse_seconds(message: Dict[str, Any], field: str) -> Optional[float]:
+    value = message.get(field)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {field}, it must be a number: {value!r}")
+
+
 def _queue_worker_from_argv(
     predictor: BasePredictor,
     redis_host: str,
@@ -391,16 +836,32 @@ def _queue_worker_from_argv(
     model_id: str,
     log_queue: str,
     predict_timeout: Optional[str] = None,
+    max_delivery_attempts: Optional[str] = None,
+    dead_letter_queue: Optional[str] = None,
+    metrics_port: Optional[str] = None,
+    response_compression: Optional[str] = None,
+    compression_threshold: Optional[str] = None,
 ) -> RedisQueueWorker:
     """
     Construct a RedisQueueWorker object from sys.argv, taking into account optional arguments and types.
 
     This is intensely fragile. This should be kwargs or JSON or something like that.
     """
-    if predict_timeout is not None:
+    if predict_timeout:
         predict_timeout_int = int(predict_timeout)
     else:
         predict_timeout_int = None
+    kwargs: Dict[str, Any] = {}
+    if max_delivery_attempts:
+        kwargs["max_delivery_attempts"] = int(max_delivery_attempts)
+    if dead_letter_queue:
+        kwargs["dead_letter_queue"] = dead_letter_queue
+    if metrics_port:
+        kwargs["metrics_port"] = int(metrics_port)
+    if response_compression:
+        kwargs["response_compression"] = response_compression
+    if compression_threshold:
+        kwargs["compression_threshold"] = int(compression_threshold)
     return RedisQueueWorker(
         predictor,
         redis_host,
@@ -411,6 +872,7 @@ def _queue_worker_from_argv(
         model_id,
         log_queue,
         predict_timeout_int,
+        **kwargs,
     )
 
 
@@ -0,0 +1,206 @@
+from collections import OrderedDict
+import hashlib
+import inspect
+import io
+import json
+import pathlib
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import redis
+
+from ..json import dumps
+from ..predictor import BasePredictor
+
+
+class LocalCache:
+    """
+    An in-memory LRU cache with a maximum number of entries and a TTL.
+    """
+
+    def __init__(self, max_size: int = 128, ttl: Optional[float] = 60 * 60) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl if self.ttl is not None else float("inf")
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+class RedisCache:
+    """
+    A cache stored in Redis, so it can be shared between workers. Entries
+    expire after `ttl` seconds.
+    """
+
+    KEY_PREFIX = "cog-result-cache:"
+
+    def __init__(self, redis_client: redis.Redis, ttl: Optional[float] = 60 * 60):
+        self.redis = redis_client
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.redis.get(self.KEY_PREFIX + key)
+        if value is None:
+            return None
+        return value.decode("utf-8")
+
+    def set(self, key: str, value: str) -> None:
+        ex = max(1, int(self.ttl)) if self.ttl is not None else None
+        self.redis.set(self.KEY_PREFIX + key, value, ex=ex)
+
+
+class ResultCache:
+    """
+    Caches the encoded outputs of predictions, keyed by `input_hash()`.
+
+    The local cache is checked first, then Redis if there is a Redis backend.
+    Outputs bigger than `max_value_bytes` when encoded as JSON aren't cached.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        max_size: int = 128,
+        ttl: Optional[float] = 60 * 60,
+        max_value_bytes: int = 1024 * 1024,
+        redis_client: Optional[redis.Redis] = None,
+    ) -> None:
+        self.version = version
+        self.max_value_bytes = max_value_bytes
+        self.local = LocalCache(max_size=max_size, ttl=ttl)
+        self.remote = RedisCache(redis_client, ttl=ttl) if redis_client else None
+
+    def key(self, inputs: Dict[str, Any], *extra: Optional[str]) -> Optional[str]:
+        return input_hash(inputs, self.version, *extra)
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Returns a tuple of whether there was a cached output, and the output.
+        """
+        value = self.local.get(key)
+        if value is None and self.remote is not None:
+            value = self.remote.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        if value is None:
+            return False, None
+        return True, json.loads(value)
+
+    def set(self, key: str, output: Any) -> None:
+        value = dumps(output).decode("utf-8")
+        if len(value) > self.max_value_bytes:
+            return
+        self.local.set(key, value)
+        if self.remote is not None:
+            self.remote.set(key, value)
+
+
+def make_result_cache(
+    predictor: BasePredictor,
+    version: Optional[str] = None,
+    max_size: int = 128,
+    ttl: Optional[float] = 60 * 60,
+    redis_client: Optional[redis.Redis] = None,
+) -> Optional[ResultCache]:
+    """
+    Returns a ResultCache for the predictor, or None if the predictor hasn't
+    declared itself deterministic.
+    """
+    if not getattr(predictor, "deterministic", False):
+        return None
+    if version is None:
+        version = get_model_version(predictor)
+    return ResultCache(version, max_size=max_size, ttl=ttl, redis_client=redis_client)
+
+
+def get_model_version(predictor: BasePredictor) -> str:
+    """
+    Identifies the model by a hash of the file that defines the predictor, so
+    results aren't shared between different versions of the code.
+    """
+    h = hashlib.sha256()
+    h.update(type(predictor).__qualname__.encode("utf-8"))
+    try:
+        source_file = inspect.getsourcefile(type(predictor))
+    except (TypeError, OSError):
+        source_file = None
+    if source_file is not None:
+        with open(source_file, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def input_hash(
+    inputs: Dict[str, Any], version: str, *extra: Optional[str]
+) -> Optional[str]:
+    """
+    Hashes validated inputs, so identical requests have identical hashes.
+
+    Files are hashed by their contents rather than their temporary paths.
+    Returns None if the inputs can't be hashed without consuming them, such as
+    a file being streamed from a URL.
+    """
+    normalised = {}
+    for name, value in inputs.items():
+        if isinstance(value, (pathlib.Path, io.IOBase)):
+            digest = file_hash(value)
+            if digest is None:
+                return None
+            normalised[name] = {"sha256": digest}
+        else:
+            normalised[name] = value
+
+    h = hashlib.sha256()
+    h.update(
+        json.dumps([version, normalised, extra], sort_keys=True, default=str).encode(
+            "utf-8"
+        )
+    )
+    return h.hexdigest()
+
+
+def file_hash(f: Any) -> Optional[str]:
+    if isinstance(f, pathlib.Path):
+        with f.open("rb") as fh:
+            return _hash_stream(fh)
+
+    if not f.seekable():
+        return None
+    position = f.tell()
+    digest = _hash_stream(f)
+    f.seek(position)
+    return digest
+
+
+def _hash_stream(f: Any) -> str:
+    h = hashlib.sha256()
+    while True:
+        chunk = f.read(1024 * 1024)
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        h.update(chunk)
+    return h.hexdigest()
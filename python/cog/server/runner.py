@@ -61,7 +61,9 @@ class PredictionRunner:
         SINGLE = 1
         GENERATOR = 2
 
-    def __init__(self, predict_timeout: Optional[int] = None) -> None:
+    def __init__(
+        self, predict_timeout: Optional[int] = None, own_process_group: bool = False
+    ) -> None:
         self.logs_pipe_reader, self.logs_pipe_writer = multiprocessing.Pipe(
             duplex=False
         )
@@ -79,6 +81,11 @@ class PredictionRunner:
             duplex=False
         )
         self.predict_timeout = predict_timeout
+        # If the subprocess is in a process group of its own, killing it also
+        # kills the log processes it starts, but it no longer gets signals
+        # sent to the group it was started from, like Ctrl-C in a terminal
+        self.own_process_group = own_process_group
+        self._error: Any = None
 
     def setup(self) -> None:
         """
@@ -102,11 +109,17 @@ class PredictionRunner:
         self._is_processing = True
         self.predictor_process.start()
 
-        # poll with an infinite timeout to avoid burning resources in the loop
-        while self.done_pipe_reader.poll(timeout=None) and self.is_processing():
-            pass
+        # wait with an infinite timeout to avoid burning resources in the loop
+        while self.is_processing():
+            self.wait()
+
+        if not self.is_alive():
+            raise RuntimeError("Predictor process exited during setup")
 
     def _start_predictor_process(self, span_context: SpanContext = None) -> None:
+        if self.own_process_group:
+            os.setpgrp()
+
         # Enable OpenTelemetry if the env vars are present. If this block isn't
         # run, all the opentelemetry calls are no-ops. We have to initialize
         # this here again because we're running a new process.
@@ -186,8 +199,52 @@ class PredictionRunner:
             except EOFError:
                 pass
 
+        if self._is_processing and not self.is_alive():
+            # it crashed, or was killed, without sending the done token. This
+            # cleans up any log processes it left behind.
+            self.kill()
+            self._is_processing = False
+            self._error = RuntimeError(
+                f"Predictor process exited unexpectedly with exit code {self.predictor_process.exitcode}"
+            )
+
         return self._is_processing
 
+    def is_alive(self) -> bool:
+        return self.predictor_process.is_alive()
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """
+        Blocks until there's output, logs, an error or a done token waiting,
+        or the subprocess exits, or `timeout` seconds have passed.
+        """
+        multiprocessing.connection.wait(
+            [
+                self.predictor_pipe_reader,
+                self.logs_pipe_reader,
+                self.error_pipe_reader,
+                self.done_pipe_reader,
+                self.predictor_process.sentinel,
+            ],
+            timeout=timeout,
+        )
+
+    def kill(self) -> None:
+        """
+        Kills the subprocess, for when a prediction doesn't respond to the
+        timeout. The processes it started are killed too if it's in a process
+        group of its own.
+        """
+        assert self.predictor_process.pid is not None
+        try:
+            if self.own_process_group:
+                os.killpg(self.predictor_process.pid, signal.SIGKILL)
+            else:
+                os.kill(self.predictor_process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.predictor_process.join()
+
     def has_output_waiting(self) -> bool:
         return self.predictor_pipe_reader.poll()
 
@@ -0,0 +1,228 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Set
+
+from .runner import PredictionRunner
+
+logger = logging.getLogger("cog")
+
+# How long a prediction gets to stop by itself after it has timed out, before
+# its subprocess is killed
+KILL_GRACE_SECONDS = 5
+
+RESTART_DELAY_SECONDS = 5
+
+# A subprocess that crashes doesn't always wake up `PredictionRunner.wait()`,
+# because processes it started can hold its sentinel open, so check on it at
+# least this often
+LIVENESS_CHECK_SECONDS = 1
+
+
+class PredictionError(Exception):
+    """
+    Raised when a prediction running in a subprocess fails, times out or
+    crashes.
+    """
+
+
+class PredictionCancelled(PredictionError):
+    """
+    Raised when a prediction is cancelled before it finishes.
+    """
+
+
+class RunnerPool:
+    """
+    Runs predictions in a pool of PredictionRunner subprocesses, so they can
+    be timed out, have their logs captured, and crash without taking the
+    server down.
+
+    A runner whose subprocess exits is replaced in the background.
+    """
+
+    def __init__(self, size: int = 1, predict_timeout: Optional[int] = None) -> None:
+        self.size = size
+        self.predict_timeout = predict_timeout
+        # the runners that are free to run a prediction
+        self.runners: "queue.Queue[PredictionRunner]" = queue.Queue()
+        # all the runners, including the ones running predictions
+        self.all_runners: Set[PredictionRunner] = set()
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def setup(self) -> None:
+        """
+        Starts the subprocesses. Blocks until all of them have finished setup.
+        """
+        for _ in range(self.size):
+            self.runners.put(self.start_runner())
+
+    def start_runner(self) -> PredictionRunner:
+        # in their own process groups, so the log processes are killed along
+        # with them when they're killed
+        runner = PredictionRunner(
+            predict_timeout=self.predict_timeout, own_process_group=True
+        )
+        runner.setup()
+        with self.lock:
+            self.all_runners.add(runner)
+        return runner
+
+    def predict(
+        self,
+        inputs: Dict[str, Any],
+        on_log: Optional[Callable[[str], None]] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> Any:
+        """
+        Runs a prediction in the first free runner, and returns its output.
+
+        If the predictor is a generator, this returns a generator of outputs
+        as soon as the first one is produced, and the runner is held until
+        the generator is exhausted or closed. Closing it early kills the
+        prediction.
+
+        Lines the predictor logs are passed to `on_log` as they're captured.
+        Raises PredictionError if the prediction fails.
+
+        If `cancelled` is set while the prediction is running, its subprocess
+        is killed and replaced, and this raises PredictionCancelled.
+        """
+        runner: Optional[PredictionRunner] = self.runners.get()
+        assert runner is not None
+        try:
+            runner.run(**inputs)
+            deadline = None
+            if self.predict_timeout is not None:
+                deadline = time.time() + self.predict_timeout + KILL_GRACE_SECONDS
+
+            while runner.is_output_generator() is None and runner.is_processing():
+                self.wait(runner, deadline, on_log, cancelled)
+
+            if runner.is_output_generator():
+                outputs = self.iterate_outputs(runner, deadline, on_log, cancelled)
+                # the generator releases the runner when it's done with it
+                runner = None
+                return outputs
+
+            while runner.is_processing():
+                self.wait(runner, deadline, on_log, cancelled)
+            forward_logs(runner, on_log)
+            raise_error(runner)
+            output = runner.read_output()
+            assert len(output) == 1
+            return output[0]
+        finally:
+            if runner is not None:
+                self.release(runner)
+
+    def iterate_outputs(
+        self,
+        runner: PredictionRunner,
+        deadline: Optional[float],
+        on_log: Optional[Callable[[str], None]],
+        cancelled: Optional[threading.Event],
+    ) -> Iterator[Any]:
+        try:
+            while runner.is_processing():
+                yield from runner.read_output()
+                self.wait(runner, deadline, on_log, cancelled)
+            yield from runner.read_output()
+            forward_logs(runner, on_log)
+            raise_error(runner)
+        finally:
+            self.release(runner)
+
+    def wait(
+        self,
+        runner: PredictionRunner,
+        deadline: Optional[float],
+        on_log: Optional[Callable[[str], None]],
+        cancelled: Optional[threading.Event] = None,
+    ) -> None:
+        if cancelled is not None and cancelled.is_set():
+            # released runners that are still running are killed and
+            # replaced, which frees up the slot
+            runner.kill()
+            raise PredictionCancelled("Prediction was cancelled")
+        if deadline is not None and time.time() >= deadline:
+            # it didn't respond to the timeout in the subprocess, probably
+            # because it's stuck in native code
+            runner.kill()
+            raise PredictionError("Prediction timed out")
+        timeout: float = LIVENESS_CHECK_SECONDS
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+        runner.wait(timeout=timeout)
+        forward_logs(runner, on_log)
+
+    def release(self, runner: PredictionRunner) -> None:
+        if runner.is_alive() and runner.is_processing():
+            # the prediction was abandoned, and there's no way of stopping it
+            # other than killing it
+            runner.kill()
+
+        if runner.is_alive():
+            with self.lock:
+                if not self.closed:
+                    self.runners.put(runner)
+                    return
+            runner.close()
+            return
+
+        with self.lock:
+            self.all_runners.discard(runner)
+        logger.warning("Predictor process exited, starting a new one")
+        thread = threading.Thread(target=self.restart_runner, daemon=True)
+        thread.start()
+
+    def restart_runner(self) -> None:
+        while not self.closed:
+            try:
+                runner = self.start_runner()
+            except Exception:
+                logger.exception("Failed to start predictor process")
+                time.sleep(RESTART_DELAY_SECONDS)
+                continue
+            with self.lock:
+                if not self.closed:
+                    self.runners.put(runner)
+                    return
+            # the pool was closed while it was starting
+            runner.close()
+
+    def close(self) -> None:
+        """
+        Stops the subprocesses. Predictions that are still running are killed.
+        """
+        with self.lock:
+            self.closed = True
+            all_runners = list(self.all_runners)
+        while True:
+            try:
+                runner = self.runners.get_nowait()
+            except queue.Empty:
+                break
+            runner.close()
+            all_runners.remove(runner)
+        for runner in all_runners:
+            runner.kill()
+
+
+def forward_logs(
+    runner: PredictionRunner, on_log: Optional[Callable[[str], None]]
+) -> None:
+    # logs have to be read even if nobody wants them, otherwise the runner
+    # always looks like it has something waiting
+    logs = runner.read_logs()
+    if on_log is not None:
+        for line in logs:
+            on_log(line)
+
+
+def raise_error(runner: PredictionRunner) -> None:
+    error = runner.error()
+    if error is not None:
+        raise PredictionError(str(error))
@@ -0,0 +1,220 @@
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import redis
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.items: List[Any] = []
+        self.finished = False
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Makes sure only one call with a given key runs at a time in this process.
+    Callers that arrive while a call with the same key is running wait for it
+    to finish and get the same result, or the same exception.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        return self.do_streaming(key, lambda publish: fn())
+
+    def do_streaming(
+        self,
+        key: str,
+        fn: Callable[[Callable[[Any], None]], Any],
+        on_item: Optional[Callable[[Any], None]] = None,
+    ) -> Any:
+        """
+        Like `do()`, but `fn` is passed a function to publish items as it
+        produces them, such as the outputs of a generator. Every caller's
+        `on_item` is called with each item, including the items published
+        before the caller arrived.
+        """
+        with self.lock:
+            is_leader = key not in self.calls
+            if is_leader:
+                self.calls[key] = _Call()
+            call = self.calls[key]
+
+        if not is_leader:
+            return self._follow(call, on_item)
+
+        def publish(item: Any) -> None:
+            with call.condition:
+                call.items.append(item)
+                call.condition.notify_all()
+            if on_item is not None:
+                on_item(item)
+
+        try:
+            call.result = fn(publish)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            with call.condition:
+                call.finished = True
+                call.condition.notify_all()
+
+    def _follow(self, call: _Call, on_item: Optional[Callable[[Any], None]]) -> Any:
+        index = 0
+        while True:
+            with call.condition:
+                while index == len(call.items) and not call.finished:
+                    call.condition.wait()
+                items = call.items[index:]
+                finished = call.finished
+            index += len(items)
+            if on_item is not None:
+                for item in items:
+                    on_item(item)
+            if finished:
+                break
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class RedisSingleFlight:
+    """
+    Coalesces identical predictions across queue workers.
+
+    The message that runs a prediction holds a lease on its key. Workers that
+    receive an identical message while the lease is held add the message's
+    response destination to a list of waiters instead of running it, and the
+    worker running the prediction sends every response to the waiters too.
+
+    The lease is owned by the ID of the message rather than the worker, so
+    if the worker dies and the message is retried, the retry takes over the
+    lease and the waiters. That means `lease_seconds` has to be longer than
+    a message is left pending before it's retried.
+    """
+
+    KEY_PREFIX = "cog-in-flight:"
+    MESSAGE_KEY_PREFIX = "cog-in-flight-message:"
+
+    # The message that owns the lease can take it again, which also renews
+    # it. Which key each message holds is kept too, so the lease can be
+    # released for a message without working out its key from its inputs.
+    ACQUIRE_SCRIPT = """
+local owner = redis.call("GET", KEYS[1])
+if owner == false or owner == ARGV[1] then
+    redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+    redis.call("SET", KEYS[2], ARGV[3], "EX", ARGV[2])
+    return 1
+end
+return 0
+"""
+
+    # Checking the lease and adding the waiter has to be atomic, otherwise the
+    # lease could be released in between and the waiter would never get a
+    # response
+    ATTACH_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    redis.call("RPUSH", KEYS[2], ARGV[1])
+    redis.call("EXPIRE", KEYS[2], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+    # Only the owner can release the lease. If it expired and another
+    # message has taken it since, the waiters are left for that one.
+    RELEASE_SCRIPT = """
+local owner = redis.call("GET", KEYS[1])
+if owner ~= false and owner ~= ARGV[1] then
+    return {}
+end
+local waiters = redis.call("LRANGE", KEYS[2], 0, -1)
+redis.call("DEL", KEYS[1], KEYS[2], KEYS[3])
+return waiters
+"""
+
+    def __init__(self, redis_client: redis.Redis, lease_seconds: int) -> None:
+        self.redis = redis_client
+        self.lease_seconds = lease_seconds
+        self.acquire_script = self.redis.register_script(self.ACQUIRE_SCRIPT)
+        self.attach_script = self.redis.register_script(self.ATTACH_SCRIPT)
+        self.release_script = self.redis.register_script(self.RELEASE_SCRIPT)
+
+    def lease_key(self, key: str) -> str:
+        return self.KEY_PREFIX + key
+
+    def waiters_key(self, key: str) -> str:
+        return self.KEY_PREFIX + key + ":waiters"
+
+    def message_key(self, owner: str) -> str:
+        return self.MESSAGE_KEY_PREFIX + owner
+
+    def acquire(self, key: str, owner: str) -> bool:
+        """
+        Tries to take the lease for a key for the message with the ID
+        `owner`. Returns True if this worker should run the prediction.
+        """
+        return bool(
+            self.acquire_script(
+                keys=[self.lease_key(key), self.message_key(owner)],
+                args=[owner, self.lease_seconds, key],
+            )
+        )
+
+    def attach(self, key: str, waiter: Dict[str, Any]) -> bool:
+        """
+        Adds a waiter to the prediction running for a key. Returns False if no
+        prediction is running for the key.
+        """
+        # Waiters outlive the lease, so that if the worker running the
+        # prediction dies, whichever worker retries it picks them up
+        return bool(
+            self.attach_script(
+                keys=[self.lease_key(key), self.waiters_key(key)],
+                args=[json.dumps(waiter), self.lease_seconds * 2],
+            )
+        )
+
+    def waiters(self, key: str, start: int = 0) -> List[Dict[str, Any]]:
+        """
+        Returns the waiters for a key, from the `start`th one on.
+        """
+        waiters = self.redis.lrange(self.waiters_key(key), start, -1)
+        return [json.loads(w) for w in waiters]
+
+    def release(self, key: str, owner: str) -> List[Dict[str, Any]]:
+        """
+        Releases the lease for a key, if the message with the ID `owner`
+        still holds it, and returns all the waiters. Returns no waiters if
+        another message holds it.
+        """
+        waiters = self.release_script(
+            keys=[
+                self.lease_key(key),
+                self.waiters_key(key),
+                self.message_key(owner),
+            ],
+            args=[owner],
+        )
+        return [json.loads(w) for w in waiters]
+
+    def release_message(self, owner: str) -> List[Dict[str, Any]]:
+        """
+        Releases the lease held by the message with the ID `owner`, if it
+        holds one, and returns all the waiters.
+        """
+        key = self.redis.get(self.message_key(owner))
+        if key is None:
+            return []
+        return self.release(key.decode(), owner)
@@ -3,7 +3,6 @@ import mimetypes
 import os
 import base64
 import pathlib
-import requests
 import shutil
 import tempfile
 from typing import Any, Callable, Dict, Iterator, List, Union
@@ -12,6 +11,8 @@ from urllib.parse import urlparse
 from pydantic import Field
 from pydantic.typing import NoArgAnyCallable
 
+from .downloads import Download, download, is_http_url
+
 
 def Input(
     default: Any = ...,
@@ -59,6 +60,12 @@ class File(io.IOBase):
     def validate(cls, value: Any) -> io.IOBase:
         if isinstance(value, io.IOBase):
             return value
+        if isinstance(value, Download):
+            # started by BaseInput, along with the other inputs' downloads
+            path = value.result()
+            fh = open(path, "rb")
+            os.unlink(path)
+            return fh
 
         parsed_url = urlparse(value)
         if parsed_url.scheme == "data":
@@ -67,10 +74,11 @@ class File(io.IOBase):
             header, encoded = parsed_url.path.split(",", 1)
             return io.BytesIO(base64.b64decode(encoded))
         elif parsed_url.scheme == "http" or parsed_url.scheme == "https":
-            resp = requests.get(value, stream=True)
-            resp.raise_for_status()
-            resp.raw.decode_content = True
-            return resp.raw
+            path = download(value, suffix=get_filename(value))
+            # the open file keeps its contents after it's deleted
+            fh = open(path, "rb")
+            os.unlink(path)
+            return fh
         else:
             raise ValueError(
                 f"'{parsed_url.scheme}' is not a valid URL scheme. 'data', 'http', or 'https' is supported."
@@ -95,6 +103,11 @@ class Path(pathlib.PosixPath):
         if isinstance(value, pathlib.Path):
             return value
 
+        if isinstance(value, Download):
+            return cls(value.result())
+        if is_http_url(value):
+            return cls(download(value, suffix=get_filename(value)))
+
         src = File.validate(value)
         dest = tempfile.NamedTemporaryFile(suffix=get_filename(value), delete=False)
         shutil.copyfileobj(src, dest)
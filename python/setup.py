@@ -21,6 +21,7 @@ setuptools.setup(
         "opentelemetry-sdk>=1.11.1,<2",
         "protobuf<=3.20",
         "pydantic>=1,<2",
+        "python-multipart>=0.0.5,<1",
         "PyYAML",
         "redis>=4,<5",
         "requests>=2,<3",
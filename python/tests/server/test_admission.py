@@ -0,0 +1,46 @@
+import pytest
+
+from cog.server.admission import Admission, QueueFull
+
+
+def test_admission_rejects_when_queue_is_full():
+    admission = Admission(slots=1, max_queue_depth=1)
+    admission.admit()
+    started_at = admission.start(admitted_at=0.0)
+    admission.admit()
+
+    with pytest.raises(QueueFull):
+        admission.admit()
+
+    admission.finish(started_at)
+    # there's room again now one has finished
+    admission.admit()
+
+
+def test_admission_without_max_queue_depth_accepts_everything():
+    admission = Admission(slots=1)
+    for _ in range(100):
+        admission.admit()
+    assert admission.metrics()["queue_depth"] == 100
+
+
+def test_admission_retry_after_is_estimated_from_predict_time():
+    admission = Admission(slots=2, max_queue_depth=2)
+    admission.predict_time = 10.0
+    for _ in range(4):
+        admission.admit()
+    for _ in range(2):
+        admission.start(admitted_at=0.0)
+
+    with pytest.raises(QueueFull) as excinfo:
+        admission.admit()
+    # 2 waiting plus this one, shared between 2 slots
+    assert excinfo.value.retry_after == 15
+
+
+def test_admission_cancel():
+    admission = Admission(slots=1, max_queue_depth=0)
+    admission.admit()
+    admission.cancel()
+    admission.admit()
+    assert admission.metrics()["queue_depth"] == 1
@@ -0,0 +1,121 @@
+import gzip
+import json
+from typing import Iterator
+import zlib
+
+from fastapi.testclient import TestClient
+import pytest
+
+from cog import BasePredictor
+from cog.server import compression
+from cog.server.compression import (
+    GZIP,
+    ZSTD,
+    Compressor,
+    compress_body,
+    negotiate_encoding,
+)
+from cog.server.http import create_app
+
+
+def test_negotiate_encoding(monkeypatch):
+    monkeypatch.setattr(compression, "has_zstd", True)
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("gzip, deflate") == GZIP
+    assert negotiate_encoding("gzip, zstd") == ZSTD
+    assert negotiate_encoding("gzip;q=1.0, zstd;q=0.5") == GZIP
+    assert negotiate_encoding("zstd;q=0, *") == GZIP
+    assert negotiate_encoding("*") == ZSTD
+
+    monkeypatch.setattr(compression, "has_zstd", False)
+    assert negotiate_encoding("zstd") is None
+    assert negotiate_encoding("gzip, zstd") == GZIP
+
+
+def test_compress_body():
+    assert compress_body(b"x" * 10, GZIP, threshold=100) == (b"x" * 10, None)
+    assert compress_body(b"x" * 1000, None, threshold=100) == (b"x" * 1000, None)
+
+    body, encoding = compress_body(b"x" * 1000, GZIP, threshold=100)
+    assert encoding == GZIP
+    assert gzip.decompress(body) == b"x" * 1000
+
+
+def test_compressor_flushes_each_chunk():
+    compressor = Compressor(GZIP)
+    first = compressor.compress(b"hello ", final=False)
+    # everything so far can be decompressed before the rest arrives
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(first) == b"hello "
+    assert decompressor.decompress(compressor.compress(b"world", final=True)) == (
+        b"world"
+    )
+
+
+class Predictor(BasePredictor):
+    def predict(self, size: int) -> str:
+        return "x" * size
+
+
+def test_large_responses_are_compressed():
+    with TestClient(create_app(Predictor())) as client:
+        resp = client.post(
+            "/predictions",
+            json={"input": {"size": 10000}},
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert resp.status_code == 200
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert int(resp.headers["Content-Length"]) < 1000
+        assert resp.json()["output"] == "x" * 10000
+
+        resp = client.post(
+            "/predictions",
+            json={"input": {"size": 10}},
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert "Content-Encoding" not in resp.headers
+        assert resp.json()["output"] == "x" * 10
+
+        resp = client.post(
+            "/predictions",
+            json={"input": {"size": 10000}},
+            headers={"Accept-Encoding": "identity"},
+        )
+        assert "Content-Encoding" not in resp.headers
+
+
+def test_streamed_responses_are_compressed():
+    class StreamingPredictor(BasePredictor):
+        def predict(self, size: int) -> Iterator[str]:
+            for _ in range(3):
+                yield "x" * size
+
+    with TestClient(create_app(StreamingPredictor())) as client:
+        resp = client.post(
+            "/predictions",
+            json={"input": {"size": 10}},
+            headers={"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"},
+        )
+        assert resp.headers["Content-Encoding"] == "gzip"
+        events = [json.loads(line) for line in resp.text.splitlines()]
+        assert [e["data"] for e in events] == ["x" * 10] * 3 + [
+            {"status": "succeeded"}
+        ]
+
+
+@pytest.mark.skipif(not compression.has_zstd, reason="zstandard isn't installed")
+def test_zstd_responses():
+    import zstandard
+
+    with TestClient(create_app(Predictor())) as client:
+        resp = client.post(
+            "/predictions",
+            json={"input": {"size": 10000}},
+            headers={"Accept-Encoding": "zstd"},
+            stream=True,
+        )
+        assert resp.headers["Content-Encoding"] == "zstd"
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(resp.raw.read())
+        assert json.loads(body)["output"] == "x" * 10000
@@ -0,0 +1,191 @@
+import contextlib
+import json
+import threading
+from typing import Iterator
+
+import grpc
+import numpy as np
+import pytest
+
+from cog import BasePredictor, File, Path
+from cog.json import has_orjson
+from cog.server.grpc_server import (
+    Blob,
+    PredictEvent,
+    PredictRequest,
+    PredictResponse,
+    make_server,
+)
+from cog.server.http import create_app
+
+
+@contextlib.contextmanager
+def serve(predictor: BasePredictor, **kwargs) -> Iterator[grpc.Channel]:
+    app = create_app(predictor, **kwargs)
+    server, port = make_server(app, host="127.0.0.1", port=0)
+    app.state.start_setup()
+    server.start()
+    try:
+        with grpc.insecure_channel(f"127.0.0.1:{port}") as channel:
+            yield channel
+    finally:
+        server.stop(None)
+        app.state.shutdown()
+
+
+def predict(channel: grpc.Channel, **kwargs) -> PredictResponse:
+    call = channel.unary_unary(
+        "/cog.Predictor/Predict",
+        request_serializer=PredictRequest.SerializeToString,
+        response_deserializer=PredictResponse.FromString,
+    )
+    return call(PredictRequest(**kwargs), timeout=10)
+
+
+def predict_stream(channel: grpc.Channel, **kwargs) -> Iterator[PredictEvent]:
+    call = channel.unary_stream(
+        "/cog.Predictor/PredictStream",
+        request_serializer=PredictRequest.SerializeToString,
+        response_deserializer=PredictEvent.FromString,
+    )
+    return call(PredictRequest(**kwargs), timeout=10)
+
+
+def test_predict():
+    class Predictor(BasePredictor):
+        def predict(self, text: str, count: int = 1) -> str:
+            return text * count
+
+    with serve(Predictor()) as channel:
+        response = predict(channel, id="abc", input_json='{"text": "hi", "count": 2}')
+    assert response.id == "abc"
+    assert response.status == "succeeded"
+    assert json.loads(response.output_json) == "hihi"
+    assert response.error == ""
+
+
+def test_predict_invalid_input():
+    class Predictor(BasePredictor):
+        def predict(self, count: int) -> int:
+            return count
+
+    with serve(Predictor()) as channel:
+        with pytest.raises(grpc.RpcError) as e:
+            predict(channel, input_json='{"count": "lots"}')
+        assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+        with pytest.raises(grpc.RpcError) as e:
+            predict(channel, input_json="[1]")
+        assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+
+def test_predict_failed():
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            raise Exception("it broke")
+
+    with serve(Predictor()) as channel:
+        with pytest.raises(grpc.RpcError) as e:
+            predict(channel)
+    assert e.value.code() == grpc.StatusCode.INTERNAL
+    assert e.value.details() == "it broke"
+
+
+def test_file_inputs_and_outputs(tmp_path):
+    class Predictor(BasePredictor):
+        def predict(self, image: File, audio: Path) -> Path:
+            output = tmp_path / "output.txt"
+            output.write_bytes(image.read() + open(audio, "rb").read())
+            assert str(audio).endswith(".wav")
+            return Path(output)
+
+    with serve(Predictor()) as channel:
+        response = predict(
+            channel,
+            files=[
+                Blob(id="image", filename="in.png", data=b"\x89PNG"),
+                Blob(id="audio", filename="in.wav", data=b"RIFF"),
+            ],
+        )
+    assert response.status == "succeeded"
+    assert json.loads(response.output_json) == "cid:output.txt"
+    [blob] = response.blobs
+    assert blob.id == "output.txt"
+    assert blob.content_type == "text/plain"
+    assert blob.data == b"\x89PNGRIFF"
+
+
+@pytest.mark.skipif(not has_orjson, reason="arrays are lists without orjson")
+def test_array_outputs():
+    class Predictor(BasePredictor):
+        def predict(self) -> dict:
+            return {"embedding": np.arange(6, dtype=np.float32).reshape(2, 3)}
+
+    with serve(Predictor()) as channel:
+        response = predict(channel)
+    assert json.loads(response.output_json) == {"embedding": "cid:array-0"}
+    [blob] = response.blobs
+    assert list(blob.shape) == [2, 3]
+    array = np.frombuffer(blob.data, dtype=blob.dtype).reshape(blob.shape)
+    assert array.tolist() == [[0, 1, 2], [3, 4, 5]]
+
+
+def test_predict_stream():
+    class Predictor(BasePredictor):
+        def predict(self, count: int) -> Iterator[str]:
+            for i in range(count):
+                yield f"output {i}"
+
+    with serve(Predictor()) as channel:
+        events = list(predict_stream(channel, id="abc", input_json='{"count": 3}'))
+    assert [(e.id, e.event, json.loads(e.data_json)) for e in events] == [
+        ("abc", "output", "output 0"),
+        ("abc", "output", "output 1"),
+        ("abc", "output", "output 2"),
+        ("abc", "done", {"status": "succeeded"}),
+    ]
+
+
+def test_predict_stream_is_cancelled_when_client_cancels():
+    started = threading.Event()
+    stopped = threading.Event()
+
+    class Predictor(BasePredictor):
+        def predict(self) -> Iterator[int]:
+            try:
+                i = 0
+                while True:
+                    started.set()
+                    yield i
+                    i += 1
+            finally:
+                stopped.set()
+
+    with serve(Predictor()) as channel:
+        events = predict_stream(channel)
+        assert started.wait(timeout=5)
+        next(events)
+        events.cancel()
+        assert stopped.wait(timeout=5)
+
+
+def test_queue_full_is_unavailable():
+    started = threading.Event()
+    release = threading.Event()
+
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            started.set()
+            release.wait(timeout=10)
+            return "done"
+
+    with serve(Predictor(), max_queue_depth=0) as channel:
+        running = predict_stream(channel)
+        try:
+            assert started.wait(timeout=5)
+            with pytest.raises(grpc.RpcError) as e:
+                predict(channel)
+            assert e.value.code() == grpc.StatusCode.UNAVAILABLE
+        finally:
+            release.set()
+        assert [event.event for event in running] == ["output", "done"]
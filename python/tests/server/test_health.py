@@ -0,0 +1,106 @@
+import sys
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from cog import BasePredictor
+from cog.server.health import MAX_SETUP_LOG_LINES, Setup
+from cog.server.http import create_app
+
+
+def wait_for_setup(client: TestClient) -> dict:
+    for _ in range(100):
+        state = client.get("/health-check").json()
+        if state["status"] != "starting":
+            return state
+        time.sleep(0.05)
+    raise AssertionError("Setup didn't finish")
+
+
+def test_health_check_while_setup_runs():
+    setup_can_finish = threading.Event()
+
+    class Predictor(BasePredictor):
+        def setup(self):
+            print("loading weights")
+            setup_can_finish.wait()
+
+        def predict(self) -> str:
+            return "foo"
+
+    with TestClient(create_app(Predictor())) as client:
+        resp = client.get("/health-check")
+        assert resp.status_code == 503
+        assert resp.json()["status"] == "starting"
+
+        setup_can_finish.set()
+        # predictions that arrive during setup wait for it to finish
+        resp = client.post("/predictions")
+        assert resp.json() == {"status": "succeeded", "output": "foo"}
+
+        resp = client.get("/health-check")
+        assert resp.status_code == 200
+        state = resp.json()
+        assert state["status"] == "ready"
+        assert state["setup"]["logs"] == ["loading weights"]
+        assert state["setup"]["duration_seconds"] >= 0
+
+
+def test_health_check_when_setup_fails():
+    class Predictor(BasePredictor):
+        def setup(self):
+            raise ValueError("no weights")
+
+        def predict(self) -> str:
+            return "foo"
+
+    with TestClient(create_app(Predictor())) as client:
+        state = wait_for_setup(client)
+        assert state["status"] == "setup_failed"
+        assert state["setup"]["logs"][-1] == "ValueError: no weights"
+        assert client.get("/health-check").status_code == 503
+
+        resp = client.post("/predictions")
+        assert resp.status_code == 503
+        assert resp.json() == {"detail": "Setup failed"}
+
+
+def test_setup_only_keeps_the_last_log_lines():
+    def setup():
+        for i in range(MAX_SETUP_LOG_LINES + 10):
+            print(f"line {i}")
+
+    state = Setup()
+    state.run(setup)
+    logs = state.state()["setup"]["logs"]
+    assert len(logs) == MAX_SETUP_LOG_LINES
+    assert logs[-1] == f"line {MAX_SETUP_LOG_LINES + 9}"
+
+
+def test_setup_only_captures_its_own_output():
+    stdout = sys.stdout
+    other_thread_can_print = threading.Event()
+    other_thread_printed = threading.Event()
+
+    def print_from_another_thread():
+        other_thread_can_print.wait()
+        print("handling a request")
+        other_thread_printed.set()
+
+    def setup():
+        print("loading weights")
+        other_thread_can_print.set()
+        other_thread_printed.wait()
+
+    thread = threading.Thread(target=print_from_another_thread)
+    thread.start()
+    state = Setup()
+    state.run(setup)
+    thread.join()
+    assert state.state()["setup"]["logs"] == ["loading weights"]
+
+    # the output isn't captured once setup has finished
+    assert sys.stdout is stdout
+    print("after setup")
+    assert state.state()["setup"]["logs"] == ["loading weights"]
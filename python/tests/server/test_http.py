@@ -1,7 +1,12 @@
+import asyncio
 import base64
+from concurrent.futures import ThreadPoolExecutor
 import io
+import json
 import os
 import tempfile
+import threading
+import time
 from typing import Iterator, List
 from unittest import mock
 
@@ -9,10 +14,13 @@ from fastapi.testclient import TestClient
 from pydantic import BaseModel
 from PIL import Image
 import pytest
+import responses
 
 from cog import BasePredictor, Input, File, Path
+from cog.predictor import Concurrency
 
 from cog.server.http import create_app
+from cog.server.result_cache import ResultCache
 
 
 def make_client(predictor: BasePredictor, **kwargs) -> TestClient:
@@ -74,6 +82,20 @@ def test_openapi_specification():
                     "summary": "Predict",
                     "description": "Run a single prediction on the model",
                     "operationId": "predict_predictions_post",
+                    "parameters": [
+                        {
+                            "required": False,
+                            "schema": {"title": "Prefer", "type": "string"},
+                            "name": "prefer",
+                            "in": "header",
+                        },
+                        {
+                            "required": False,
+                            "schema": {"title": "Accept", "type": "string"},
+                            "name": "accept",
+                            "in": "header",
+                        },
+                    ],
                     "requestBody": {
                         "content": {
                             "application/json": {
@@ -103,9 +125,115 @@ def test_openapi_specification():
                     },
                 }
             },
+            "/predictions/batch": {
+                "post": {
+                    "summary": "Predict Batch",
+                    "description": "Run a prediction for each of a batch of inputs",
+                    "operationId": "predict_batch_predictions_batch_post",
+                    "parameters": [
+                        {
+                            "required": False,
+                            "schema": {"title": "Accept", "type": "string"},
+                            "name": "accept",
+                            "in": "header",
+                        }
+                    ],
+                    "requestBody": {
+                        "content": {
+                            "application/json": {
+                                "schema": {"$ref": "#/components/schemas/BatchRequest"}
+                            }
+                        },
+                        "required": True,
+                    },
+                    "responses": {
+                        "200": {
+                            "description": "Successful Response",
+                            "content": {
+                                "application/json": {
+                                    "schema": {
+                                        "$ref": "#/components/schemas/BatchResponse"
+                                    }
+                                }
+                            },
+                        },
+                        "422": {
+                            "description": "Validation Error",
+                            "content": {
+                                "application/json": {
+                                    "schema": {
+                                        "$ref": "#/components/schemas/HTTPValidationError"
+                                    }
+                                }
+                            },
+                        },
+                    },
+                }
+            },
+            "/predictions/{prediction_id}": {
+                "get": {
+                    "summary": "Get Prediction",
+                    "description": "Get the state of a prediction that was started asynchronously",
+                    "operationId": "get_prediction_predictions__prediction_id__get",
+                    "parameters": [
+                        {
+                            "required": True,
+                            "schema": {"title": "Prediction Id", "type": "string"},
+                            "name": "prediction_id",
+                            "in": "path",
+                        }
+                    ],
+                    "responses": {
+                        "200": {
+                            "description": "Successful Response",
+                            "content": {"application/json": {"schema": {}}},
+                        },
+                        "422": {
+                            "description": "Validation Error",
+                            "content": {
+                                "application/json": {
+                                    "schema": {
+                                        "$ref": "#/components/schemas/HTTPValidationError"
+                                    }
+                                }
+                            },
+                        },
+                    },
+                }
+            },
         },
         "components": {
             "schemas": {
+                "BatchRequest": {
+                    "title": "BatchRequest",
+                    "required": ["inputs"],
+                    "type": "object",
+                    "properties": {
+                        "inputs": {
+                            "title": "Inputs",
+                            "type": "array",
+                            "items": {"$ref": "#/components/schemas/Input"},
+                        },
+                        "output_file_prefix": {
+                            "title": "Output File Prefix",
+                            "type": "string",
+                        },
+                    },
+                    "description": "The request body for a batch of predictions",
+                },
+                "BatchResponse": {
+                    "title": "BatchResponse",
+                    "required": ["predictions"],
+                    "type": "object",
+                    "properties": {
+                        "predictions": {
+                            "title": "Predictions",
+                            "type": "array",
+                            "items": {"$ref": "#/components/schemas/Response"},
+                        }
+                    },
+                    "description": "The response body for a batch of predictions",
+                },
                 "HTTPValidationError": {
                     "title": "HTTPValidationError",
                     "type": "object",
@@ -168,11 +296,13 @@ def test_openapi_specification():
                     "title": "Request",
                     "type": "object",
                     "properties": {
+                        "id": {"title": "Id", "type": "string"},
                         "input": {"$ref": "#/components/schemas/Input"},
                         "output_file_prefix": {
                             "title": "Output File Prefix",
                             "type": "string",
                         },
+                        "webhook": {"title": "Webhook", "type": "string"},
                     },
                     "description": "The request body for a prediction",
                 },
@@ -262,6 +392,20 @@ def test_openapi_specification_with_custom_user_defined_output_type():
                     "summary": "Predict",
                     "description": "Run a single prediction on the model",
                     "operationId": "predict_predictions_post",
+                    "parameters": [
+                        {
+                            "required": False,
+                            "schema": {"title": "Prefer", "type": "string"},
+                            "name": "prefer",
+                            "in": "header",
+                        },
+                        {
+                            "required": False,
+                            "schema": {"title": "Accept", "type": "string"},
+                            "name": "accept",
+                            "in": "header",
+                        },
+                    ],
                     "requestBody": {
                         "content": {
                             "application/json": {
@@ -291,9 +435,115 @@ def test_openapi_specification_with_custom_user_defined_output_type():
                     },
                 }
             },
+            "/predictions/batch": {
+                "post": {
+                    "summary": "Predict Batch",
+                    "description": "Run a prediction for each of a batch of inputs",
+                    "operationId": "predict_batch_predictions_batch_post",
+                    "parameters": [
+                        {
+                            "required": False,
+                            "schema": {"title": "Accept", "type": "string"},
+                            "name": "accept",
+                            "in": "header",
+                        }
+                    ],
+                    "requestBody": {
+                        "content": {
+                            "application/json": {
+                                "schema": {"$ref": "#/components/schemas/BatchRequest"}
+                            }
+                        },
+                        "required": True,
+                    },
+                    "responses": {
+                        "200": {
+                            "description": "Successful Response",
+                            "content": {
+                                "application/json": {
+                                    "schema": {
+                                        "$ref": "#/components/schemas/BatchResponse"
+                                    }
+                                }
+                            },
+                        },
+                        "422": {
+                            "description": "Validation Error",
+                            "content": {
+                                "application/json": {
+                                    "schema": {
+                                        "$ref": "#/components/schemas/HTTPValidationError"
+                                    }
+                                }
+                            },
+                        },
+                    },
+                }
+            },
+            "/predictions/{prediction_id}": {
+                "get": {
+                    "summary": "Get Prediction",
+                    "description": "Get the state of a prediction that was started asynchronously",
+                    "operationId": "get_prediction_predictions__prediction_id__get",
+                    "parameters": [
+                        {
+                            "required": True,
+                            "schema": {"title": "Prediction Id", "type": "string"},
+                            "name": "prediction_id",
+                            "in": "path",
+                        }
+                    ],
+                    "responses": {
+                        "200": {
+                            "description": "Successful Response",
+                            "content": {"application/json": {"schema": {}}},
+                        },
+                        "422": {
+                            "description": "Validation Error",
+                            "content": {
+                                "application/json": {
+                                    "schema": {
+                                        "$ref": "#/components/schemas/HTTPValidationError"
+                                    }
+                                }
+                            },
+                        },
+                    },
+                }
+            },
         },
         "components": {
             "schemas": {
+                "BatchRequest": {
+                    "title": "BatchRequest",
+                    "required": ["inputs"],
+                    "type": "object",
+                    "properties": {
+                        "inputs": {
+                            "title": "Inputs",
+                            "type": "array",
+                            "items": {"$ref": "#/components/schemas/Input"},
+                        },
+                        "output_file_prefix": {
+                            "title": "Output File Prefix",
+                            "type": "string",
+                        },
+                    },
+                    "description": "The request body for a batch of predictions",
+                },
+                "BatchResponse": {
+                    "title": "BatchResponse",
+                    "required": ["predictions"],
+                    "type": "object",
+                    "properties": {
+                        "predictions": {
+                            "title": "Predictions",
+                            "type": "array",
+                            "items": {"$ref": "#/components/schemas/Response"},
+                        }
+                    },
+                    "description": "The response body for a batch of predictions",
+                },
                 "HTTPValidationError": {
                     "title": "HTTPValidationError",
                     "type": "object",
@@ -327,11 +577,13 @@ def test_openapi_specification_with_custom_user_defined_output_type():
                     "title": "Request",
                     "type": "object",
                     "properties": {
+                        "id": {"title": "Id", "type": "string"},
                         "input": {"$ref": "#/components/schemas/Input"},
                         "output_file_prefix": {
                             "title": "Output File Prefix",
                             "type": "string",
                         },
+                        "webhook": {"title": "Webhook", "type": "string"},
                     },
                     "description": "The request body for a prediction",
                 },
@@ -523,6 +775,81 @@ def test_yielding_files_from_generator_predictors():
     assert image_color(output[2]) == (255, 255, 0)  # yellow
 
 
+def parse_events(body):
+    events = []
+    for message in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in message.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_streaming_outputs_as_server_sent_events():
+    class Predictor(BasePredictor):
+        def predict(self) -> Iterator[str]:
+            for prediction in ["foo", "bar", "baz"]:
+                yield prediction
+
+    with TestClient(create_app(Predictor())) as client:
+        resp = client.post("/predictions", headers={"Accept": "text/event-stream"})
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        assert parse_events(resp.text) == [
+            ("output", "foo"),
+            ("output", "bar"),
+            ("output", "baz"),
+            ("done", {"status": "succeeded"}),
+        ]
+
+
+def test_streaming_outputs_as_ndjson():
+    class Predictor(BasePredictor):
+        def predict(self) -> Iterator[Path]:
+            for text in ["foo", "bar"]:
+                temp_dir = tempfile.mkdtemp()
+                temp_path = os.path.join(temp_dir, f"{text}.txt")
+                with open(temp_path, "w") as f:
+                    f.write(text)
+                yield Path(temp_path)
+
+    with TestClient(create_app(Predictor())) as client:
+        resp = client.post("/predictions", headers={"Accept": "application/x-ndjson"})
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        assert [json.loads(line) for line in resp.text.splitlines()] == [
+            {"event": "output", "data": "data:text/plain;base64,Zm9v"},
+            {"event": "output", "data": "data:text/plain;base64,YmFy"},
+            {"event": "done", "data": {"status": "succeeded"}},
+        ]
+
+
+def test_streaming_output_of_non_generator_predictor():
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            return "foo"
+
+    with TestClient(create_app(Predictor())) as client:
+        resp = client.post("/predictions", headers={"Accept": "text/event-stream"})
+        assert parse_events(resp.text) == [
+            ("output", "foo"),
+            ("done", {"status": "succeeded"}),
+        ]
+
+
+def test_streaming_invalid_output():
+    class Predictor(BasePredictor):
+        def predict(self) -> Iterator[int]:
+            yield 1
+            yield "not a number"
+
+    with TestClient(create_app(Predictor())) as client:
+        resp = client.post("/predictions", headers={"Accept": "text/event-stream"})
+        assert resp.status_code == 200
+        assert parse_events(resp.text) == [
+            ("output", 1),
+            ("done", {"status": "failed", "error": "Internal Server Error"}),
+        ]
+
+
 # TODO: timing
 @pytest.mark.skip
 @mock.patch("time.time", return_value=0.0)
@@ -561,3 +888,675 @@ def test_input_with_unsupported_type():
 
     with pytest.raises(TypeError):
         client = make_client(Predictor())
+
+
+def test_deterministic_predictor_caches_outputs():
+    class Predictor(BasePredictor):
+        deterministic = True
+
+        def setup(self):
+            self.calls = 0
+
+        def predict(self, text: str) -> str:
+            self.calls += 1
+            return "hello " + text
+
+    predictor = Predictor()
+    client = make_client(predictor)
+
+    for _ in range(2):
+        resp = client.post("/predictions", json={"input": {"text": "foo"}})
+        assert resp.status_code == 200
+        assert resp.json() == {"status": "succeeded", "output": "hello foo"}
+    assert predictor.calls == 1
+
+    resp = client.post("/predictions", json={"input": {"text": "bar"}})
+    assert resp.json() == {"status": "succeeded", "output": "hello bar"}
+    assert predictor.calls == 2
+
+
+def test_non_deterministic_predictor_does_not_cache_outputs():
+    class Predictor(BasePredictor):
+        def setup(self):
+            self.calls = 0
+
+        def predict(self, text: str) -> str:
+            self.calls += 1
+            return "hello " + text
+
+    predictor = Predictor()
+    client = make_client(predictor)
+
+    for _ in range(2):
+        resp = client.post("/predictions", json={"input": {"text": "foo"}})
+        assert resp.status_code == 200
+    assert predictor.calls == 2
+
+
+def test_deterministic_predictor_coalesces_identical_requests():
+    class Predictor(BasePredictor):
+        deterministic = True
+
+        def setup(self):
+            self.calls = 0
+
+        def predict(self, text: str) -> str:
+            self.calls += 1
+            time.sleep(0.5)
+            return "hello " + text
+
+    predictor = Predictor()
+    # turn off the cache to make sure it's requests in flight being shared
+    app = create_app(
+        predictor, threads=4, result_cache=ResultCache("test", max_size=0)
+    )
+    with TestClient(app) as client:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(
+                    client.post, "/predictions", json={"input": {"text": "foo"}}
+                )
+                for _ in range(4)
+            ]
+            responses = [f.result() for f in futures]
+
+    assert predictor.calls == 1
+    for resp in responses:
+        assert resp.status_code == 200
+        assert resp.json() == {"status": "succeeded", "output": "hello foo"}
+
+
+def wait_for_prediction(client: TestClient, prediction_id: str) -> dict:
+    for _ in range(100):
+        resp = client.get(f"/predictions/{prediction_id}")
+        assert resp.status_code == 200
+        if resp.json()["status"] != "processing":
+            return resp.json()
+        time.sleep(0.05)
+    raise AssertionError("prediction did not finish")
+
+
+def test_async_prediction():
+    class Predictor(BasePredictor):
+        def predict(self, text: str) -> str:
+            time.sleep(0.2)
+            return "hello " + text
+
+    app = create_app(Predictor())
+    with TestClient(app) as client:
+        resp = client.post(
+            "/predictions",
+            json={"input": {"text": "foo"}},
+            headers={"Prefer": "respond-async"},
+        )
+        assert resp.status_code == 202
+        assert resp.headers["Preference-Applied"] == "respond-async"
+        prediction_id = resp.json()["id"]
+        assert resp.headers["Location"] == f"/predictions/{prediction_id}"
+        assert resp.json()["status"] == "processing"
+
+        prediction = wait_for_prediction(client, prediction_id)
+        assert prediction == {
+            "id": prediction_id,
+            "status": "succeeded",
+            "output": "hello foo",
+            "x-experimental-timestamps": {
+                "started_at": mock.ANY,
+                "completed_at": mock.ANY,
+            },
+        }
+
+
+def test_async_prediction_with_id_and_error():
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            raise ValueError("over budget")
+
+    app = create_app(Predictor())
+    with TestClient(app) as client:
+        resp = client.post(
+            "/predictions",
+            json={"id": "abc123"},
+            headers={"Prefer": "respond-async"},
+        )
+        assert resp.status_code == 202
+        assert resp.json()["id"] == "abc123"
+
+        prediction = wait_for_prediction(client, "abc123")
+        assert prediction["status"] == "failed"
+        assert prediction["error"] == "over budget"
+
+        resp = client.post(
+            "/predictions",
+            json={"id": "abc123"},
+            headers={"Prefer": "respond-async"},
+        )
+        assert resp.status_code == 409
+
+
+@responses.activate
+def test_async_prediction_webhook():
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            return "foo"
+
+    responses.add(responses.POST, "http://example.com/webhook", status=200)
+
+    app = create_app(Predictor())
+    with TestClient(app) as client:
+        resp = client.post(
+            "/predictions",
+            json={"id": "abc123", "webhook": "http://example.com/webhook"},
+            headers={"Prefer": "respond-async"},
+        )
+        assert resp.status_code == 202
+        wait_for_prediction(client, "abc123")
+
+    for _ in range(100):
+        if len(responses.calls) > 0:
+            break
+        time.sleep(0.05)
+    assert len(responses.calls) == 1
+    body = json.loads(responses.calls[0].request.body)
+    assert body["id"] == "abc123"
+    assert body["output"] == "foo"
+
+
+@responses.activate
+def test_slow_webhook_does_not_hold_up_predictions():
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            return "foo"
+
+    webhook_started = threading.Event()
+    release_webhook = threading.Event()
+
+    def callback(request):
+        webhook_started.set()
+        release_webhook.wait(timeout=5)
+        return (200, {}, b"")
+
+    responses.add_callback(
+        responses.POST, "http://example.com/webhook", callback=callback
+    )
+
+    app = create_app(Predictor(), threads=1)
+    with TestClient(app) as client:
+        try:
+            resp = client.post(
+                "/predictions",
+                json={"id": "abc123", "webhook": "http://example.com/webhook"},
+                headers={"Prefer": "respond-async"},
+            )
+            assert resp.status_code == 202
+            assert webhook_started.wait(timeout=5)
+
+            # the only slot is free while the webhook is being sent
+            resp = client.post("/predictions")
+            assert resp.status_code == 200
+            assert resp.json()["output"] == "foo"
+        finally:
+            release_webhook.set()
+
+    assert responses.calls[0].request.req_kwargs["timeout"] == 10
+
+
+def test_get_unknown_prediction():
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            return "foo"
+
+    client = make_client(Predictor())
+    resp = client.get("/predictions/nope")
+    assert resp.status_code == 404
+
+
+def test_instance_per_thread_concurrency():
+    class Predictor(BasePredictor):
+        def setup(self):
+            self.setup_calls = getattr(self, "setup_calls", 0) + 1
+
+        def predict(self) -> str:
+            time.sleep(0.2)
+            return f"{id(self)} {self.setup_calls}"
+
+    app = create_app(
+        Predictor(), threads=2, concurrency=Concurrency.INSTANCE_PER_THREAD
+    )
+    with TestClient(app) as client:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(client.post, "/predictions") for _ in range(2)]
+            outputs = [f.result().json()["output"] for f in futures]
+
+    instance_ids = {output.split()[0] for output in outputs}
+    assert len(instance_ids) == 2
+    # each instance is set up once
+    assert all(output.split()[1] == "1" for output in outputs)
+
+
+def test_thread_safe_concurrency_shares_one_instance():
+    class Predictor(BasePredictor):
+        def setup(self):
+            self.setup_calls = getattr(self, "setup_calls", 0) + 1
+
+        def predict(self) -> str:
+            time.sleep(0.2)
+            return f"{id(self)} {self.setup_calls}"
+
+    app = create_app(Predictor(), threads=2)
+    with TestClient(app) as client:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(client.post, "/predictions") for _ in range(2)]
+            outputs = [f.result().json()["output"] for f in futures]
+
+    assert len(set(outputs)) == 1
+    assert outputs[0].split()[1] == "1"
+
+
+def test_full_queue_is_rejected():
+    release = threading.Event()
+
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            release.wait(timeout=5)
+            return "foo"
+
+    app = create_app(Predictor(), threads=1, max_queue_depth=0)
+    with TestClient(app) as client:
+        resp = client.post(
+            "/predictions", json={"id": "a"}, headers={"Prefer": "respond-async"}
+        )
+        assert resp.status_code == 202
+
+        resp = client.post("/predictions")
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "1"
+
+        resp = client.get("/metrics")
+        assert resp.status_code == 200
+        assert "cog_running 1.0\n" in resp.text
+        assert "cog_queue_depth 0.0\n" in resp.text
+        assert "cog_rejected_per_second" in resp.text
+
+        release.set()
+        assert wait_for_prediction(client, "a")["output"] == "foo"
+        resp = client.post("/predictions")
+        assert resp.status_code == 200
+
+
+def test_metrics_per_stage():
+    class Predictor(BasePredictor):
+        def predict(self, text: str) -> str:
+            return text
+
+    with TestClient(create_app(Predictor())) as client:
+        client.post("/predictions", json={"input": {"text": "foo"}})
+        resp = client.get("/metrics")
+        assert resp.status_code == 200
+        assert 'cog_predictions_total{status="succeeded"} 1.0\n' in resp.text
+        assert "cog_prediction_duration_seconds_count 1\n" in resp.text
+        for stage in ["input", "predict", "output", "serialisation"]:
+            assert (
+                f'cog_stage_duration_seconds_count{{stage="{stage}"}} 1\n' in resp.text
+            )
+        assert "cog_ready 1.0\n" in resp.text
+        assert "cog_setup_duration_seconds " in resp.text
+
+
+def test_batch_prediction():
+    class Predictor(BasePredictor):
+        def predict(self, number: int) -> int:
+            if number < 0:
+                raise ValueError("number must be positive")
+            # the first finishes last
+            time.sleep(0.05 * (3 - number))
+            return number * 2
+
+    with TestClient(create_app(Predictor(), threads=3)) as client:
+        resp = client.post(
+            "/predictions/batch",
+            json={"inputs": [{"number": 1}, {"number": 2}, {"number": -1}]},
+        )
+        assert resp.status_code == 200
+        assert resp.json() == {
+            "predictions": [
+                {"status": "succeeded", "output": 2},
+                {"status": "succeeded", "output": 4},
+                {"status": "failed", "error": "number must be positive"},
+            ]
+        }
+
+
+def test_batch_prediction_validates_every_input():
+    class Predictor(BasePredictor):
+        def predict(self, number: int) -> int:
+            return number
+
+    client = make_client(Predictor())
+    resp = client.post(
+        "/predictions/batch", json={"inputs": [{"number": 1}, {"number": "foo"}]}
+    )
+    assert resp.status_code == 422
+    assert resp.json()["detail"][0]["loc"] == ["body", "inputs", 1, "number"]
+
+
+def test_batch_prediction_deletes_files_if_an_input_is_invalid(monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    class Predictor(BasePredictor):
+        def predict(self, file: Path, n: int) -> int:
+            return n
+
+    client = make_client(Predictor())
+    file = "data:text/plain;base64,aGVsbG8="
+    resp = client.post(
+        "/predictions/batch",
+        json={"inputs": [{"file": file, "n": 1}, {"file": file, "n": "notanint"}]},
+    )
+    assert resp.status_code == 422
+    assert resp.json()["detail"][0]["loc"] == ["body", "inputs", 1, "n"]
+    assert os.listdir(tmp_path) == []
+
+
+@responses.activate
+def test_batch_prediction_downloads_every_input_at_once():
+    # each download waits until they've all started
+    barrier = threading.Barrier(2, timeout=5)
+
+    def callback(request):
+        barrier.wait()
+        return (200, {}, request.url.encode())
+
+    for name in ["a.txt", "b.txt"]:
+        responses.add_callback(
+            responses.GET, f"http://example.com/{name}", callback=callback
+        )
+
+    class Predictor(BasePredictor):
+        def predict(self, file: Path) -> str:
+            return file.read_text()
+
+    client = make_client(Predictor())
+    resp = client.post(
+        "/predictions/batch",
+        json={
+            "inputs": [
+                {"file": "http://example.com/a.txt"},
+                {"file": "http://example.com/b.txt"},
+            ]
+        },
+    )
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "predictions": [
+            {"status": "succeeded", "output": "http://example.com/a.txt"},
+            {"status": "succeeded", "output": "http://example.com/b.txt"},
+        ]
+    }
+
+
+@responses.activate
+def test_health_check_while_inputs_download():
+    download_started = threading.Event()
+    download_can_finish = threading.Event()
+
+    def callback(request):
+        download_started.set()
+        download_can_finish.wait(timeout=5)
+        return (200, {}, b"hello")
+
+    responses.add_callback(
+        responses.GET, "http://example.com/slow.txt", callback=callback
+    )
+
+    class Predictor(BasePredictor):
+        def predict(self, file: Path) -> str:
+            return file.read_text()
+
+    with TestClient(create_app(Predictor())) as client, ThreadPoolExecutor(1) as pool:
+        prediction = pool.submit(
+            client.post,
+            "/predictions",
+            json={"input": {"file": "http://example.com/slow.txt"}},
+        )
+        assert download_started.wait(timeout=5)
+
+        # the download doesn't block the event loop
+        resp = client.get("/health-check")
+        assert resp.status_code in (200, 503)
+        assert not prediction.done()
+
+        download_can_finish.set()
+        assert prediction.result().json() == {"status": "succeeded", "output": "hello"}
+
+
+def test_streaming_batch_prediction():
+    class Predictor(BasePredictor):
+        def predict(self, number: int) -> int:
+            time.sleep(0.1 * (2 - number))
+            return number
+
+    with TestClient(create_app(Predictor(), threads=2)) as client:
+        resp = client.post(
+            "/predictions/batch",
+            json={"inputs": [{"number": 0}, {"number": 1}]},
+            headers={"Accept": "application/x-ndjson"},
+        )
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        events = [json.loads(line) for line in resp.text.splitlines()]
+        assert events == [
+            {
+                "event": "prediction",
+                "data": {"index": 1, "status": "succeeded", "output": 1},
+            },
+            {
+                "event": "prediction",
+                "data": {"index": 0, "status": "succeeded", "output": 0},
+            },
+            {"event": "done", "data": {}},
+        ]
+
+
+def test_batch_larger_than_queue_is_rejected():
+    class Predictor(BasePredictor):
+        def predict(self, number: int) -> int:
+            return number
+
+    app = create_app(Predictor(), threads=1, max_queue_depth=1)
+    with TestClient(app) as client:
+        resp = client.post(
+            "/predictions/batch",
+            json={"inputs": [{"number": 1}, {"number": 2}, {"number": 3}]},
+        )
+        assert resp.status_code == 503
+        assert 'cog_predictions_total{status="rejected"} 3.0\n' in (
+            client.get("/metrics").text
+        )
+
+        resp = client.post(
+            "/predictions/batch", json={"inputs": [{"number": 1}, {"number": 2}]}
+        )
+        assert resp.status_code == 200
+
+
+async def post_and_disconnect(app, path: str, disconnect: threading.Event) -> int:
+    """
+    Calls the app like a server would, with a client that disconnects once
+    `disconnect` is set. Returns the response's status code.
+    """
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"{}", "more_body": False}
+        while not disconnect.is_set():
+            await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "server": ("testserver", 80),
+        "client": ("testclient", 50000),
+    }
+    await app(scope, receive, send)
+    return messages[0]["status"]
+
+
+def test_prediction_is_cancelled_when_client_disconnects():
+    started = threading.Event()
+    stopped = threading.Event()
+
+    class Predictor(BasePredictor):
+        def predict(self) -> Iterator[str]:
+            started.set()
+            try:
+                while True:
+                    yield "foo"
+                    time.sleep(0.01)
+            finally:
+                stopped.set()
+
+    app = create_app(Predictor())
+    with TestClient(app) as client:
+        status = asyncio.run(post_and_disconnect(app, "/predictions", started))
+        assert status == 499
+        assert stopped.wait(timeout=5)
+
+        resp = client.get("/metrics")
+        assert 'cog_predictions_total{status="cancelled"} 1.0\n' in resp.text
+
+
+def test_queued_prediction_is_not_run_when_client_disconnects():
+    release = threading.Event()
+    calls = []
+
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            calls.append(1)
+            release.wait(timeout=5)
+            return "foo"
+
+    app = create_app(Predictor(), threads=1)
+    with TestClient(app) as client:
+        resp = client.post(
+            "/predictions", json={"id": "a"}, headers={"Prefer": "respond-async"}
+        )
+        assert resp.status_code == 202
+
+        disconnect = threading.Event()
+        disconnect.set()
+        status = asyncio.run(post_and_disconnect(app, "/predictions", disconnect))
+        assert status == 499
+
+        release.set()
+        assert wait_for_prediction(client, "a")["output"] == "foo"
+        resp = client.post("/predictions")
+        assert resp.json() == {"status": "succeeded", "output": "foo"}
+        assert len(calls) == 2
+
+
+def test_websocket_multiplexes_predictions():
+    class Predictor(BasePredictor):
+        def predict(self, text: str) -> Iterator[str]:
+            for word in text.split(" "):
+                time.sleep(0.01)
+                yield word
+
+    with TestClient(create_app(Predictor(), threads=2)) as client:
+        with client.websocket_connect("/predictions/ws") as websocket:
+            websocket.send_json({"id": "a", "input": {"text": "hello world"}})
+            websocket.send_json({"id": "b", "input": {"text": "foo bar baz"}})
+            websocket.send_json({"id": "c", "input": {}})
+
+            events = {"a": [], "b": [], "c": []}
+            done = 0
+            while done < 3:
+                message = websocket.receive_json()
+                events[message["id"]].append((message["event"], message["data"]))
+                if message["event"] == "done":
+                    done += 1
+
+    assert events["a"] == [
+        ("output", "hello"),
+        ("output", "world"),
+        ("done", {"status": "succeeded"}),
+    ]
+    assert events["b"] == [
+        ("output", "foo"),
+        ("output", "bar"),
+        ("output", "baz"),
+        ("done", {"status": "succeeded"}),
+    ]
+    [(event, data)] = events["c"]
+    assert event == "done"
+    assert data["status"] == "failed"
+    assert "field required" in data["error"]
+
+
+def test_websocket_cancels_prediction():
+    class Predictor(BasePredictor):
+        def predict(self) -> Iterator[int]:
+            i = 0
+            while True:
+                time.sleep(0.01)
+                yield i
+                i += 1
+
+    with TestClient(create_app(Predictor())) as client:
+        with client.websocket_connect("/predictions/ws") as websocket:
+            websocket.send_json({"id": "a"})
+            assert websocket.receive_json() == {"id": "a", "event": "output", "data": 0}
+            websocket.send_json({"type": "cancel", "id": "a"})
+            while True:
+                message = websocket.receive_json()
+                if message["event"] == "done":
+                    break
+            assert message["data"] == {
+                "status": "failed",
+                "error": "Prediction was cancelled",
+            }
+
+            websocket.send_text("not json")
+            assert websocket.receive_json() == {
+                "event": "error",
+                "data": "Messages must be JSON objects",
+            }
+
+
+def test_websocket_rejects_binary_messages():
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            return "foo"
+
+    with TestClient(create_app(Predictor())) as client:
+        with client.websocket_connect("/predictions/ws") as websocket:
+            websocket.send_bytes(b'{"id": "a"}')
+            assert websocket.receive_json() == {
+                "event": "error",
+                "data": "Messages must be text",
+            }
+
+            # the connection can still be used
+            websocket.send_json({"id": "b"})
+            assert websocket.receive_json() == {
+                "id": "b",
+                "event": "output",
+                "data": "foo",
+            }
@@ -187,6 +187,60 @@ def test_file_bad_input():
     assert resp.status_code == 422
 
 
+def test_form_data_path_input():
+    class Predictor(BasePredictor):
+        def predict(self, path: Path, text: str, count: int = 1) -> str:
+            with open(path) as fh:
+                extension = fh.name.split(".")[-1]
+                return f"{extension} {fh.read()} {text * count} {path}"
+
+    client = make_client(Predictor())
+    resp = client.post(
+        "/predictions",
+        data={"text": "baz", "count": "2"},
+        files={"path": ("foo.txt", b"bar", "text/plain")},
+    )
+    assert resp.status_code == 200
+    extension, contents, text, temporary_path = resp.json()["output"].split(" ")
+    assert (extension, contents, text) == ("txt", "bar", "bazbaz")
+    assert not os.path.exists(temporary_path)
+
+
+def test_form_data_file_input():
+    class Predictor(BasePredictor):
+        def predict(self, file: File) -> str:
+            return file.read().decode("utf-8")
+
+    client = make_client(Predictor())
+    resp = client.post(
+        "/predictions", files={"file": ("foo.txt", b"bar", "text/plain")}
+    )
+    assert resp.status_code == 200
+    assert resp.json() == {"output": "bar", "status": "succeeded"}
+
+
+def test_form_data_bad_input():
+    class Predictor(BasePredictor):
+        def predict(self, path: Path, count: int) -> str:
+            return str(path)
+
+    client = make_client(Predictor())
+    resp = client.post(
+        "/predictions",
+        data={"count": "not a number"},
+        files={"path": ("foo.txt", b"bar", "text/plain")},
+    )
+    assert resp.status_code == 422
+    assert resp.json()["detail"][0]["loc"] == ["input", "count"]
+
+    resp = client.post(
+        "/predictions",
+        data=b"not form data",
+        headers={"Content-Type": "multipart/form-data; boundary=foo"},
+    )
+    assert resp.status_code == 400
+
+
 def test_path_output_file():
     class Predictor(BasePredictor):
         def predict(self) -> Path:
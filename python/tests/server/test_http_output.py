@@ -1,5 +1,7 @@
 import base64
+import email
 import io
+import json
 import os
 import tempfile
 from typing import Iterator, List
@@ -158,3 +160,81 @@ def test_iterator_of_list_of_complex_output():
         "status": "succeeded",
     }
     assert resp.status_code == 200
+
+
+def test_file_output_as_binary():
+    class Predictor(BasePredictor):
+        def predict(self) -> Path:
+            temp_dir = tempfile.mkdtemp()
+            temp_path = os.path.join(temp_dir, "my_file.txt")
+            with open(temp_path, "w") as f:
+                f.write("hello")
+            return Path(temp_path)
+
+    client = make_client(Predictor())
+    resp = client.post("/predictions", headers={"Accept": "application/octet-stream"})
+    assert resp.status_code == 200
+    assert resp.content == b"hello"
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert 'filename="my_file.txt"' in resp.headers["content-disposition"]
+
+
+def test_in_memory_file_output_as_binary():
+    class Predictor(BasePredictor):
+        def predict(self) -> File:
+            return io.BytesIO(b"hello")
+
+    client = make_client(Predictor())
+    resp = client.post("/predictions", headers={"Accept": "application/octet-stream"})
+    assert resp.status_code == 200
+    assert resp.content == b"hello"
+    assert resp.headers["content-type"] == "application/octet-stream"
+
+
+def test_non_file_output_as_binary_is_not_acceptable():
+    class Predictor(BasePredictor):
+        def predict(self) -> str:
+            return "hello"
+
+    client = make_client(Predictor())
+    resp = client.post("/predictions", headers={"Accept": "application/octet-stream"})
+    assert resp.status_code == 406
+
+
+def test_file_outputs_as_multipart():
+    class Output(BaseModel):
+        text: str
+        image: Path
+        file: File
+
+    class Predictor(BasePredictor):
+        def predict(self) -> Output:
+            temp_dir = tempfile.mkdtemp()
+            temp_path = os.path.join(temp_dir, "my_file.bmp")
+            Image.new("RGB", (255, 255), "red").save(temp_path)
+            return Output(
+                text="hello", image=Path(temp_path), file=io.BytesIO(b"world")
+            )
+
+    client = make_client(Predictor())
+    resp = client.post("/predictions", headers={"Accept": "multipart/mixed"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("multipart/mixed; boundary=")
+
+    message = email.message_from_bytes(
+        b"Content-Type: "
+        + resp.headers["content-type"].encode()
+        + b"\r\n\r\n"
+        + resp.content
+    )
+    response_part, image_part, file_part = message.get_payload()
+    assert response_part.get_content_type() == "application/json"
+    assert json.loads(response_part.get_payload()) == {
+        "status": "succeeded",
+        "output": {"text": "hello", "image": "cid:my_file.bmp", "file": "cid:output"},
+    }
+    assert image_part["Content-ID"] == "<my_file.bmp>"
+    image = Image.open(io.BytesIO(image_part.get_payload(decode=True)))
+    assert image.getcolors()[0][1] == (255, 0, 0)
+    assert file_part["Content-ID"] == "<output>"
+    assert file_part.get_payload(decode=True) == b"world"
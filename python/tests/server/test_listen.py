@@ -0,0 +1,92 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+import cog
+from cog.server.listen import bind_sockets, close_sockets
+
+from .test_prefork import free_port, wait_until_ready
+
+PREDICTOR = """
+from cog import BasePredictor
+
+
+class Predictor(BasePredictor):
+    def predict(self) -> str:
+        return "hello"
+"""
+
+
+def request_over_unix_socket(path: str, request: bytes) -> bytes:
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.1)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(request)
+        response = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return response
+            response += chunk
+
+
+def test_bind_sockets_replaces_stale_unix_socket(tmp_path):
+    path = str(tmp_path / "cog.sock")
+    close_sockets(bind_sockets(port=None, unix_socket=path), path)
+    assert not os.path.exists(path)
+
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    sockets = bind_sockets(port=None, unix_socket=path)
+    try:
+        assert [sock.family for sock in sockets] == [socket.AF_UNIX]
+    finally:
+        close_sockets(sockets, path)
+
+
+def test_http_server_listens_on_unix_socket_and_tcp(tmp_path):
+    (tmp_path / "cog.yaml").write_text('predict: "predict.py:Predictor"\n')
+    (tmp_path / "predict.py").write_text(PREDICTOR)
+    path = str(tmp_path / "cog.sock")
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(cog.__file__)))
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "cog.server.http",
+            "--host=127.0.0.1",
+            f"--port={port}",
+            f"--unix-socket={path}",
+        ],
+        cwd=tmp_path,
+        env=env,
+    )
+    try:
+        wait_until_ready(f"http://127.0.0.1:{port}")
+        response = request_over_unix_socket(
+            path,
+            b"POST /predictions HTTP/1.1\r\n"
+            b"Host: localhost\r\n"
+            b"Content-Length: 0\r\n"
+            b"Connection: close\r\n\r\n",
+        )
+        assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+        assert response.endswith(b'{"status":"succeeded","output":"hello"}')
+
+        resp = requests.post(f"http://127.0.0.1:{port}/predictions")
+        assert resp.json() == {"status": "succeeded", "output": "hello"}
+
+        proc.terminate()
+        assert proc.wait(timeout=10) == 0
+        assert not os.path.exists(path)
+    finally:
+        proc.kill()
@@ -0,0 +1,100 @@
+from cog.server.metrics import (
+    BusyTracker,
+    Counter,
+    Histogram,
+    RollingWindow,
+    format_prometheus,
+)
+
+
+def test_rolling_window_summary():
+    window = RollingWindow(window=60)
+    for i in range(1, 101):
+        window.add(float(i), now=1000)
+
+    assert window.summary(now=1000) == {
+        "count": 100,
+        "sum": 5050.0,
+        "p50": 50.0,
+        "p90": 90.0,
+        "p99": 99.0,
+    }
+    assert window.rate(now=1000) == 100 / 60
+
+
+def test_rolling_window_expires_old_samples():
+    window = RollingWindow(window=60)
+    window.add(1.0, now=1000)
+    window.add(2.0, now=1050)
+
+    assert window.values(now=1070) == [2.0]
+    assert window.summary(now=2000) == {
+        "count": 0,
+        "sum": 0,
+        "p50": None,
+        "p90": None,
+        "p99": None,
+    }
+
+
+def test_busy_tracker():
+    busy = BusyTracker(window=60)
+    busy.start(now=1000)
+    busy.stop(now=1015)
+    busy.start(now=1030)
+
+    # 15s finished, plus 15s in progress
+    assert busy.ratio(now=1045) == 0.5
+    assert busy.completed(now=1045) == 1
+
+    # the first interval is partly outside the window
+    busy.stop(now=1070)
+    assert busy.ratio(now=1070) == 45 / 60
+
+
+def test_format_prometheus():
+    text = format_prometheus(
+        {
+            "queue_length": 3,
+            "setup_time_seconds": None,
+            "run_time_seconds": {"count": 2, "sum": 3.5, "p50": 1.5, "p90": None},
+        },
+        prefix="cog_queue_",
+        labels={"queue": "predict-queue"},
+    )
+    assert text == (
+        "# TYPE cog_queue_queue_length gauge\n"
+        'cog_queue_queue_length{queue="predict-queue"} 3.0\n'
+        "# TYPE cog_queue_run_time_seconds summary\n"
+        'cog_queue_run_time_seconds_count{queue="predict-queue"} 2.0\n'
+        'cog_queue_run_time_seconds_sum{queue="predict-queue"} 3.5\n'
+        'cog_queue_run_time_seconds{queue="predict-queue",quantile="0.5"} 1.5\n'
+        'cog_queue_run_time_seconds{queue="predict-queue",quantile="0.9"} NaN\n'
+    )
+
+
+def test_format_prometheus_counters_and_histograms():
+    counter = Counter(label="status")
+    counter.inc("succeeded")
+    counter.inc("succeeded")
+    counter.inc("failed")
+    histogram = Histogram(label="stage", buckets=(0.1, 1.0))
+    histogram.observe(0.05, "predict")
+    histogram.observe(0.5, "predict")
+    histogram.observe(5, "predict")
+
+    text = format_prometheus(
+        {"predictions_total": counter, "stage_duration_seconds": histogram},
+        labels={"queue": "q"},
+    )
+    assert text == (
+        "# TYPE cog_predictions_total counter\n"
+        'cog_predictions_total{queue="q",status="succeeded"} 2.0\n'
+        'cog_predictions_total{queue="q",status="failed"} 1.0\n'
+        "# TYPE cog_stage_duration_seconds histogram\n"
+        'cog_stage_duration_seconds_bucket{queue="q",stage="predict",le="0.1"} 1\n'
+        'cog_stage_duration_seconds_bucket{queue="q",stage="predict",le="1.0"} 2\n'
+        'cog_stage_duration_seconds_bucket{queue="q",stage="predict",le="+Inf"} 3\n'
+        'cog_stage_duration_seconds_sum{queue="q",stage="predict"} 5.55\n'
+        'cog_stage_duration_seconds_count{queue="q",stage="predict"} 3\n'
+    )
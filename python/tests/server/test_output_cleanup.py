@@ -0,0 +1,145 @@
+import os
+import tempfile
+import time
+
+import pytest
+
+from cog import BaseModel, BasePredictor, Path
+from cog.server.output_cleanup import (
+    DiskQuotaExceeded,
+    OutputCleaner,
+    find_output_files,
+)
+from .test_http import make_client
+
+
+def make_temp_file(size: int = 10) -> str:
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+
+def test_find_output_files():
+    class Output(BaseModel):
+        image: Path
+        text: str
+
+    first = make_temp_file()
+    second = make_temp_file()
+    with open(second, "rb") as fh:
+        output = [
+            Output(image=Path(first), text="foo"),
+            {"file": fh, "same": Path(first)},
+            # not in the temporary directory
+            Path(__file__),
+        ]
+        assert find_output_files(output) == [first, second]
+
+
+def test_find_output_files_since():
+    old = make_temp_file()
+    os.utime(old, (1000, 1000))
+    new = make_temp_file()
+
+    assert find_output_files([Path(old), Path(new)], since=2000) == [new]
+
+
+def test_release_deletes_files_in_background():
+    cleaner = OutputCleaner()
+    path = make_temp_file()
+    cleaner.hold([path])
+    assert cleaner.usage() == 10
+
+    cleaner.release([path])
+    cleaner.close()
+    assert not os.path.exists(path)
+    assert cleaner.usage() == 0
+
+
+def test_file_is_kept_until_every_holder_releases_it():
+    cleaner = OutputCleaner()
+    path = make_temp_file()
+    cleaner.hold([path])
+    cleaner.hold([path])
+    assert cleaner.usage() == 10
+
+    cleaner.release([path])
+    cleaner.close()
+    assert os.path.exists(path)
+
+    cleaner.release([path])
+    cleaner.close()
+    assert not os.path.exists(path)
+
+
+def test_disk_quota():
+    cleaner = OutputCleaner(max_bytes=15)
+    first = make_temp_file()
+    cleaner.hold([first])
+
+    second = make_temp_file()
+    with pytest.raises(DiskQuotaExceeded, match="only 5 bytes"):
+        cleaner.hold([second])
+    cleaner.close()
+    assert not os.path.exists(second)
+
+    cleaner.release([first])
+    cleaner.close()
+    third = make_temp_file()
+    cleaner.hold([third])
+    cleaner.release([third])
+    cleaner.close()
+
+
+def test_http_output_files_are_deleted():
+    paths = []
+
+    class Predictor(BasePredictor):
+        def predict(self) -> Path:
+            paths.append(make_temp_file())
+            return Path(paths[-1])
+
+    client = make_client(Predictor())
+    resp = client.post("/predictions")
+    assert resp.status_code == 200
+    assert resp.json()["output"].startswith("data:")
+
+    resp = client.post("/predictions", headers={"Accept": "application/octet-stream"})
+    assert resp.status_code == 200
+    assert resp.content == b"x" * 10
+
+    for path in paths:
+        for _ in range(100):
+            if not os.path.exists(path):
+                break
+            time.sleep(0.01)
+        assert not os.path.exists(path)
+
+
+def test_http_files_from_before_the_prediction_are_kept():
+    class Predictor(BasePredictor):
+        def setup(self):
+            self.path = make_temp_file()
+            os.utime(self.path, (1000, 1000))
+
+        def predict(self) -> Path:
+            return Path(self.path)
+
+    predictor = Predictor()
+    client = make_client(predictor)
+    for _ in range(2):
+        resp = client.post("/predictions")
+        assert resp.status_code == 200
+        assert resp.json()["output"].endswith(";base64,eHh4eHh4eHh4eA==")
+
+    for _ in range(2):
+        resp = client.post(
+            "/predictions", headers={"Accept": "application/octet-stream"}
+        )
+        assert resp.status_code == 200
+        assert resp.content == b"x" * 10
+
+    client.app.state.output_cleaner.close()
+    assert os.path.exists(predictor.path)
+    os.unlink(predictor.path)
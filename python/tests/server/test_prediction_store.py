@@ -0,0 +1,21 @@
+from cog.server.prediction_store import PredictionStore
+
+
+def test_prediction_store_evicts_oldest_finished_prediction():
+    store = PredictionStore(max_size=2)
+    assert store.create("a")
+    assert store.create("b")
+    store.update("b", status="succeeded", output="foo")
+
+    assert store.create("c")
+    assert "a" in store
+    assert "b" not in store
+    assert "c" in store
+
+
+def test_prediction_store_refuses_when_full_of_running_predictions():
+    store = PredictionStore(max_size=1)
+    assert store.create("a")
+    assert not store.create("b")
+    assert store.get("a") == {"id": "a", "status": "processing", "output": None}
+    assert store.get("b") is None
@@ -0,0 +1,105 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+import requests
+
+import cog
+from cog.predictor import Concurrency
+from cog.server.http import create_app
+from cog.server.prefork import serve_prefork
+
+SERVER = """
+import os
+import sys
+
+from cog import BasePredictor
+from cog.server.http import create_app
+from cog.server.prefork import serve_prefork
+
+
+class Predictor(BasePredictor):
+    def setup(self):
+        self.setup_pid = os.getpid()
+
+    def predict(self) -> str:
+        return f"{self.setup_pid} {os.getpid()}"
+
+
+serve_prefork(
+    create_app(Predictor()), workers=2, port=int(sys.argv[1]), log_level="warning"
+)
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url: str) -> None:
+    for _ in range(100):
+        try:
+            if requests.get(url + "/health-check").status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    raise AssertionError("Server didn't start")
+
+
+def test_prefork_workers_share_setup(tmp_path):
+    script = tmp_path / "server.py"
+    script.write_text(textwrap.dedent(SERVER))
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    # wherever this cog is, whether it's installed or not
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(cog.__file__)))
+    proc = subprocess.Popen([sys.executable, str(script), str(port)], env=env)
+    try:
+        wait_until_ready(url)
+        worker_pids = set()
+        for _ in range(5):
+            resp = requests.post(url + "/predictions")
+            assert resp.status_code == 200
+            setup_pid, worker_pid = resp.json()["output"].split(" ")
+            # setup ran once, in the parent, before the workers were forked
+            assert int(setup_pid) == proc.pid
+            assert int(worker_pid) != proc.pid
+            worker_pids.add(int(worker_pid))
+
+        # another worker couldn't fetch it, or see its metrics
+        resp = requests.post(url + "/predictions", headers={"Prefer": "respond-async"})
+        assert resp.status_code == 400
+        assert requests.get(url + "/metrics").status_code == 404
+
+        # a worker that dies is replaced
+        os.kill(worker_pids.pop(), signal.SIGKILL)
+        time.sleep(2)
+        for _ in range(5):
+            assert requests.post(url + "/predictions").status_code == 200
+
+        proc.send_signal(signal.SIGTERM)
+        assert proc.wait(timeout=10) == 0
+    finally:
+        proc.kill()
+
+
+def test_prefork_rejects_runner_pools():
+    class Predictor(cog.BasePredictor):
+        def setup(self):
+            raise AssertionError("setup shouldn't run")
+
+        def predict(self) -> str:
+            return "hello"
+
+    app = create_app(Predictor(), concurrency=Concurrency.PROCESS_PER_SLOT)
+
+    with pytest.raises(ValueError, match="RunnerPool"):
+        serve_prefork(app, workers=2, port=free_port())
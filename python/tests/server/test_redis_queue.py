@@ -0,0 +1,31 @@
+import time
+
+import pytest
+
+from cog.server.redis_queue import calculate_time_in_queue, message_expired
+
+
+def test_calculate_time_in_queue():
+    message_id = f"{int(time.time() * 1000) - 5000}-0"
+    assert 5 <= calculate_time_in_queue(message_id) < 6
+
+
+def test_message_expired_without_deadline():
+    assert not message_expired({"input": {}}, time_in_queue=1000, now=2000)
+
+
+def test_message_expired_deadline():
+    assert message_expired({"deadline": 1999}, time_in_queue=0, now=2000)
+    assert not message_expired({"deadline": 2001}, time_in_queue=0, now=2000)
+
+
+def test_message_expired_max_queue_time():
+    assert message_expired({"max_queue_time": 10}, time_in_queue=11, now=2000)
+    assert not message_expired({"max_queue_time": 10}, time_in_queue=9, now=2000)
+
+
+def test_message_expired_malformed():
+    with pytest.raises(ValueError, match="Invalid deadline"):
+        message_expired({"deadline": "tomorrow"}, time_in_queue=0, now=2000)
+    with pytest.raises(ValueError, match="Invalid max_queue_time"):
+        message_expired({"max_queue_time": [10]}, time_in_queue=0, now=2000)
@@ -0,0 +1,61 @@
+import io
+import os
+import tempfile
+import time
+
+import cog
+from cog.server.result_cache import LocalCache, ResultCache, input_hash
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(max_size=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
+    assert cache.get("c") == "3"
+
+
+def test_local_cache_expires_entries():
+    cache = LocalCache(ttl=0.01)
+    cache.set("a", "1")
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_result_cache_skips_large_outputs():
+    cache = ResultCache("v1", max_value_bytes=10)
+    cache.set("small", "foo")
+    cache.set("large", "foo" * 10)
+
+    assert cache.get("small") == (True, "foo")
+    assert cache.get("large") == (False, None)
+
+
+def test_input_hash():
+    assert input_hash({"a": 1, "b": "foo"}, "v1") == input_hash(
+        {"b": "foo", "a": 1}, "v1"
+    )
+    assert input_hash({"a": 1}, "v1") != input_hash({"a": 2}, "v1")
+    assert input_hash({"a": 1}, "v1") != input_hash({"a": 1}, "v2")
+    assert input_hash({"a": 1}, "v1", "foo") != input_hash({"a": 1}, "v1", "bar")
+
+
+def test_input_hash_uses_file_contents():
+    paths = []
+    for _ in range(2):
+        temp_dir = tempfile.mkdtemp()
+        temp_path = os.path.join(temp_dir, "my_file.txt")
+        with open(temp_path, "w") as fh:
+            fh.write("file content")
+        paths.append(cog.Path(temp_path))
+
+    assert input_hash({"path": paths[0]}, "v1") == input_hash({"path": paths[1]}, "v1")
+
+    f = io.BytesIO(b"file content")
+    assert input_hash({"path": f}, "v1") == input_hash({"path": paths[0]}, "v1")
+    # reading the file to hash it doesn't consume it
+    assert f.read() == b"file content"
@@ -0,0 +1,121 @@
+import json
+import textwrap
+import threading
+import time
+
+from fastapi.testclient import TestClient
+import pytest
+
+from cog.predictor import load_config, load_predictor
+from cog.server.http import create_app
+from cog.server.runner_pool import PredictionCancelled, PredictionError, RunnerPool
+
+PREDICTOR = """
+import os
+import time
+from typing import Iterator
+
+from cog import BasePredictor
+
+
+class Predictor(BasePredictor):
+    def predict(self, mode: str = "generate") -> Iterator[str]:
+        if mode == "sleep":
+            time.sleep(10)
+        if mode == "crash":
+            os._exit(1)
+        for word in ["foo", "bar"]:
+            print("predicting " + word)
+            yield word
+"""
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    # the runner loads the predictor from cog.yaml in the working directory
+    (tmp_path / "cog.yaml").write_text('predict: "predict.py:Predictor"\n')
+    (tmp_path / "predict.py").write_text(textwrap.dedent(PREDICTOR))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_runner_pool_streams_outputs_and_logs(model_dir):
+    pool = RunnerPool(size=1)
+    pool.setup()
+    try:
+        logs = []
+        outputs = pool.predict({"mode": "generate"}, on_log=logs.append)
+        assert list(outputs) == ["foo", "bar"]
+        assert logs == ["predicting foo", "predicting bar"]
+    finally:
+        pool.close()
+
+
+def test_runner_pool_times_out(model_dir):
+    pool = RunnerPool(size=1, predict_timeout=1)
+    pool.setup()
+    try:
+        with pytest.raises(PredictionError, match="Prediction timed out"):
+            list(pool.predict({"mode": "sleep"}))
+        # the runner can be used again afterwards
+        assert list(pool.predict({"mode": "generate"})) == ["foo", "bar"]
+    finally:
+        pool.close()
+
+
+def test_runner_pool_recovers_from_crash(model_dir):
+    pool = RunnerPool(size=1)
+    pool.setup()
+    try:
+        with pytest.raises(PredictionError, match="exited unexpectedly"):
+            list(pool.predict({"mode": "crash"}))
+        # a new runner is started in the background to replace it
+        assert list(pool.predict({"mode": "generate"})) == ["foo", "bar"]
+    finally:
+        pool.close()
+
+
+def test_runner_pool_cancels_prediction(model_dir):
+    pool = RunnerPool(size=1)
+    pool.setup()
+    try:
+        cancelled = threading.Event()
+        threading.Timer(0.5, cancelled.set).start()
+        started_at = time.time()
+        with pytest.raises(PredictionCancelled):
+            list(pool.predict({"mode": "sleep"}, cancelled=cancelled))
+        # the subprocess is killed rather than left to finish sleeping
+        assert time.time() - started_at < 5
+        # and replaced
+        assert list(pool.predict({"mode": "generate"})) == ["foo", "bar"]
+    finally:
+        pool.close()
+
+
+def test_http_predictions_in_runner_pool(model_dir):
+    predictor = load_predictor(load_config())
+    app = create_app(predictor, runner_pool=RunnerPool(size=1))
+    with TestClient(app) as client:
+        resp = client.post("/predictions", json={"input": {"mode": "generate"}})
+        assert resp.status_code == 200
+        assert resp.json() == {"status": "succeeded", "output": ["foo", "bar"]}
+
+        resp = client.post(
+            "/predictions",
+            json={"input": {"mode": "generate"}},
+            headers={"Accept": "application/x-ndjson"},
+        )
+        events = [json.loads(line) for line in resp.text.splitlines()]
+        # logs are captured by another process, so they can arrive after the
+        # outputs that were yielded after them
+        assert [e["data"] for e in events if e["event"] == "output"] == ["foo", "bar"]
+        assert [e["data"] for e in events if e["event"] == "log"] == [
+            "predicting foo",
+            "predicting bar",
+        ]
+        assert events[-1] == {"event": "done", "data": {"status": "succeeded"}}
+
+        resp = client.post("/predictions", json={"input": {"mode": "crash"}})
+        assert resp.status_code == 500
+        assert resp.json()["status"] == "failed"
+        assert "exited unexpectedly" in resp.json()["error"]
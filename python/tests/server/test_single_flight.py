@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+from cog.server.single_flight import SingleFlight
+
+
+def test_single_flight_shares_result():
+    single_flight = SingleFlight()
+    calls = 0
+
+    def fn():
+        nonlocal calls
+        calls += 1
+        time.sleep(0.2)
+        return calls
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(single_flight.do, "key", fn) for _ in range(4)]
+        results = [f.result() for f in futures]
+
+    assert calls == 1
+    assert results == [1, 1, 1, 1]
+    assert single_flight.calls == {}
+
+
+def test_single_flight_shares_exception():
+    single_flight = SingleFlight()
+    started = threading.Event()
+
+    def fn():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError("oops")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(single_flight.do, "key", fn)
+        started.wait()
+        follower = executor.submit(single_flight.do, "key", fn)
+
+        with pytest.raises(ValueError):
+            leader.result()
+        with pytest.raises(ValueError):
+            follower.result()
+
+
+def test_single_flight_runs_different_keys_separately():
+    single_flight = SingleFlight()
+    assert single_flight.do("a", lambda: 1) == 1
+    assert single_flight.do("b", lambda: 2) == 2
+    # finished calls aren't reused
+    assert single_flight.do("a", lambda: 3) == 3
+
+
+def test_single_flight_streams_items_to_followers():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    follower_attached = threading.Event()
+    calls = 0
+
+    def fn(publish):
+        nonlocal calls
+        calls += 1
+        publish("a")
+        started.set()
+        follower_attached.wait()
+        time.sleep(0.1)
+        publish("b")
+        return "done"
+
+    leader_items = []
+    follower_items = []
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(
+            single_flight.do_streaming, "key", fn, leader_items.append
+        )
+        started.wait()
+        follower = executor.submit(
+            single_flight.do_streaming, "key", fn, follower_items.append
+        )
+        follower_attached.set()
+
+        assert leader.result() == "done"
+        assert follower.result() == "done"
+
+    assert calls == 1
+    assert leader_items == ["a", "b"]
+    # items published before the follower arrived are replayed
+    assert follower_items == ["a", "b"]
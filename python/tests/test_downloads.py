@@ -0,0 +1,144 @@
+import os
+import tempfile
+import threading
+import time
+
+from pydantic import ValidationError
+import pytest
+import responses
+
+from cog import BasePredictor, File, Path
+from cog.downloads import DownloadError, download
+from cog.predictor import get_input_type
+
+
+class Predictor(BasePredictor):
+    def predict(self, image: Path, mask: Path, audio: File) -> str:
+        pass
+
+
+@responses.activate
+def test_inputs_are_downloaded_at_once():
+    # each download waits until they've all started
+    barrier = threading.Barrier(3, timeout=5)
+
+    def callback(request):
+        barrier.wait()
+        return (200, {}, request.url.encode())
+
+    for name in ["image.png", "mask.png", "audio.wav"]:
+        responses.add_callback(
+            responses.GET, f"http://example.com/{name}", callback=callback
+        )
+
+    InputType = get_input_type(Predictor())
+    inputs = InputType(
+        image="http://example.com/image.png",
+        mask="http://example.com/mask.png",
+        audio="http://example.com/audio.wav",
+    )
+
+    assert str(inputs.image).endswith(".png")
+    assert inputs.image.read_bytes() == b"http://example.com/image.png"
+    assert inputs.mask.read_bytes() == b"http://example.com/mask.png"
+    assert inputs.audio.read() == b"http://example.com/audio.wav"
+    inputs.cleanup()
+
+
+@responses.activate
+def test_failed_downloads_are_input_errors():
+    responses.add(responses.GET, "http://example.com/image.png", status=404)
+    responses.add(responses.GET, "http://example.com/mask.png", body=b"mask")
+
+    InputType = get_input_type(Predictor())
+    with pytest.raises(ValidationError) as e:
+        InputType(
+            image="http://example.com/image.png",
+            mask="http://example.com/mask.png",
+            audio="data:audio/wav;base64,UklGRg==",
+        )
+
+    [error] = e.value.errors()
+    assert error["loc"] == ("image",)
+    assert error["msg"].startswith(
+        "Failed to download http://example.com/image.png: 404 Client Error"
+    )
+
+
+@responses.activate
+def test_download_timeout(monkeypatch):
+    monkeypatch.setenv("COG_DOWNLOAD_TIMEOUT", "0.1")
+
+    def callback(request):
+        time.sleep(0.2)
+        return (200, {}, b"image")
+
+    responses.add_callback(
+        responses.GET, "http://example.com/image.png", callback=callback
+    )
+
+    with pytest.raises(DownloadError, match="Timed out downloading"):
+        download("http://example.com/image.png")
+
+
+@responses.activate
+def test_total_download_timeout(monkeypatch):
+    monkeypatch.setenv("COG_DOWNLOAD_TOTAL_TIMEOUT", "0.1")
+    release = threading.Event()
+
+    def callback(request):
+        release.wait(timeout=5)
+        return (200, {}, b"image")
+
+    for name in ["image.png", "mask.png"]:
+        responses.add_callback(
+            responses.GET, f"http://example.com/{name}", callback=callback
+        )
+
+    InputType = get_input_type(Predictor())
+    try:
+        with pytest.raises(ValidationError) as e:
+            InputType(
+                image="http://example.com/image.png",
+                mask="http://example.com/mask.png",
+                audio="data:audio/wav;base64,UklGRg==",
+            )
+    finally:
+        release.set()
+        # they finish in the background, but not after this test
+        for _ in range(50):
+            if len(responses.calls) == 2:
+                break
+            time.sleep(0.1)
+
+    assert [error["loc"] for error in e.value.errors()] == [("image",), ("mask",)]
+    for error in e.value.errors():
+        assert error["msg"].startswith("Timed out downloading")
+
+
+@responses.activate
+def test_downloads_are_deleted_if_another_input_is_invalid(monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    for name in ["image.png", "mask.png", "audio.wav"]:
+        responses.add(responses.GET, f"http://example.com/{name}", body=b"x")
+
+    class Predictor(BasePredictor):
+        def predict(self, image: Path, mask: Path, audio: File, count: int) -> str:
+            pass
+
+    InputType = get_input_type(Predictor())
+    with pytest.raises(ValidationError):
+        InputType(
+            image="http://example.com/image.png",
+            mask="http://example.com/mask.png",
+            audio="http://example.com/audio.wav",
+            count="lots",
+        )
+
+    # they're deleted in the background once they've finished
+    for _ in range(50):
+        if not os.listdir(tmp_path):
+            break
+        time.sleep(0.1)
+    assert len(responses.calls) == 3
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,142 @@
+import os
+from unittest import mock
+
+import pytest
+import responses
+
+from cog.downloads import download
+from cog.input_cache import InputCache
+from cog.types import File, Path
+
+URL = "http://example.com/reference.png"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = InputCache(str(tmp_path / "cache"), max_bytes=1024)
+    with mock.patch("cog.downloads.get_input_cache", return_value=cache):
+        yield cache
+
+
+def serve(url, body, etag='"v1"'):
+    """
+    Serves `body` at `url` with an ETag, and answers requests that have that
+    ETag with 304 Not Modified.
+    """
+
+    def callback(request):
+        if request.headers.get("If-None-Match") == etag:
+            return (304, {"ETag": etag}, b"")
+        return (200, {"ETag": etag}, body)
+
+    responses.add_callback(responses.GET, url, callback=callback)
+
+
+@responses.activate
+def test_revalidates_instead_of_downloading_again(cache):
+    serve(URL, b"image")
+
+    first = download(URL, suffix=".png")
+    second = download(URL, suffix=".png")
+
+    assert [call.response.status_code for call in responses.calls] == [200, 304]
+    assert responses.calls[1].request.headers["If-None-Match"] == '"v1"'
+    assert first != second
+    assert second.endswith(".png")
+    with open(second, "rb") as f:
+        assert f.read() == b"image"
+
+
+@responses.activate
+def test_changing_an_input_file_does_not_change_the_cache(cache):
+    serve(URL, b"image")
+    first = download(URL)
+
+    # the predictor can change its own copy, even in place
+    assert os.stat(first).st_mode & 0o200
+    with open(first, "r+b") as f:
+        f.write(b"IMAGE")
+
+    second = download(URL)
+    with open(second, "rb") as f:
+        assert f.read() == b"image"
+
+
+@responses.activate
+def test_downloads_again_if_it_has_changed(cache):
+    serve(URL, b"old", etag='"v1"')
+    download(URL)
+    responses.reset()
+    serve(URL, b"new", etag='"v2"')
+
+    path = download(URL)
+
+    assert responses.calls[0].response.status_code == 200
+    with open(path, "rb") as f:
+        assert f.read() == b"new"
+
+
+@responses.activate
+def test_responses_without_validators_are_not_cached(cache):
+    responses.add(responses.GET, URL, body=b"image")
+
+    download(URL)
+    download(URL)
+
+    assert "If-None-Match" not in responses.calls[1].request.headers
+    assert os.listdir(cache.files_dir) == []
+
+
+@responses.activate
+def test_files_are_stored_by_their_contents(cache):
+    serve("http://example.com/a.png", b"image")
+    serve("http://example.com/b.png", b"image")
+
+    download("http://example.com/a.png")
+    download("http://example.com/b.png")
+
+    assert len(os.listdir(cache.files_dir)) == 1
+
+
+@responses.activate
+def test_least_recently_used_files_are_evicted(cache):
+    for name in ["a", "b", "c"]:
+        serve(f"http://example.com/{name}", name.encode() * 400)
+
+    a = download("http://example.com/a")
+    os.utime(a, (0, 0))
+    b = download("http://example.com/b")
+    os.utime(b, (1, 1))
+    # uses a again, so b is the least recently used
+    download("http://example.com/a")
+    download("http://example.com/c")
+
+    assert cache.read_entry("http://example.com/a") is not None
+    assert cache.read_entry("http://example.com/b") is None
+    assert cache.read_entry("http://example.com/c") is not None
+    # files that were handed out are kept until they're deleted
+    with open(a, "rb") as f:
+        assert f.read() == b"a" * 400
+
+
+@responses.activate
+def test_files_bigger_than_the_cache_are_not_cached(cache):
+    serve(URL, b"x" * 2048)
+
+    path = download(URL)
+
+    assert os.path.getsize(path) == 2048
+    assert os.listdir(cache.files_dir) == []
+
+
+@responses.activate
+def test_path_and_file_inputs_use_the_cache(cache):
+    serve(URL, b"image")
+
+    path = Path.validate(URL)
+    fh = File.validate(URL)
+
+    assert str(path).endswith(".png")
+    assert path.read_bytes() == b"image"
+    assert fh.read() == b"image"
+    assert [call.response.status_code for call in responses.calls] == [200, 304]
@@ -4,9 +4,11 @@ import tempfile
 
 import cog
 from cog.files import upload_file
-from cog.json import make_encodeable, upload_files
+from cog.json import dumps, encode_json, make_encodeable, upload_files
+import cog.response
 import numpy as np
 from pydantic import BaseModel
+import pytest
 
 
 def test_make_encodeable_recursively_encodes_tuples():
@@ -68,3 +70,46 @@ def test_numpy():
         "npfloat": 1.3,
         "npinteger": 5,
     }
+
+
+def test_encode_json_uploads_files_and_encodes_models():
+    class Model(BaseModel):
+        path: cog.Path
+        numbers: tuple
+        text: str = "unset"
+
+    temp_dir = tempfile.mkdtemp()
+    temp_path = os.path.join(temp_dir, "my_file.txt")
+    with open(temp_path, "w") as fh:
+        fh.write("file content")
+    model = Model(path=cog.Path(temp_path), numbers=(np.float32(0.5), np.int64(2)))
+    result = encode_json(model, upload_file)
+    assert result == {
+        "path": "data:text/plain;base64,ZmlsZSBjb250ZW50",
+        "numbers": [0.5, 2],
+    }
+    assert [type(n) for n in result["numbers"]] == [float, int]
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps_numpy(monkeypatch, use_orjson):
+    if use_orjson and not cog.json.has_orjson:
+        pytest.skip("orjson isn't installed")
+    monkeypatch.setattr(cog.json, "has_orjson", use_orjson)
+
+    obj = encode_json(
+        {
+            "ndarray": np.array([[1, 2], [3, 4]]),
+            # not contiguous, so orjson can't serialise it by itself
+            "transposed": np.array([[1.5, 2.5], [3.5, 4.5]]).T,
+            "objects": np.array(["a", None], dtype=object),
+            "status": cog.response.Status.SUCCEEDED,
+        },
+        upload_file,
+    )
+    assert json.loads(dumps(obj)) == {
+        "ndarray": [[1, 2], [3, 4]],
+        "transposed": [[1.5, 3.5], [2.5, 4.5]],
+        "objects": ["a", None],
+        "status": "succeeded",
+    }
@@ -0,0 +1,14 @@
+import os
+
+from cog import BasePredictor
+
+# it's still there once the predictor has been restarted
+CRASHED_MARKER = "/tmp/crashed"
+
+
+class Predictor(BasePredictor):
+    def predict(self, text: str) -> str:
+        if not os.path.exists(CRASHED_MARKER):
+            open(CRASHED_MARKER, "w").close()
+            os._exit(1)
+        return "hello " + text
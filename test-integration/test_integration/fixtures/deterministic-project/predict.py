@@ -0,0 +1,11 @@
+import time
+
+from cog import BasePredictor
+
+
+class Predictor(BasePredictor):
+    deterministic = True
+
+    def predict(self, sleep_time: float) -> str:
+        time.sleep(sleep_time)
+        return f"it worked after {sleep_time} seconds!"
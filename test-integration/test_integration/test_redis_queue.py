@@ -1494,6 +1494,521 @@ def test_queue_worker_redis_responses(docker_network, docker_image, redis_client
         }
 
 
+def test_queue_worker_dead_letter(
+    docker_network, docker_image, redis_client, httpserver
+):
+    project_dir = Path(__file__).parent / "fixtures/int-project"
+    subprocess.run(["cog", "build", "-t", docker_image], check=True, cwd=project_dir)
+
+    redis_client.xgroup_create(
+        mkstream=True, groupname="predict-queue", name="predict-queue", id="$"
+    )
+
+    predict_id = random_string(10)
+    webhook_url = httpserver.url_for("/webhook").replace(
+        "localhost", "host.docker.internal"
+    )
+    message_id = redis_client.xadd(
+        name="predict-queue",
+        fields={
+            "value": json.dumps(
+                {
+                    "id": predict_id,
+                    "input": {
+                        "num": 42,
+                    },
+                    "webhook": webhook_url,
+                }
+            ),
+        },
+    )
+
+    # simulate a message that has already crashed three workers
+    redis_client.xreadgroup(
+        groupname="predict-queue",
+        consumername="crashed-worker",
+        streams={"predict-queue": ">"},
+        count=1,
+    )
+    redis_client.xclaim(
+        name="predict-queue",
+        groupname="predict-queue",
+        consumername="crashed-worker",
+        min_idle_time=0,
+        message_ids=[message_id],
+        idle=60 * 60 * 1000,
+        retrycount=3,
+    )
+
+    httpserver.expect_oneshot_request(
+        "/webhook",
+        json={
+            "error": mock.ANY,
+            "logs": [],
+            "output": None,
+            "status": "failed",
+        },
+        method="POST",
+    )
+
+    with docker_run(
+        image=docker_image,
+        interactive=True,
+        network=docker_network,
+        command=[
+            "python",
+            "-m",
+            "cog.server.redis_queue",
+            "redis",
+            "6379",
+            "predict-queue",
+            "",
+            "test-worker",
+            "model_id",
+            "logs",
+            "",
+            "3",
+        ],
+    ):
+        with httpserver.wait(timeout=30) as waiting:
+            pass
+
+        assert waiting.result
+
+        # the message is acked just after the response is sent
+        time.sleep(1)
+
+    dead_letters = redis_client.xrange("predict-queue-dead-letter")
+    assert len(dead_letters) == 1
+    _, fields = dead_letters[0]
+    assert fields[b"message_id"] == message_id
+    assert json.loads(fields[b"value"])["id"] == predict_id
+
+    assert redis_client.xpending(name="predict-queue", groupname="predict-queue")[
+        "pending"
+    ] == 0
+
+
+def test_queue_worker_dead_letter_releases_coalesced_messages(
+    docker_network, docker_image, redis_client
+):
+    project_dir = Path(__file__).parent / "fixtures/deterministic-project"
+    subprocess.run(["cog", "build", "-t", docker_image], check=True, cwd=project_dir)
+
+    redis_client.xgroup_create(
+        mkstream=True, groupname="predict-queue", name="predict-queue", id="$"
+    )
+
+    message_id = redis_client.xadd(
+        name="predict-queue",
+        fields={
+            "value": json.dumps(
+                {
+                    "id": random_string(10),
+                    "input": {"sleep_time": 0.1},
+                    "response_queue": "response-queue-1",
+                }
+            ),
+        },
+    )
+
+    # simulate a message that has already crashed three workers, while it
+    # held the lease that an identical message is waiting on
+    redis_client.xreadgroup(
+        groupname="predict-queue",
+        consumername="crashed-worker",
+        streams={"predict-queue": ">"},
+        count=1,
+    )
+    redis_client.xclaim(
+        name="predict-queue",
+        groupname="predict-queue",
+        consumername="crashed-worker",
+        min_idle_time=0,
+        message_ids=[message_id],
+        idle=60 * 60 * 1000,
+        retrycount=3,
+    )
+    redis_client.set(b"cog-in-flight-message:" + message_id, "prediction-key")
+    redis_client.set("cog-in-flight:prediction-key", message_id)
+    redis_client.rpush(
+        "cog-in-flight:prediction-key:waiters",
+        json.dumps({"response_queue": "response-queue-2"}),
+    )
+
+    with docker_run(
+        image=docker_image,
+        interactive=True,
+        network=docker_network,
+        command=queue_worker_command("test-worker") + ["", "3"],
+    ):
+        first = wait_for_response(redis_client, "response-queue-1", "failed")
+        second = wait_for_response(redis_client, "response-queue-2", "failed")
+
+    assert second == first
+    assert redis_client.keys("cog-in-flight*") == []
+
+
+def test_queue_worker_restarts_crashed_predictor(
+    docker_network, docker_image, redis_client
+):
+    project_dir = Path(__file__).parent / "fixtures/crashing-project"
+    subprocess.run(["cog", "build", "-t", docker_image], check=True, cwd=project_dir)
+
+    redis_client.xgroup_create(
+        mkstream=True, groupname="predict-queue", name="predict-queue", id="$"
+    )
+
+    # messages are retried 2 + 30 seconds after they were received
+    with docker_run(
+        image=docker_image,
+        interactive=True,
+        network=docker_network,
+        command=queue_worker_command("test-worker", predict_timeout=2),
+    ):
+        wait_for_setup(redis_client, workers=1)
+
+        # the first message crashes the predictor
+        add_message(redis_client, {"text": "first"}, "response-queue-1")
+        add_message(redis_client, {"text": "second"}, "response-queue-2")
+
+        # the next message runs once it's been restarted
+        second = wait_for_response(redis_client, "response-queue-2", "succeeded")
+        assert second["output"] == "hello second"
+        # and the one that crashed it is retried instead of failing
+        first = wait_for_response(
+            redis_client, "response-queue-1", "succeeded", timeout=90
+        )
+        assert first["output"] == "hello first"
+
+    assert redis_client.xlen("predict-queue-dead-letter") == 0
+    assert (
+        redis_client.xpending(name="predict-queue", groupname="predict-queue")[
+            "pending"
+        ]
+        == 0
+    )
+
+
+def test_queue_worker_expired_message(
+    docker_network, docker_image, redis_client, httpserver
+):
+    project_dir = Path(__file__).parent / "fixtures/int-project"
+    subprocess.run(["cog", "build", "-t", docker_image], check=True, cwd=project_dir)
+
+    with docker_run(
+        image=docker_image,
+        interactive=True,
+        network=docker_network,
+        command=[
+            "python",
+            "-m",
+            "cog.server.redis_queue",
+            "redis",
+            "6379",
+            "predict-queue",
+            "",
+            "test-worker",
+            "model_id",
+            "logs",
+        ],
+    ):
+        httpserver.expect_oneshot_request(
+            "/webhook",
+            json={
+                "error": "Prediction expired before it started",
+                "logs": [],
+                "output": None,
+                "status": "failed",
+            },
+            method="POST",
+        )
+
+        redis_client.xgroup_create(
+            mkstream=True, groupname="predict-queue", name="predict-queue", id="$"
+        )
+
+        predict_id = random_string(10)
+        webhook_url = httpserver.url_for("/webhook").replace(
+            "localhost", "host.docker.internal"
+        )
+
+        with httpserver.wait(timeout=15) as waiting:
+            redis_client.xadd(
+                name="predict-queue",
+                fields={
+                    "value": json.dumps(
+                        {
+                            "id": predict_id,
+                            "input": {
+                                "num": 42,
+                            },
+                            "webhook": webhook_url,
+                            "deadline": time.time() - 1,
+                        }
+                    ),
+                },
+            )
+
+        # check we received all the webhooks
+        assert waiting.result
+
+
+def test_queue_worker_invalid_deadline(
+    docker_network, docker_image, redis_client, httpserver
+):
+    project_dir = Path(__file__).parent / "fixtures/int-project"
+    subprocess.run(["cog", "build", "-t", docker_image], check=True, cwd=project_dir)
+
+    with docker_run(
+        image=docker_image,
+        interactive=True,
+        network=docker_network,
+        command=[
+            "python",
+            "-m",
+            "cog.server.redis_queue",
+            "redis",
+            "6379",
+            "predict-queue",
+            "",
+            "test-worker",
+            "model_id",
+            "logs",
+        ],
+    ):
+        httpserver.expect_oneshot_request(
+            "/webhook",
+            json={
+                "error": "Invalid deadline, it must be a number: 'tomorrow'",
+                "logs": [],
+                "output": None,
+                "status": "failed",
+            },
+            method="POST",
+        )
+
+        redis_client.xgroup_create(
+            mkstream=True, groupname="predict-queue", name="predict-queue", id="$"
+        )
+
+        predict_id = random_string(10)
+        webhook_url = httpserver.url_for("/webhook").replace(
+            "localhost", "host.docker.internal"
+        )
+
+        with httpserver.wait(timeout=15) as waiting:
+            redis_client.xadd(
+                name="predict-queue",
+                fields={
+                    "value": json.dumps(
+                        {
+                            "id": predict_id,
+                            "input": {
+                                "num": 42,
+                            },
+                            "webhook": webhook_url,
+                            "deadline": "tomorrow",
+                        }
+                    ),
+                },
+            )
+
+        assert waiting.result
+        # it was acked, so it isn't redelivered
+        assert (
+            redis_client.xpending(name="predict-queue", groupname="predict-queue")[
+                "pending"
+            ]
+            == 0
+        )
+
+
+def test_queue_worker_coalesces_identical_messages(
+    docker_network, docker_image, redis_client
+):
+    project_dir = Path(__file__).parent / "fixtures/deterministic-project"
+    subprocess.run(["cog", "build", "-t", docker_image], check=True, cwd=project_dir)
+
+    redis_client.xgroup_create(
+        mkstream=True, groupname="predict-queue", name="predict-queue", id="$"
+    )
+
+    with docker_run(
+        image=docker_image,
+        interactive=True,
+        network=docker_network,
+        command=queue_worker_command("worker-1"),
+    ), docker_run(
+        image=docker_image,
+        interactive=True,
+        network=docker_network,
+        command=queue_worker_command("worker-2"),
+    ):
+        wait_for_setup(redis_client, workers=2)
+
+        add_message(redis_client, {"sleep_time": 5}, "response-queue-1")
+        wait_for_response(redis_client, "response-queue-1", "processing")
+        # the other worker receives this while the first is running
+        add_message(redis_client, {"sleep_time": 5}, "response-queue-2")
+
+        first = wait_for_response(redis_client, "response-queue-1", "succeeded")
+        second = wait_for_response(redis_client, "response-queue-2", "succeeded")
+
+    # it got the responses from the first prediction instead of running again
+    assert first["output"] == "it worked after 5.0 seconds!"
+    assert second == first
+    assert redis_client.keys("cog-in-flight:*") == []
+
+
+def test_queue_worker_retries_coalesced_message_after_crash(
+    docker_network, docker_image, redis_client
+):
+    project_dir = Path(__file__).parent / "fixtures/deterministic-project"
+    subprocess.run(["cog", "build", "-t", docker_image], check=True, cwd=project_dir)
+
+    redis_client.xgroup_create(
+        mkstream=True, groupname="predict-queue", name="predict-queue", id="$"
+    )
+
+    crashing_worker = "crashing-worker-" + random_string(10)
+    # messages are retried 10 + 30 seconds after the worker stops responding
+    with docker_run(
+        image=docker_image,
+        name=crashing_worker,
+        interactive=True,
+        network=docker_network,
+        command=queue_worker_command("worker-1", predict_timeout=10),
+    ):
+        wait_for_setup(redis_client, workers=1)
+        add_message(redis_client, {"sleep_time": 5}, "response-queue-1")
+        wait_for_response(redis_client, "response-queue-1", "processing")
+
+        with docker_run(
+            image=docker_image,
+            interactive=True,
+            network=docker_network,
+            command=queue_worker_command("worker-2", predict_timeout=10),
+        ):
+            wait_for_setup(redis_client, workers=2)
+            add_message(redis_client, {"sleep_time": 5}, "response-queue-2")
+            wait_for_waiters(redis_client, 1)
+
+            subprocess.run(["docker", "rm", "--force", crashing_worker], check=True)
+
+            # the retry takes over the lease it had, and the waiter
+            first = wait_for_response(
+                redis_client, "response-queue-1", "succeeded", timeout=90
+            )
+            second = wait_for_response(redis_client, "response-queue-2", "succeeded")
+
+    assert first["output"] == "it worked after 5.0 seconds!"
+    assert second == first
+    assert redis_client.keys("cog-in-flight:*") == []
+    assert (
+        redis_client.xpending(name="predict-queue", groupname="predict-queue")[
+            "pending"
+        ]
+        == 0
+    )
+
+
+def test_queue_worker_releases_coalesced_messages(
+    docker_network, docker_image, redis_client
+):
+    project_dir = Path(__file__).parent / "fixtures/deterministic-project"
+    subprocess.run(["cog", "build", "-t", docker_image], check=True, cwd=project_dir)
+
+    redis_client.xgroup_create(
+        mkstream=True, groupname="predict-queue", name="predict-queue", id="$"
+    )
+
+    with docker_run(
+        image=docker_image,
+        interactive=True,
+        network=docker_network,
+        command=queue_worker_command("worker-1"),
+    ):
+        wait_for_setup(redis_client, workers=1)
+
+        add_message(redis_client, {"sleep_time": 0.1}, "response-queue-1")
+        wait_for_response(redis_client, "response-queue-1", "succeeded")
+        assert redis_client.keys("cog-in-flight:*") == []
+
+        # failed predictions aren't cached, so this runs twice, and the
+        # second doesn't get stuck waiting for the first
+        add_message(redis_client, {"sleep_time": -1}, "response-queue-2")
+        wait_for_response(redis_client, "response-queue-2", "failed")
+        assert redis_client.keys("cog-in-flight:*") == []
+
+        add_message(redis_client, {"sleep_time": -1}, "response-queue-3")
+        wait_for_response(redis_client, "response-queue-3", "failed")
+        assert redis_client.keys("cog-in-flight:*") == []
+
+
+def queue_worker_command(consumer_id, predict_timeout=None):
+    command = [
+        "python",
+        "-m",
+        "cog.server.redis_queue",
+        "redis",
+        "6379",
+        "predict-queue",
+        "",
+        consumer_id,
+        "model_id",
+        "logs",
+    ]
+    if predict_timeout is not None:
+        command.append(str(predict_timeout))
+    return command
+
+
+def add_message(redis_client, inputs, response_queue):
+    redis_client.xadd(
+        name="predict-queue",
+        fields={
+            "value": json.dumps(
+                {
+                    "id": random_string(10),
+                    "input": inputs,
+                    "response_queue": response_queue,
+                }
+            ),
+        },
+    )
+
+
+def wait_for_setup(redis_client, workers, timeout=60):
+    start = time.time()
+    while redis_client.xlen("predict-queue-setup-time") < workers:
+        if time.time() - start > timeout:
+            raise TimeoutError("Timed out waiting for workers to set up")
+        time.sleep(0.1)
+
+
+def wait_for_response(redis_client, response_queue, status, timeout=30):
+    start = time.time()
+    while time.time() - start < timeout:
+        value = redis_client.get(response_queue)
+        if value is not None:
+            response = json.loads(value)
+            if response["status"] == status:
+                return response
+        time.sleep(0.1)
+    raise TimeoutError(f"Timed out waiting for a {status} response")
+
+
+def wait_for_waiters(redis_client, count, timeout=30):
+    start = time.time()
+    while time.time() - start < timeout:
+        for key in redis_client.keys("cog-in-flight:*:waiters"):
+            if redis_client.llen(key) == count:
+                return
+        time.sleep(0.1)
+    raise TimeoutError("Timed out waiting for a message to attach")
+
+
 def response_iterator(redis_client, response_queue, timeout=10):
     redis_client.config_set("notify-keyspace-events", "KEA")
     channel = redis_client.pubsub()